@@ -0,0 +1,202 @@
+"""
+Incremental assembly of chunked videos.
+
+Chunks finish out of order. As soon as every chunk before one has arrived,
+its segments are cut the same way video_stitcher.stitch_chunks cuts them
+(keyframe runs stream-copied, seam windows re-encoded), and a fragmented MP4
+preview of everything so far is republished. The preview is remuxed from the
+segment list each time (stream copy, milliseconds), so every published
+preview is a complete file that players can start on before it is fully
+downloaded. All ffmpeg work runs as asyncio subprocesses, keeping the event
+loop free, and the final video is a single remux once the last chunk lands.
+"""
+
+import asyncio
+import logging
+import os
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Callable, Tuple
+
+from . import metrics
+from .video_stitcher import (
+    CROSSFADE_FRAMES, FFMPEG, probe_args, parse_probe, prepare_clips, plan_clip, full_reencode_plan,
+    segment_args, segment_frames, write_concat_list, concat_args, stitch_chunks,
+)
+
+logger = logging.getLogger(__name__)
+
+# Fragmented, so a player can start on the preview before it is fully downloaded
+PREVIEW_MOVFLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+# Called with (preview_path, seconds of video in it)
+PreviewCallback = Callable[[Path, float], None]
+
+
+async def run_ffmpeg_async(args: List[str]) -> bytes:
+    """Run ffmpeg without blocking the event loop; raises CalledProcessError on failure"""
+    cmd = FFMPEG + args
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return stdout
+
+
+class IncrementalAssembler:
+    """Builds a job's video from its chunks while the remaining chunks are still generating"""
+
+    def __init__(self, chunks: List[Dict[str, Any]], work_dir: Path, preview_path: Optional[Path] = None,
+                 fps: int = 16, crossfade_frames: int = CROSSFADE_FRAMES,
+                 on_preview: Optional[PreviewCallback] = None):
+        """
+        Args:
+            chunks: The job's chunk plan (from calculate_chunks)
+            work_dir: Scratch dir for segments; must outlive the chunk files
+            preview_path: Where to publish the growing preview (None = no preview)
+            on_preview: Told about each new preview
+        """
+        self.clips = prepare_clips(chunks)
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.preview_path = Path(preview_path) if preview_path else None
+        self.fps = fps
+        self.crossfade_frames = crossfade_frames
+        self.on_preview = on_preview
+        self.arrived: Dict[int, Path] = {}
+        # Index of the next clip to plan; everything before it is in self.files
+        self.next_index = 0
+        self.window: List[Tuple[int, int, int]] = []
+        self.files: List[Path] = []
+        self.frames = 0
+        self.timescale = 0
+        self.failed = False
+        self._segment_count = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def seconds_ready(self) -> float:
+        return self.frames / self.fps
+
+    def add(self, chunk_id: int, path: Path):
+        """Hand over a finished chunk. Returns at once; assembly continues in the background."""
+        if chunk_id in self.arrived:
+            # A speculative copy finished too; the first one is already in use
+            return
+        self.arrived[chunk_id] = Path(path)
+        if not self.failed and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        # No await between the final check and returning, so add() never misses a wakeup
+        while not self.failed and self.next_index < len(self.clips) \
+                and self.clips[self.next_index]["chunk_id"] in self.arrived:
+            i = self.next_index
+            clip = self.clips[i]
+            clip["path"] = self.arrived[clip["chunk_id"]]
+            try:
+                clip["frame_count"], clip["keyframes"], self.timescale = parse_probe(
+                    await run_ffmpeg_async(probe_args(clip["path"])), self.fps, clip["path"])
+                if self.crossfade_frames and clip["frame_count"] < 2 * self.crossfade_frames:
+                    raise ValueError(f"chunk {clip['chunk_id']} is too short to crossfade")
+                segments, self.window = plan_clip(self.clips, i, self.crossfade_frames, self.window)
+                await self._append(segments)
+                self.next_index += 1
+                if segments:
+                    await self._publish_preview()
+            except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                # finish() falls back to a one-shot stitch
+                error = e.stderr.decode(errors="replace").strip() if isinstance(e, subprocess.CalledProcessError) else e
+                logger.debug("Incremental assembly stopped at chunk %s: %s", clip['chunk_id'], error)
+                self.failed = True
+
+    async def _append(self, segments: List[Tuple]):
+        for segment in segments:
+            segment_path = self.work_dir / f"segment_{self._segment_count:03d}.mp4"
+            self._segment_count += 1
+            args = segment_args(self.clips, segment, segment_path, self.fps, self.crossfade_frames,
+                                self.timescale)
+            if args is None:
+                segment_path = self.clips[segment[1]]["path"]
+            else:
+                with metrics.span("seam_encode", segment=segment[0]):
+                    await run_ffmpeg_async(args)
+            self.files.append(segment_path)
+            self.frames += segment_frames(self.clips, segment, self.crossfade_frames)
+
+    async def _publish_preview(self):
+        if self.preview_path is None:
+            return
+        concat_file = self.work_dir / "preview_list.txt"
+        partial_path = self.preview_path.with_name(self.preview_path.name + ".part")
+        write_concat_list(self.files, concat_file)
+        try:
+            with metrics.span("preview", files=len(self.files)):
+                await run_ffmpeg_async(concat_args(concat_file, partial_path, movflags=PREVIEW_MOVFLAGS))
+            os.replace(partial_path, self.preview_path)
+        except (subprocess.CalledProcessError, OSError) as e:
+            # Only the preview is lost; the segments are still good
+            logger.debug("Preview update failed: %s", e)
+            return
+        logger.debug("Preview updated: %.1fs of video", self.seconds_ready)
+        if self.on_preview is not None:
+            try:
+                self.on_preview(self.preview_path, self.seconds_ready)
+            except Exception as e:
+                logger.debug("preview callback failed: %s", e)
+
+    async def finish(self, output_path: Path) -> Optional[Path]:
+        """Close the last seam and write the final video (a faststart MP4)"""
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if self._task is not None:
+            await self._task
+        try:
+            if len(self.arrived) != len(self.clips):
+                missing = [clip["chunk_id"] for clip in self.clips if clip["chunk_id"] not in self.arrived]
+                logger.error("Cannot assemble video, chunks missing: %s", missing)
+                return None
+            if self.failed:
+                clips = [dict(clip, path=self.arrived[clip["chunk_id"]]) for clip in self.clips]
+                return await asyncio.to_thread(stitch_chunks, clips, output_path, self.fps, self.crossfade_frames)
+            try:
+                if self.window:
+                    await self._append([("encode", self.window)])
+                    self.window = []
+            except subprocess.CalledProcessError as e:
+                logger.debug("Final seam failed (%s); re-encoding all %s chunks",
+                             e.stderr.decode(errors='replace').strip(), len(self.clips))
+                self.files, self.frames = [], 0
+                await self._append(full_reencode_plan(self.clips, self.crossfade_frames))
+            concat_file = self.work_dir / "concat_list.txt"
+            partial_path = output_path.with_name(output_path.name + ".part")
+            write_concat_list(self.files, concat_file)
+            with metrics.span("stitch", chunks=len(self.clips)):
+                await run_ffmpeg_async(concat_args(concat_file, partial_path))
+            os.replace(partial_path, output_path)
+            return output_path
+        except subprocess.CalledProcessError as e:
+            logger.error("FFmpeg error: %s", e.stderr.decode(errors='replace') if e.stderr else 'Unknown error')
+            return None
+        finally:
+            self.discard_preview()
+
+    async def abort(self):
+        """Stop background work and remove the preview (job failed or was cancelled)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.discard_preview()
+
+    def discard_preview(self):
+        if self.preview_path is not None:
+            self.preview_path.unlink(missing_ok=True)
+            self.preview_path.with_name(self.preview_path.name + ".part").unlink(missing_ok=True)
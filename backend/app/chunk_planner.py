@@ -0,0 +1,208 @@
+"""
+Chunk sizing for the parallel generator.
+
+A job of 4K + 1 frames is cut into chunks that share one frame at each seam.
+Every chunk is itself 4k + 1 frames (Wan's length constraint), so the chunks'
+k always add up to K. More chunks mean more parallelism, but each one also
+pays a fixed cost: queueing, text and vision encoding, download, and one more
+seam to stitch.
+
+The planner scores candidate cuts by simulating the dispatcher. Chunks go out
+in order, each to the worker that would finish it first, using the worker's
+measured seconds per frame plus any model reload, another job's running
+chunk or foreign queue backlog. It keeps the cut with the smallest makespan.
+Near-ties go to fewer chunks.
+
+Candidates are even cuts into n chunks, and speed-proportional cuts. In a
+speed-proportional cut, each of the m fastest workers gets r chunks, sized
+so that they all finish together. In chaining mode each chunk waits for the
+previous one, and the simulation honours that.
+"""
+
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .dispatcher import MODEL_RELOAD_SECONDS, worker_seconds_per_frame
+from .workflow_template import MIN_FRAMES
+
+# Fixed seconds each chunk costs on top of its frames (queue, encoders, download, seam)
+CHUNK_OVERHEAD_SECONDS = float(os.getenv("PIXELDOJO_CHUNK_OVERHEAD", "15"))
+# Longest chunk to generate; Wan 2.1 is trained on 81-frame clips and drifts on longer ones
+MAX_CHUNK_FRAMES = int(os.getenv("PIXELDOJO_MAX_CHUNK_FRAMES", "81"))
+# Plans within this fraction of the best makespan count as ties, settled by fewer chunks
+MAKESPAN_TOLERANCE = 0.02
+# Even cuts are tried up to this many chunks per worker beyond the minimum count
+MAX_EXTRA_WAVES = 4
+
+
+@dataclass
+class WorkerEstimate:
+    """What the planner knows about one worker"""
+    name: str
+    seconds_per_frame: float
+    # Seconds before it could start our first chunk (model reload, other clients' prompts)
+    ready_in: float = 0.0
+
+
+@dataclass
+class ChunkPlan:
+    frame_counts: List[int]
+    # Simulated seconds until the last chunk is done, and which worker ran which chunks
+    makespan: float
+    assignment: Dict[str, List[int]]
+
+    def chunks(self) -> List[Dict[str, Any]]:
+        """Chunk dicts for the dispatcher and stitcher (neighbours share one frame)"""
+        chunks = []
+        start = 0
+        for chunk_id, frame_count in enumerate(self.frame_counts):
+            end = start + frame_count
+            chunks.append({
+                "chunk_id": chunk_id,
+                "start_frame": start,
+                "end_frame": end,
+                "frame_count": frame_count,
+                "is_first": chunk_id == 0,
+                "is_last": chunk_id == len(self.frame_counts) - 1,
+            })
+            start = end - 1
+        return chunks
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-friendly view for the job status"""
+        return {
+            "chunk_frames": list(self.frame_counts),
+            "estimated_seconds": round(self.makespan, 1),
+            "workers": {name: ids for name, ids in self.assignment.items() if ids},
+        }
+
+
+def estimate_workers(workers: Sequence[Any], model_key: Optional[str] = None,
+                     overhead: float = CHUNK_OVERHEAD_SECONDS,
+                     max_chunk_frames: int = MAX_CHUNK_FRAMES) -> List[WorkerEstimate]:
+    """WorkerEstimates for ComfyWorkers, with the same reload and backlog rules as the dispatcher"""
+    estimates = []
+    now = time.time()
+    for worker in workers:
+        seconds_per_frame = worker_seconds_per_frame(worker)
+        ready_in = worker.queue_depth * (overhead + max_chunk_frames * seconds_per_frame)
+        if worker.busy:
+            # Running another job's chunk
+            ready_in += max(0.0, worker.busy_until - now)
+        if model_key is not None and worker.loaded_model != model_key:
+            ready_in += MODEL_RELOAD_SECONDS
+        estimates.append(WorkerEstimate(worker.name, seconds_per_frame, ready_in))
+    return estimates
+
+
+def simulate(frame_counts: Sequence[int], workers: Sequence[WorkerEstimate], overhead: float,
+             chained: bool = False) -> Tuple[float, Dict[str, List[int]]]:
+    """Makespan and worker -> chunk ids when chunks go out in order to the earliest finisher"""
+    free_at = {worker.name: worker.ready_in for worker in workers}
+    assignment: Dict[str, List[int]] = {worker.name: [] for worker in workers}
+    previous_done = 0.0
+    makespan = 0.0
+    for chunk_id, frames in enumerate(frame_counts):
+        earliest = previous_done if chained else 0.0
+
+        def finish(worker: WorkerEstimate) -> float:
+            return max(free_at[worker.name], earliest) + overhead + frames * worker.seconds_per_frame
+
+        best = min(workers, key=lambda worker: (finish(worker), worker.seconds_per_frame))
+        done = finish(best)
+        free_at[best.name] = previous_done = done
+        assignment[best.name].append(chunk_id)
+        makespan = max(makespan, done)
+    return makespan, assignment
+
+
+def fit_units(weights: Sequence[float], total: int, low: int, high: int) -> Optional[List[int]]:
+    """
+    Split total into integers proportional to weights, each within [low, high].
+
+    Largest-remainder rounding; None if the bounds cannot add up to total.
+    """
+    count = len(weights)
+    if count == 0 or count * low > total or count * high < total:
+        return None
+    weight_sum = sum(weights)
+    ideal = [total * weight / weight_sum for weight in weights]
+    units = [min(high, max(low, int(value))) for value in ideal]
+    diff = total - sum(units)
+    while diff > 0:
+        i = max((i for i in range(count) if units[i] < high), key=lambda i: ideal[i] - units[i])
+        units[i] += 1
+        diff -= 1
+    while diff < 0:
+        i = min((i for i in range(count) if units[i] > low), key=lambda i: ideal[i] - units[i])
+        units[i] -= 1
+        diff += 1
+    return units
+
+
+def _candidate_weights(total_frames: int, workers: Sequence[WorkerEstimate], overhead: float,
+                       min_chunks: int, max_chunks: int) -> Iterator[List[float]]:
+    # Even cuts
+    for count in range(min_chunks, max_chunks + 1):
+        yield [1.0] * count
+    # Speed-proportional cuts over the m fastest workers, r waves each
+    ranked = sorted(workers, key=lambda worker: worker.seconds_per_frame)
+    for m in range(1, len(ranked) + 1):
+        group = ranked[:m]
+        speed = sum(1 / worker.seconds_per_frame for worker in group)
+        for waves in range(max(1, math.ceil(min_chunks / m)), max_chunks // m + 1):
+            # All of the group finish at the same moment T
+            finish = (total_frames + sum((worker.ready_in + waves * overhead) / worker.seconds_per_frame
+                                         for worker in group)) / speed
+            shares = [(finish - worker.ready_in - waves * overhead) / worker.seconds_per_frame / waves
+                      for worker in group]
+            if min(shares) <= 0:
+                continue
+            # Wave by wave, the biggest chunk (for the fastest worker) first
+            yield shares * waves
+
+
+def plan_chunks(total_frames: int, workers: Sequence[WorkerEstimate], overhead: float = CHUNK_OVERHEAD_SECONDS,
+                max_chunk_frames: int = MAX_CHUNK_FRAMES, chained: bool = False) -> ChunkPlan:
+    """Cut total_frames (4K + 1) into 4k + 1 frame chunks with the shortest simulated makespan"""
+    units_total = max(0, (total_frames - 1) // 4)
+    low = (MIN_FRAMES - 1) // 4
+    high = max(low, (max_chunk_frames - 1) // 4)
+    if not workers:
+        raise ValueError("Chunk planning needs at least one worker")
+    if units_total <= low:
+        # Too short to split
+        frame_counts = [4 * units_total + 1]
+        makespan, assignment = simulate(frame_counts, workers, overhead, chained)
+        return ChunkPlan(frame_counts, makespan, assignment)
+
+    min_chunks = math.ceil(units_total / high)
+    max_chunks = min(units_total // low, min_chunks + MAX_EXTRA_WAVES * len(workers))
+    scored = []
+    seen = set()
+    for weights in _candidate_weights(4 * units_total, workers, overhead, min_chunks, max_chunks):
+        units = fit_units(weights, units_total, low, high)
+        if units is None or tuple(units) in seen:
+            continue
+        seen.add(tuple(units))
+        frame_counts = [4 * unit + 1 for unit in units]
+        makespan, assignment = simulate(frame_counts, workers, overhead, chained)
+        scored.append((makespan, frame_counts, assignment))
+
+    if not scored:
+        # No cut keeps every chunk within [MIN_FRAMES, max_chunk_frames] (a short clip
+        # with a small max): split evenly and let the chunks run short instead
+        units = fit_units([1.0] * min_chunks, units_total, 1, high)
+        frame_counts = [4 * unit + 1 for unit in units]
+        makespan, assignment = simulate(frame_counts, workers, overhead, chained)
+        return ChunkPlan(frame_counts, makespan, assignment)
+
+    best = min(makespan for makespan, _, _ in scored)
+    makespan, frame_counts, assignment = min(
+        (entry for entry in scored if entry[0] <= best * (1 + MAKESPAN_TOLERANCE)),
+        key=lambda entry: (len(entry[1]), entry[0]),
+    )
+    return ChunkPlan(frame_counts, makespan, assignment)
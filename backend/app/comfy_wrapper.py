@@ -1,43 +1,191 @@
+import logging
 import subprocess
+import threading
 import time
 import requests
 import json
 import os
+import uuid
+import aiohttp
+import asyncio
 from typing import Optional, Dict, Any
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .completion_tracker import CompletionTracker, AsyncCompletionTracker
+from .upload_cache import UploadCache, sha256_file, content_filename
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Connection pool and retry defaults, overridable per deployment
+# Keep the pool at least as large as the frame download workers (COMFYUI_FRAME_WORKERS)
+DEFAULT_POOL_SIZE = int(os.getenv("COMFYUI_POOL_SIZE", "10"))
+DEFAULT_RETRIES = int(os.getenv("COMFYUI_RETRIES", "2"))
+DEFAULT_RETRY_BACKOFF = float(os.getenv("COMFYUI_RETRY_BACKOFF", "0.3"))
+
+# How long a successful response vouches for ComfyUI being up, and how often
+# the optional background heartbeat probes it (0 disables the heartbeat)
+DEFAULT_HEALTH_TTL = float(os.getenv("COMFYUI_HEALTH_TTL", "15"))
+DEFAULT_HEARTBEAT_INTERVAL = float(os.getenv("COMFYUI_HEARTBEAT_INTERVAL", "0"))
+
+
+class _CountingRetry(Retry):
+    """Retry policy that counts each retry in pixeldojo_comfyui_retries_total"""
+
+    def increment(self, *args, **kwargs):
+        new_retry = super().increment(*args, **kwargs)
+        metrics.COMFYUI_RETRIES.inc()
+        return new_retry
+
+
+def _count_response(response, *args, **kwargs):
+    metrics.COMFYUI_REQUESTS.inc(endpoint=metrics.endpoint_label(response.request.path_url))
+
+
+async def _count_request(session, context, params):
+    metrics.COMFYUI_REQUESTS.inc(endpoint=metrics.endpoint_label(params.url.path))
+
+
+def build_session(pool_size: int = DEFAULT_POOL_SIZE, retries: int = DEFAULT_RETRIES,
+                  backoff: float = DEFAULT_RETRY_BACKOFF) -> requests.Session:
+    """
+    Create a keep-alive requests session with a bounded connection pool.
+    
+    Connection errors are retried for every method. Read errors and gateway
+    statuses (common on RunPod proxies) are only retried for idempotent
+    methods, so a POST /prompt is never queued twice.
+    """
+    retry = _CountingRetry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(_count_response)
+    return session
+
+
+def build_async_session(pool_size: int = DEFAULT_POOL_SIZE, keepalive: float = 60) -> aiohttp.ClientSession:
+    """Create a pooled keep-alive aiohttp session (must be called inside a running loop)"""
+    connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size, keepalive_timeout=keepalive)
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_count_request)
+    return aiohttp.ClientSession(connector=connector, trace_configs=[trace])
 
 
 class ComfyUIWrapper:
     """Wrapper for managing ComfyUI instance and API interactions"""
     
-    def __init__(self, comfyui_path: str = "comfyui", port: int = 8188):
+    def __init__(self, comfyui_path: str = "comfyui", port: int = 8188, pool_size: int = DEFAULT_POOL_SIZE,
+                 retries: int = DEFAULT_RETRIES, retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+                 health_ttl: float = DEFAULT_HEALTH_TTL):
         self.comfyui_path = Path(comfyui_path)
         self.port = port
         # Allow overriding URL for cloud/remote instances
         self.base_url = os.getenv("COMFYUI_URL", f"http://127.0.0.1:{port}")
         self.process: Optional[subprocess.Popen] = None
-        self.client_id = "pixeldojo-client"
+        # One pooled session so calls reuse TCP/TLS connections
+        self.session = build_session(pool_size, retries, retry_backoff)
+        # Unique per process so ComfyUI routes our prompt events to our socket
+        self.client_id = f"pixeldojo-{uuid.uuid4().hex[:12]}"
+        self.tracker = CompletionTracker(self.base_url, self.client_id)
+        # Cached liveness: monotonic time of the last response proving ComfyUI is up
+        self.health_ttl = health_ttl
+        self._last_healthy = 0.0
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self._heartbeat_stop = threading.Event()
+        # Content hash -> filename already present in ComfyUI's input dir
+        self.upload_cache = UploadCache()
+        # Model key (see WorkflowTemplate.model_key) of the last queued prompt, and swaps so far
+        self.loaded_model: Optional[str] = None
+        self.model_reloads = 0
+        # asyncio client for the event-loop path (agenerate). It has its own
+        # client_id: ComfyUI keeps one socket per id, so the two can't share one.
+        self.pool_size = pool_size
+        self.async_session: Optional[aiohttp.ClientSession] = None
+        self.async_client_id = f"pixeldojo-{uuid.uuid4().hex[:12]}"
+        self.async_tracker: Optional[AsyncCompletionTracker] = None
+    
+    def use_model(self, model_key: str) -> bool:
+        """Record the model a queued prompt loads. Returns True if ComfyUI has to swap weights."""
+        reload = self.loaded_model is not None and self.loaded_model != model_key
+        if reload:
+            self.model_reloads += 1
+            logger.debug("ComfyUI switching model %s -> %s", self.loaded_model, model_key)
+        self.loaded_model = model_key
+        return reload
+    
+    def _mark_healthy(self):
+        self._last_healthy = time.monotonic()
     
-    def is_running(self) -> bool:
-        """Check if ComfyUI is running"""
+    def _mark_unhealthy(self):
+        self._last_healthy = 0.0
+        # ComfyUI may come back as a fresh instance without our uploads
+        self.upload_cache.clear()
+    
+    def is_healthy_cached(self) -> bool:
+        """True if a recent response or the live event stream shows ComfyUI is up"""
+        if self.tracker.connected:
+            return True
+        return time.monotonic() - self._last_healthy < self.health_ttl
+    
+    def is_running(self, use_cache: bool = True) -> bool:
+        """Check if ComfyUI is running, probing /system_stats only when the cached state is stale"""
+        if use_cache and self.is_healthy_cached():
+            return True
         try:
-            response = requests.get(f"{self.base_url}/system_stats", timeout=10)
-            return response.status_code == 200
+            response = self.session.get(f"{self.base_url}/system_stats", timeout=10)
+            if response.status_code == 200:
+                self._mark_healthy()
+                return True
+            self._mark_unhealthy()
+            return False
         except Exception as e:
-            print(f"DEBUG: is_running check failed: {e}")
+            logger.debug("is_running check failed: %s", e)
+            self._mark_unhealthy()
             return False
     
+    def start_heartbeat(self, interval: float = DEFAULT_HEARTBEAT_INTERVAL):
+        """Probe ComfyUI in the background every interval seconds to keep the health cache warm"""
+        if interval <= 0 or (self._heartbeat_thread and self._heartbeat_thread.is_alive()):
+            return
+        self._heartbeat_stop.clear()
+        
+        def beat():
+            while not self._heartbeat_stop.wait(interval):
+                self.is_running(use_cache=False)
+        
+        self._heartbeat_thread = threading.Thread(target=beat, name="comfyui-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+    
+    def stop_heartbeat(self):
+        """Stop the background heartbeat, if running"""
+        self._heartbeat_stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join(timeout=5)
+            self._heartbeat_thread = None
+    
     def start(self) -> bool:
         """Start ComfyUI server"""
-        print(f"DEBUG: Checking connection to ComfyUI at {self.base_url}")
-        if self.is_running():
-            print("ComfyUI is running/accessible")
+        logger.debug("Checking connection to ComfyUI at %s", self.base_url)
+        if self.is_running(use_cache=False):
+            logger.info("ComfyUI is running/accessible")
             return True
         
         # If using a remote URL, don't try to start a local process
         if os.getenv("COMFYUI_URL"):
-            print(f"ERROR: Could not connect to remote ComfyUI at {self.base_url}")
-            print("Please check if the RunPod instance is running and the port is correct.")
+            logger.error("Could not connect to remote ComfyUI at %s", self.base_url)
+            logger.error("Please check if the RunPod instance is running and the port is correct.")
             return False
         
         venv_python = self.comfyui_path / "venv" / "bin" / "python"
@@ -48,7 +196,17 @@ class ComfyUIWrapper:
         if not main_py.exists():
             raise FileNotFoundError(f"ComfyUI not found at {self.comfyui_path}")
         
-        print(f"Starting ComfyUI on port {self.port}...")
+        if self.process is not None and self.process.poll() is None:
+            # Ours but not answering (hung); it would hold the port
+            logger.warning("Restarting unresponsive ComfyUI process %s", self.process.pid)
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        
+        logger.info("Starting ComfyUI on port %s...", self.port)
         comfyui_path_str = str(self.comfyui_path.resolve())
         self.process = subprocess.Popen(
             [str(venv_python), str(main_py), "--listen", "127.0.0.1", "--port", str(self.port)],
@@ -61,20 +219,31 @@ class ComfyUIWrapper:
         max_attempts = 30
         for i in range(max_attempts):
             time.sleep(2)
-            if self.is_running():
-                print("ComfyUI started successfully")
+            if self.is_running(use_cache=False):
+                logger.info("ComfyUI started successfully")
                 return True
         
-        print("Failed to start ComfyUI")
+        logger.error("Failed to start ComfyUI")
+        return False
+    
+    def start_event_stream(self) -> bool:
+        """Follow ComfyUI's /ws events for our client_id. Returns True if connected."""
+        if self.tracker.connected:
+            return True
+        if self.tracker.start():
+            return True
+        logger.debug("ComfyUI event stream unavailable, falling back to polling")
         return False
     
     def stop(self):
         """Stop ComfyUI server"""
+        self.stop_heartbeat()
+        self.tracker.stop()
         if self.process:
             self.process.terminate()
             self.process.wait()
             self.process = None
-            print("ComfyUI stopped")
+            logger.info("ComfyUI stopped")
     
     def queue_prompt(self, workflow: Dict[str, Any]) -> Optional[str]:
         """Queue a prompt/workflow in ComfyUI and return the prompt_id"""
@@ -87,39 +256,40 @@ class ComfyUIWrapper:
         }
         
         try:
-            print(f"DEBUG: Sending workflow to {self.base_url}/prompt")
-            response = requests.post(
+            logger.debug("Sending workflow to %s/prompt", self.base_url)
+            response = self.session.post(
                 f"{self.base_url}/prompt",
                 json=prompt_data,
                 timeout=30
             )
+            self._mark_healthy()
             
             # Check for errors in response
             result = response.json()
             
             if "error" in result:
-                print(f"ERROR from ComfyUI: {result['error']}")
+                logger.error("ComfyUI rejected the prompt: %s", result['error'])
                 if "node_errors" in result:
                     for node_id, errors in result["node_errors"].items():
-                        print(f"  Node {node_id}: {errors}")
+                        logger.error("  Node %s: %s", node_id, errors)
                 return None
             
             if response.status_code != 200:
-                print(f"ERROR: ComfyUI returned status {response.status_code}")
-                print(f"Response: {result}")
+                logger.error("ComfyUI returned status %s", response.status_code)
+                logger.error("Response: %s", result)
                 return None
                 
             prompt_id = result.get("prompt_id")
-            print(f"DEBUG: Got prompt_id: {prompt_id}")
+            logger.debug("Got prompt_id: %s", prompt_id)
             return prompt_id
             
         except requests.exceptions.RequestException as e:
-            print(f"ERROR: Network error queueing prompt: {e}")
+            logger.error("Network error queueing prompt: %s", e)
+            if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                self._mark_unhealthy()
             return None
         except Exception as e:
-            print(f"ERROR: Unexpected error queueing prompt: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Unexpected error queueing prompt: %s", e)
             return None
     
     def get_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
@@ -128,9 +298,13 @@ class ComfyUIWrapper:
             return None
         
         try:
-            response = requests.get(f"{self.base_url}/history/{prompt_id}", timeout=5)
+            response = self.session.get(f"{self.base_url}/history/{prompt_id}", timeout=5)
+            self._mark_healthy()
             response.raise_for_status()
             return response.json()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self._mark_unhealthy()
+            return None
         except:
             return None
     
@@ -140,39 +314,193 @@ class ComfyUIWrapper:
             return {"queue_running": [], "queue_pending": []}
         
         try:
-            response = requests.get(f"{self.base_url}/queue", timeout=5)
+            response = self.session.get(f"{self.base_url}/queue", timeout=5)
+            self._mark_healthy()
             response.raise_for_status()
             return response.json()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self._mark_unhealthy()
+            return {"queue_running": [], "queue_pending": []}
         except:
             return {"queue_running": [], "queue_pending": []}
     
-    def upload_image(self, image_path: str) -> Optional[str]:
-        """Upload an image to ComfyUI and return the filename"""
-        if not self.is_running():
-            raise RuntimeError("ComfyUI is not running")
-        
+    def upload_image(self, image_path: str, digest: Optional[str] = None) -> Optional[str]:
+        """Upload an image to ComfyUI and return the filename, skipping content it already has"""
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image not found: {image_path}")
         
+        # Callers that already hashed the image pass its digest
+        digest = digest or sha256_file(image_path)
+        cached_name = self.upload_cache.get(digest)
+        if cached_name:
+            logger.debug("Image already uploaded as %s, skipping upload", cached_name)
+            return cached_name
+        
+        if not self.is_running():
+            raise RuntimeError("ComfyUI is not running")
+        
         try:
             with open(image_path, 'rb') as f:
-                files = {'image': (os.path.basename(image_path), f, 'image/png')}
+                # Name by content so repeat uploads of the same image land on the same file
+                upload_name = content_filename(digest, image_path)
+                files = {'image': (upload_name, f, 'image/png')}
                 data = {'overwrite': 'true'}
-                print(f"DEBUG: Uploading to {self.base_url}/upload/image")
-                response = requests.post(
+                logger.debug("Uploading to %s/upload/image", self.base_url)
+                response = self.session.post(
                     f"{self.base_url}/upload/image",
                     files=files,
                     data=data,
                     timeout=60
                 )
-                print(f"DEBUG: Upload response status: {response.status_code}")
+                self._mark_healthy()
+                logger.debug("Upload response status: %s", response.status_code)
                 response.raise_for_status()
                 result = response.json()
-                print(f"DEBUG: Upload result: {result}")
-                return result.get("name")
+                logger.debug("Upload result: %s", result)
+                name = result.get("name")
+                if name:
+                    self.upload_cache.put(digest, name)
+                return name
         except Exception as e:
-            print(f"Error uploading image: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error uploading image: %s", e)
+            if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                self._mark_unhealthy()
             return None
-
+    
+    # --- asyncio API (same semantics as the blocking methods above) ---
+    
+    async def get_async_session(self) -> aiohttp.ClientSession:
+        """Return the pooled aiohttp session, creating it (and its event tracker) on first use"""
+        if self.async_session is None or self.async_session.closed:
+            self.async_session = build_async_session(self.pool_size)
+            self.async_tracker = AsyncCompletionTracker(self.async_session, self.base_url, self.async_client_id)
+        return self.async_session
+    
+    async def ais_running(self, use_cache: bool = True) -> bool:
+        """Async is_running"""
+        if use_cache and (self.is_healthy_cached() or (self.async_tracker and self.async_tracker.connected)):
+            return True
+        session = await self.get_async_session()
+        try:
+            async with session.get(f"{self.base_url}/system_stats", timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                if resp.status == 200:
+                    self._mark_healthy()
+                    return True
+            self._mark_unhealthy()
+            return False
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("is_running check failed: %s", e)
+            self._mark_unhealthy()
+            return False
+    
+    async def astart_event_stream(self) -> bool:
+        """Follow /ws events for async_client_id. Returns True if connected."""
+        await self.get_async_session()
+        if self.async_tracker.connected:
+            return True
+        if await self.async_tracker.start():
+            return True
+        logger.debug("ComfyUI event stream unavailable, falling back to polling")
+        return False
+    
+    async def aqueue_prompt(self, workflow: Dict[str, Any]) -> Optional[str]:
+        """Async queue_prompt; events for the prompt go to async_tracker"""
+        session = await self.get_async_session()
+        prompt_data = {
+            "prompt": workflow,
+            "client_id": self.async_client_id
+        }
+        try:
+            logger.debug("Sending workflow to %s/prompt", self.base_url)
+            async with session.post(f"{self.base_url}/prompt", json=prompt_data,
+                                    timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                self._mark_healthy()
+                result = await resp.json(content_type=None)
+                status = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Network error queueing prompt: %s", e)
+            self._mark_unhealthy()
+            return None
+        except ValueError as e:
+            logger.error("Unexpected response queueing prompt: %s", e)
+            return None
+        
+        if "error" in result:
+            logger.error("ComfyUI rejected the prompt: %s", result['error'])
+            for node_id, errors in result.get("node_errors", {}).items():
+                logger.error("  Node %s: %s", node_id, errors)
+            return None
+        if status != 200:
+            logger.error("ComfyUI returned status %s", status)
+            logger.error("Response: %s", result)
+            return None
+        prompt_id = result.get("prompt_id")
+        logger.debug("Got prompt_id: %s", prompt_id)
+        return prompt_id
+    
+    async def _aget_json(self, path: str) -> Optional[Dict[str, Any]]:
+        session = await self.get_async_session()
+        try:
+            async with session.get(f"{self.base_url}{path}", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                self._mark_healthy()
+                if resp.status != 200:
+                    return None
+                return await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._mark_unhealthy()
+            return None
+        except ValueError:
+            return None
+    
+    async def aget_history(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """Async get_history"""
+        return await self._aget_json(f"/history/{prompt_id}")
+    
+    async def aget_queue_status(self) -> Dict[str, Any]:
+        """Async get_queue_status"""
+        return await self._aget_json("/queue") or {"queue_running": [], "queue_pending": []}
+    
+    async def aupload_image(self, image_path: str, digest: Optional[str] = None) -> Optional[str]:
+        """Async upload_image (shares the upload cache with the blocking client)"""
+        if not await asyncio.to_thread(os.path.exists, image_path):
+            raise FileNotFoundError(f"Image not found: {image_path}")
+        
+        digest = digest or await asyncio.to_thread(sha256_file, image_path)
+        cached_name = self.upload_cache.get(digest)
+        if cached_name:
+            logger.debug("Image already uploaded as %s, skipping upload", cached_name)
+            return cached_name
+        
+        # Read in a thread; the event loop never touches the disk
+        image_bytes = await asyncio.to_thread(Path(image_path).read_bytes)
+        session = await self.get_async_session()
+        try:
+            data = aiohttp.FormData()
+            data.add_field('image', image_bytes, filename=content_filename(digest, image_path),
+                           content_type='image/png')
+            data.add_field('overwrite', 'true')
+            logger.debug("Uploading to %s/upload/image", self.base_url)
+            async with session.post(f"{self.base_url}/upload/image", data=data,
+                                    timeout=aiohttp.ClientTimeout(total=60)) as resp:
+                self._mark_healthy()
+                logger.debug("Upload response status: %s", resp.status)
+                resp.raise_for_status()
+                result = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error("Error uploading image: %s", e)
+            if not isinstance(e, (aiohttp.ClientResponseError, ValueError)):
+                self._mark_unhealthy()
+            return None
+        logger.debug("Upload result: %s", result)
+        name = result.get("name")
+        if name:
+            self.upload_cache.put(digest, name)
+        return name
+    
+    async def aclose(self):
+        """Stop the async event stream and close the aiohttp session"""
+        if self.async_tracker is not None:
+            await self.async_tracker.stop()
+        if self.async_session is not None:
+            await self.async_session.close()
+            self.async_session = None
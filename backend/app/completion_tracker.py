@@ -0,0 +1,383 @@
+"""
+Completion tracking over ComfyUI's /ws event stream.
+
+ComfyUI pushes `executing`, `progress` and `executed` events to the client
+that queued a prompt. Following that stream lets us resolve a waiting job as
+soon as its prompt finishes instead of polling /history every few seconds.
+If the socket drops, waiters are told so and fall back to polling.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, Callable, List
+
+import websocket
+
+logger = logging.getLogger(__name__)
+
+
+# How many prompt states to remember before dropping the oldest finished ones
+MAX_TRACKED_PROMPTS = 256
+
+
+def ws_url_for(base_url: str, client_id: str) -> str:
+    """Turn an http(s) ComfyUI base URL into its /ws endpoint"""
+    if base_url.startswith("https://"):
+        ws_base = "wss://" + base_url[len("https://"):]
+    elif base_url.startswith("http://"):
+        ws_base = "ws://" + base_url[len("http://"):]
+    else:
+        ws_base = base_url
+    return f"{ws_base.rstrip('/')}/ws?clientId={client_id}"
+
+
+@dataclass
+class PromptState:
+    """Everything the event stream has told us about one prompt"""
+    prompt_id: str
+    signal: Any
+    finished: bool = False
+    error: Optional[str] = None
+    current_node: Optional[str] = None
+    progress_value: int = 0
+    progress_max: int = 0
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)
+    # Timing: when execution began, and seconds spent in each node
+    started_at: Optional[float] = None
+    node_started_at: Optional[float] = None
+    node_seconds: Dict[str, float] = field(default_factory=dict)
+    # Called as listener(state, event_type) after each event for this prompt
+    listeners: List[Callable[["PromptState", str], None]] = field(default_factory=list)
+
+
+class _BaseTracker:
+    """Shared event handling for the sync and async trackers"""
+
+    def __init__(self, base_url: str, client_id: str):
+        self.base_url = base_url
+        self.client_id = client_id
+        self.ws_url = ws_url_for(base_url, client_id)
+        self._prompts: "OrderedDict[str, PromptState]" = OrderedDict()
+
+    def _new_signal(self):
+        raise NotImplementedError
+
+    def _state(self, prompt_id: str) -> PromptState:
+        state = self._prompts.get(prompt_id)
+        if state is None:
+            state = PromptState(prompt_id=prompt_id, signal=self._new_signal())
+            self._prompts[prompt_id] = state
+            self._trim()
+        return state
+
+    def _trim(self):
+        if len(self._prompts) <= MAX_TRACKED_PROMPTS:
+            return
+        for prompt_id in list(self._prompts):
+            if len(self._prompts) <= MAX_TRACKED_PROMPTS:
+                break
+            if self._prompts[prompt_id].finished:
+                del self._prompts[prompt_id]
+
+    def get_state(self, prompt_id: str) -> Optional[PromptState]:
+        """Return the tracked state for a prompt, if any events were seen"""
+        return self._prompts.get(prompt_id)
+    
+    def add_listener(self, prompt_id: str, listener: Callable[[PromptState, str], None]) -> PromptState:
+        """Call listener(state, event_type) for every further event on this prompt"""
+        state = self._state(prompt_id)
+        state.listeners.append(listener)
+        return state
+
+    def _handle_message(self, raw: Any):
+        """Apply a single /ws message to the tracked prompt states"""
+        # Binary frames are live previews; we only care about JSON events
+        if not isinstance(raw, str):
+            return
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+
+        state = self._state(prompt_id)
+        now = state.updated_at = time.time()
+
+        if event_type == "execution_start":
+            state.started_at = now
+        elif event_type == "executing":
+            self._close_node(state, now)
+            node = data.get("node")
+            if node is None:
+                # Sent after the prompt's history has been stored
+                state.current_node = None
+                self._finish(state)
+            else:
+                state.current_node = str(node)
+                state.node_started_at = now
+        elif event_type == "progress":
+            state.progress_value = int(data.get("value", 0))
+            state.progress_max = int(data.get("max", 0))
+            if data.get("node") is not None:
+                state.current_node = str(data["node"])
+        elif event_type == "executed":
+            node = data.get("node")
+            if node is not None:
+                state.outputs[str(node)] = data.get("output") or {}
+        elif event_type in ("execution_error", "execution_interrupted"):
+            self._close_node(state, now)
+            state.error = data.get("exception_message") or event_type
+            self._finish(state)
+        
+        for listener in list(state.listeners):
+            try:
+                listener(state, event_type)
+            except Exception as e:
+                logger.debug("Progress listener failed: %s", e)
+
+    @staticmethod
+    def _close_node(state: PromptState, now: float):
+        """Charge the time since the current node started to that node"""
+        if state.current_node is not None and state.node_started_at is not None:
+            elapsed = now - state.node_started_at
+            state.node_seconds[state.current_node] = state.node_seconds.get(state.current_node, 0.0) + elapsed
+        state.node_started_at = None
+
+    def _finish(self, state: PromptState):
+        state.finished = True
+        state.signal.set()
+
+
+class CompletionTracker(_BaseTracker):
+    """
+    Background-thread tracker for the synchronous ComfyUIWrapper.
+
+    Uses websocket-client and reconnects automatically after drops.
+    """
+
+    def __init__(self, base_url: str, client_id: str, reconnect_delay: float = 5.0):
+        super().__init__(base_url, client_id)
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.RLock()
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ws: Optional[websocket.WebSocket] = None
+
+    def _new_signal(self):
+        return threading.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self, connect_timeout: float = 5.0) -> bool:
+        """Start following the event stream. Returns True once connected."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                # Already (re)connecting in the background; don't block callers
+                return self.connected
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="comfyui-ws", daemon=True
+            )
+            self._thread.start()
+        return self._connected.wait(connect_timeout)
+
+    def stop(self):
+        """Stop the background thread and close the socket"""
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._ws = websocket.create_connection(self.ws_url, timeout=10)
+                # Block in recv() indefinitely; stop() closes the socket to wake us
+                self._ws.settimeout(None)
+                self._connected.set()
+                logger.debug("Connected to ComfyUI event stream at %s", self.ws_url)
+                while not self._stop.is_set():
+                    raw = self._ws.recv()
+                    if raw is None or raw == "":
+                        break
+                    with self._lock:
+                        self._handle_message(raw)
+            except Exception as e:
+                if not self._stop.is_set():
+                    logger.debug("ComfyUI event stream dropped: %s", e)
+            finally:
+                self._connected.clear()
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+            self._stop.wait(self.reconnect_delay)
+
+    def track(self, prompt_id: str) -> PromptState:
+        """Register interest in a prompt (safe to call after it finished)"""
+        with self._lock:
+            return self._state(prompt_id)
+
+    def add_listener(self, prompt_id: str, listener: Callable[[PromptState, str], None]) -> PromptState:
+        with self._lock:
+            return super().add_listener(prompt_id, listener)
+
+    def wait(self, prompt_id: str, timeout: float) -> Optional[bool]:
+        """
+        Block until the prompt finishes.
+
+        Returns True when finished, False on timeout, and None if the event
+        stream is (or becomes) unavailable so the caller should poll instead.
+        """
+        state = self.track(prompt_id)
+        deadline = time.time() + timeout
+        while True:
+            if state.finished:
+                return True
+            if not self.connected:
+                return None
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            state.signal.wait(min(remaining, 1.0))
+
+
+class AsyncCompletionTracker(_BaseTracker):
+    """
+    asyncio tracker for ParallelVideoGenerator workers.
+
+    Runs on an existing aiohttp session and reconnects after drops.
+    """
+
+    def __init__(self, session, base_url: str, client_id: str, reconnect_delay: float = 5.0):
+        super().__init__(base_url, client_id)
+        self.session = session
+        self.reconnect_delay = reconnect_delay
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _new_signal(self):
+        return asyncio.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    async def start(self, connect_timeout: float = 5.0) -> bool:
+        """Start following the event stream. Returns True once connected."""
+        if self._task is not None and not self._task.done():
+            return self.connected
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), connect_timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def stop(self):
+        """Cancel the reader task"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        self._connected.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                async with self.session.ws_connect(self.ws_url, heartbeat=30) as ws:
+                    self._connected.set()
+                    async for msg in ws:
+                        if msg.type.name == "TEXT":
+                            self._handle_message(msg.data)
+                        elif msg.type.name in ("CLOSED", "ERROR"):
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug("Event stream for %s dropped: %s", self.base_url, e)
+            finally:
+                self._connected.clear()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def track(self, prompt_id: str) -> PromptState:
+        """Register interest in a prompt (safe to call after it finished)"""
+        return self._state(prompt_id)
+
+    async def wait(self, prompt_id: str, timeout: float) -> Optional[bool]:
+        """
+        Wait until the prompt finishes.
+
+        Returns True when finished, False on timeout, and None if the event
+        stream is (or becomes) unavailable so the caller should poll instead.
+        """
+        state = self.track(prompt_id)
+        deadline = time.time() + timeout
+        while True:
+            if state.finished:
+                return True
+            if not self.connected:
+                return None
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(state.signal.wait(), min(remaining, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_for_output(self, prompt_id: str, node_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Wait for one node's `executed` output, which arrives before the whole prompt finishes.
+
+        Returns None on timeout, if the prompt finishes without that output, or
+        if the event stream is unavailable (the caller should read /history).
+        """
+        arrived = asyncio.Event()
+
+        def on_event(state, event_type):
+            if node_id in state.outputs or state.finished:
+                arrived.set()
+
+        state = self.add_listener(prompt_id, on_event)
+        deadline = time.time() + timeout
+        try:
+            while node_id not in state.outputs:
+                if state.finished or not self.connected:
+                    return None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(arrived.wait(), min(remaining, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+            return state.outputs[node_id]
+        finally:
+            if on_event in state.listeners:
+                state.listeners.remove(on_event)
@@ -0,0 +1,379 @@
+"""
+Load-aware chunk dispatch for the parallel generator.
+
+Chunks wait in a shared pending list. A worker is handed a chunk only when it
+is idle (one in-flight chunk per worker), so a fast worker that finishes
+early simply pulls the next pending chunk: work stealing with no
+pre-assignment. Among the idle workers the dispatcher picks the one with the
+earliest estimated finish. That estimate comes from the worker's live
+/queue depth (jobs other clients queued) and a rolling seconds-per-frame
+figure learned from the chunks it has finished. A chunk that a busy worker
+would still finish sooner than any idle one waits for it.
+
+Estimates include model affinity. A worker whose last prompt loaded other
+weights (another UNet, or the fp8 dtype of fast mode) pays a model-reload
+penalty. Same-configuration jobs therefore stay on the workers that already
+hold their weights, and only spill over when that is still faster.
+
+A failed or timed-out chunk goes back into the pending list after an
+exponential backoff and avoids the workers it already failed on. Once nothing
+is pending, idle workers speculatively re-run tail chunks that are running
+well past their estimate. The first copy to finish wins and the others are
+cancelled on their workers.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Callable, Awaitable, Any, Set
+
+import aiohttp
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Prior for workers we haven't timed yet (~30s of video in ~28 min on one GPU)
+DEFAULT_SECONDS_PER_FRAME = float(os.getenv("PIXELDOJO_DEFAULT_SECONDS_PER_FRAME", "3.5"))
+# Weight of the newest sample in the rolling seconds-per-frame average
+SPF_SMOOTHING = 0.3
+# Minimum seconds between /queue probes of the same worker
+QUEUE_PROBE_INTERVAL = 2.0
+# Extra attempts for a failed chunk, and the first backoff (doubles per attempt)
+CHUNK_RETRIES = int(os.getenv("PIXELDOJO_CHUNK_RETRIES", "2"))
+CHUNK_RETRY_BACKOFF = 2.0
+# Seconds one attempt may take (queue wait + sampling + download) before it is abandoned
+CHUNK_TIMEOUT = float(os.getenv("PIXELDOJO_CHUNK_TIMEOUT", "900"))
+# Re-run a tail chunk on an idle worker once it exceeds this multiple of its estimate (0 = never)
+SPECULATE_AFTER = float(os.getenv("PIXELDOJO_SPECULATE_AFTER", "1.5"))
+# Estimated cost of swapping a worker's loaded weights for another model configuration
+MODEL_RELOAD_SECONDS = float(os.getenv("PIXELDOJO_MODEL_RELOAD_SECONDS", "40"))
+
+
+def worker_seconds_per_frame(worker) -> float:
+    return worker.seconds_per_frame or DEFAULT_SECONDS_PER_FRAME
+
+
+def record_chunk_time(worker, frames: int, elapsed: float):
+    """Fold one finished chunk into the worker's rolling seconds-per-frame estimate"""
+    if frames <= 0 or elapsed <= 0:
+        return
+    sample = elapsed / frames
+    if worker.seconds_per_frame is None:
+        worker.seconds_per_frame = sample
+    else:
+        worker.seconds_per_frame = SPF_SMOOTHING * sample + (1 - SPF_SMOOTHING) * worker.seconds_per_frame
+
+
+async def probe_queue_depth(session: aiohttp.ClientSession, worker, timeout: float = 5) -> Optional[int]:
+    """Running + pending prompts on a worker (None if /queue is unreachable)"""
+    try:
+        async with session.get(f"{worker.url}/queue", timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            if resp.status != 200:
+                return None
+            queue = await resp.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.debug("/queue probe failed for %s: %s", worker.name, e)
+        return None
+    return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+
+
+@dataclass
+class _Attempt:
+    worker: Any
+    chunk: Dict
+    started_at: float
+    speculative: bool = False
+    timed_out: bool = False
+    # The worker had to load this job's weights first, so the time isn't a clean speed sample
+    reloaded: bool = False
+
+
+class ChunkDispatcher:
+    """Runs chunks across workers, least estimated finish time first"""
+
+    def __init__(self, session: aiohttp.ClientSession, workers: List[Any],
+                 run_chunk: Callable[[Any, Dict], Awaitable[Optional[Any]]],
+                 reevaluate_interval: float = 5.0, retries: int = CHUNK_RETRIES,
+                 retry_backoff: float = CHUNK_RETRY_BACKOFF, chunk_timeout: float = CHUNK_TIMEOUT,
+                 speculate_after: float = SPECULATE_AFTER,
+                 ready: Optional[Callable[[Dict], bool]] = None,
+                 model_key: Optional[str] = None, reload_seconds: float = MODEL_RELOAD_SECONDS):
+        """
+        Args:
+            session: Shared HTTP session (used for /queue probes)
+            workers: ComfyWorker instances eligible for this job
+            run_chunk: async (worker, chunk) -> result, or None on failure. Cancelling it
+                must release the chunk's prompt on the worker.
+            reevaluate_interval: Max seconds between scheduling passes while chunks run
+            retries: Extra attempts per chunk after a failure
+            retry_backoff: Delay before the first retry; doubles for each later one
+            chunk_timeout: Seconds before an attempt is cancelled and counted as failed
+            speculate_after: Multiple of a chunk's estimate after which it may be duplicated (0 = off)
+            ready: Predicate gating chunks on inputs produced by other chunks (call wake()
+                when it may have changed)
+            model_key: Model configuration every chunk loads (None = ignore affinity)
+            reload_seconds: Estimated cost of a worker switching to model_key
+        """
+        self.session = session
+        self.workers = workers
+        self.run_chunk = run_chunk
+        self.reevaluate_interval = reevaluate_interval
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.chunk_timeout = chunk_timeout
+        self.speculate_after = speculate_after
+        self.ready = ready or (lambda chunk: True)
+        self.model_key = model_key
+        self.reload_seconds = reload_seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self.pending: List[Dict] = []
+        self.results: Dict[int, Any] = {}
+        self.failed: List[Dict] = []
+        self.in_flight: Dict[asyncio.Task, _Attempt] = {}
+        # chunk_id -> names of workers it failed on / earliest retry time
+        self.failed_on: Dict[int, Set[str]] = {}
+        self.not_before: Dict[int, float] = {}
+        self.attempts: Dict[int, int] = {}
+        self.speculated_chunks: Set[int] = set()
+        self.retried = 0
+        self.speculated = 0
+
+    async def _refresh_queue_depths(self, workers: List[Any]):
+        now = time.time()
+        stale = [w for w in workers if now - w.queue_probed_at >= QUEUE_PROBE_INTERVAL]
+        if not stale:
+            return
+        depths = await asyncio.gather(*(probe_queue_depth(self.session, w) for w in stale))
+        for worker, depth in zip(stale, depths):
+            worker.queue_probed_at = now
+            if depth is not None:
+                # Our own in-flight chunk shows up in /queue too
+                worker.queue_depth = max(0, depth - (1 if worker.busy else 0))
+
+    def _chunk_seconds(self, worker, chunk: Dict) -> float:
+        return chunk["frame_count"] * worker_seconds_per_frame(worker)
+
+    def _attempt_seconds(self, attempt: _Attempt) -> float:
+        """Expected duration of an attempt, including the model swap it started with"""
+        return self._chunk_seconds(attempt.worker, attempt.chunk) + (self.reload_seconds if attempt.reloaded else 0.0)
+
+    def _busy_until(self, worker, now: float) -> float:
+        """When a busy worker is expected to free up"""
+        if not worker.busy:
+            return now
+        expected_end = worker.busy_until
+        for attempt in self.in_flight.values():
+            if attempt.worker is worker:
+                expected_end = attempt.started_at + self._attempt_seconds(attempt)
+                break
+        # Otherwise the worker runs another job's chunk, which set busy_until when it launched.
+        # An overrunning chunk is assumed to need as long again as it has overrun
+        return expected_end if expected_end >= now else now + (now - expected_end)
+
+    def _reload_cost(self, loaded_model: Optional[str]) -> float:
+        """Seconds a worker holding loaded_model needs before it can start our chunks"""
+        if self.model_key is None or loaded_model == self.model_key:
+            return 0.0
+        return self.reload_seconds
+
+    def _eligible(self, chunk: Dict) -> List[Any]:
+        """Workers a chunk hasn't failed on (all of them once every worker has failed it)"""
+        failed_on = self.failed_on.get(chunk["chunk_id"], ())
+        return [w for w in self.workers if w.name not in failed_on] or self.workers
+
+    def estimated_finish(self, worker, chunk: Dict, now: float) -> float:
+        """Epoch seconds at which worker would finish chunk if handed it next"""
+        # Foreign jobs ahead of us are assumed to be about chunk-sized
+        backlog = worker.queue_depth * self._chunk_seconds(worker, chunk)
+        return (self._busy_until(worker, now) + backlog + self._reload_cost(worker.loaded_model)
+                + self._chunk_seconds(worker, chunk))
+
+    def _launch(self, worker, chunk: Dict, speculative: bool = False):
+        worker.busy = True
+        reloaded = self.model_key is not None and worker.use_model(self.model_key)
+        task = asyncio.create_task(self.run_chunk(worker, chunk))
+        attempt = self.in_flight[task] = _Attempt(worker, chunk, time.time(), speculative, reloaded=reloaded)
+        # Lets other jobs' dispatchers estimate when this worker frees up
+        worker.busy_until = attempt.started_at + self._attempt_seconds(attempt)
+
+    def _copies(self, chunk_id: int) -> List[asyncio.Task]:
+        return [task for task, attempt in self.in_flight.items() if attempt.chunk["chunk_id"] == chunk_id]
+
+    async def _assign(self):
+        """
+        Plan every ready chunk onto the worker that would finish it first,
+        then start the chunks whose planned worker is idle right now.
+
+        Chunks planned onto busy workers stay pending, so whichever worker frees
+        up first re-plans and takes them.
+        """
+        idle = [w for w in self.workers if not w.busy]
+        if not idle:
+            return
+        now = time.time()
+        ready = [c for c in self.pending if self.not_before.get(c["chunk_id"], 0) <= now and self.ready(c)]
+        if not ready:
+            self._speculate(idle, now)
+            return
+        await self._refresh_queue_depths(idle)
+        now = time.time()
+        # Reload penalties are already included, so only a worker's first planned chunk pays one
+        available_at = {id(w): self.estimated_finish(w, ready[0], now)
+                        - self._chunk_seconds(w, ready[0]) for w in self.workers}
+        to_launch = []
+        for chunk in ready:
+            best = min(self._eligible(chunk),
+                       key=lambda w: (available_at[id(w)] + self._chunk_seconds(w, chunk), w.chunks_failed,
+                                      self._reload_cost(w.loaded_model)))
+            if best in idle:
+                idle.remove(best)
+                to_launch.append((best, chunk))
+            available_at[id(best)] += self._chunk_seconds(best, chunk)
+            if not idle:
+                break
+        for worker, chunk in to_launch:
+            self.pending.remove(chunk)
+            logger.debug("Dispatching chunk %s to %s (queue depth %s, %.2fs/frame%s)",
+                         chunk['chunk_id'], worker.name, worker.queue_depth, worker_seconds_per_frame(worker),
+                         ', model reload' if self._reload_cost(worker.loaded_model) else '')
+            self._launch(worker, chunk)
+
+    def _speculate(self, idle: List[Any], now: float):
+        """Duplicate straggling tail chunks onto idle workers"""
+        if not self.speculate_after or self.pending:
+            return
+        stragglers = []
+        for attempt in self.in_flight.values():
+            chunk_id = attempt.chunk["chunk_id"]
+            if chunk_id in self.speculated_chunks or chunk_id in self.results:
+                continue
+            expected = self._attempt_seconds(attempt)
+            if now - attempt.started_at > self.speculate_after * expected:
+                stragglers.append(attempt)
+        # Most overdue first
+        stragglers.sort(key=lambda a: a.started_at)
+        for attempt in stragglers:
+            candidates = [w for w in idle if w is not attempt.worker and w in self._eligible(attempt.chunk)]
+            if not candidates:
+                continue
+            worker = min(candidates, key=lambda w: (self.estimated_finish(w, attempt.chunk, now), w.chunks_failed))
+            idle.remove(worker)
+            self.speculated_chunks.add(attempt.chunk["chunk_id"])
+            self.speculated += 1
+            metrics.SPECULATIVE_CHUNKS.inc()
+            logger.debug("Chunk %s running %.0fs on %s; speculatively re-running on %s",
+                         attempt.chunk['chunk_id'], now - attempt.started_at, attempt.worker.name, worker.name)
+            self._launch(worker, attempt.chunk, speculative=True)
+
+    def _expire(self, now: float):
+        """Cancel attempts that have run past the chunk timeout"""
+        for task, attempt in self.in_flight.items():
+            if not attempt.timed_out and now - attempt.started_at > self.chunk_timeout:
+                logger.debug("Chunk %s timed out on %s", attempt.chunk['chunk_id'], attempt.worker.name)
+                attempt.timed_out = True
+                task.cancel()
+
+    def _complete(self, task: asyncio.Task):
+        attempt = self.in_flight.pop(task)
+        worker, chunk = attempt.worker, attempt.chunk
+        chunk_id = chunk["chunk_id"]
+        worker.busy = False
+        if task.cancelled() and not attempt.timed_out:
+            # A losing copy, cancelled once another attempt won
+            return
+        result = None
+        if not task.cancelled():
+            try:
+                result = task.result()
+            except Exception as e:
+                logger.debug("Chunk %s raised on %s: %s", chunk_id, worker.name, e)
+        if result is None:
+            worker.chunks_failed += 1
+            self.failed_on.setdefault(chunk_id, set()).add(worker.name)
+            if attempt.speculative:
+                # Let another idle worker try to overtake the original
+                self.speculated_chunks.discard(chunk_id)
+            if chunk_id in self.results or self._copies(chunk_id):
+                # Another copy already won or is still running
+                return
+            attempts = self.attempts[chunk_id] = self.attempts.get(chunk_id, 0) + 1
+            if attempts > self.retries:
+                logger.error("Chunk %s failed after %s attempts", chunk_id, attempts)
+                self.failed.append(chunk)
+                return
+            delay = self.retry_backoff * (2 ** (attempts - 1))
+            logger.debug("Chunk %s failed on %s; retrying in %.0fs on another worker", chunk_id, worker.name, delay)
+            self.retried += 1
+            metrics.CHUNK_RETRIES.inc()
+            self.not_before[chunk_id] = time.time() + delay
+            self.pending.append(chunk)
+            self.pending.sort(key=lambda c: c["chunk_id"])
+            return
+        if chunk_id in self.results:
+            return
+        worker.chunks_done += 1
+        # Only time chunks that didn't queue behind someone else's work or wait for a model load
+        if worker.queue_depth == 0 and not attempt.reloaded:
+            record_chunk_time(worker, chunk["frame_count"], time.time() - attempt.started_at)
+        self.results[chunk_id] = result
+        for other in self._copies(chunk_id):
+            logger.debug("Chunk %s finished on %s; cancelling copy on %s",
+                         chunk_id, worker.name, self.in_flight[other].worker.name)
+            other.cancel()
+
+    def wake(self):
+        """Trigger a scheduling pass now (e.g. a chunk's dependency became available)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_wakeup(self, now: float) -> float:
+        """Seconds until the next scheduling pass is due"""
+        delay = self.reevaluate_interval
+        for chunk in self.pending:
+            delay = min(delay, self.not_before.get(chunk["chunk_id"], 0) - now)
+        return max(0.05, delay)
+
+    async def run(self, chunks: List[Dict]) -> Dict[int, Any]:
+        """Run every chunk and return chunk_id -> result for those that succeeded"""
+        self.pending = sorted(chunks, key=lambda c: c["chunk_id"])
+        self._wakeup = asyncio.Event()
+        try:
+            while self.pending or self.in_flight:
+                await self._assign()
+                if not self.in_flight:
+                    if not self.workers:
+                        break
+                    if not any(self.ready(c) for c in self.pending):
+                        # Only running chunks can satisfy a dependency, and none are running
+                        logger.error("%s chunks can never become ready", len(self.pending))
+                        self.failed.extend(self.pending)
+                        self.pending = []
+                        break
+                    # Waiting out a retry backoff, or every worker is busy with another job
+                    await asyncio.sleep(self._next_wakeup(time.time()))
+                    continue
+                waiter = asyncio.ensure_future(self._wakeup.wait())
+                done, _ = await asyncio.wait([*self.in_flight, waiter], timeout=self._next_wakeup(time.time()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                self._wakeup.clear()
+                for task in done:
+                    if task is not waiter:
+                        self._complete(task)
+                self._expire(time.time())
+        finally:
+            tasks = list(self.in_flight)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for attempt in self.in_flight.values():
+                attempt.worker.busy = False
+            self.in_flight.clear()
+        if self.retried or self.speculated:
+            logger.debug("Chunk dispatch finished with %s retries, %s speculative copies, %s failed chunks",
+                         self.retried, self.speculated, len(self.failed))
+        return self.results
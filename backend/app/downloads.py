@@ -0,0 +1,223 @@
+"""
+Streaming downloads from ComfyUI's /view endpoint.
+
+Outputs are streamed in chunks to a `.part` file next to the destination and
+renamed into place only when complete, so memory stays flat regardless of
+video size and readers never see half-written files. Interrupted transfers
+resume with an HTTP Range request.
+"""
+
+import asyncio
+import logging
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, List, Iterator
+
+import aiofiles
+import aiohttp
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+DOWNLOAD_ATTEMPTS = 3
+# Parallel /view requests when fetching image-sequence outputs
+FRAME_DOWNLOAD_WORKERS = int(os.getenv("COMFYUI_FRAME_WORKERS", "8"))
+
+
+def _part_path(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".part")
+
+
+def _hash_existing(path: Path, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """Seed a sha256 with the bytes already on disk from an earlier attempt"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(block)
+    return hasher
+
+
+def _finish(part: Path, dest: Path, digest: str, expected_sha256: Optional[str]) -> Optional[str]:
+    if expected_sha256 and digest != expected_sha256.lower():
+        logger.error("Checksum mismatch for %s: expected %s, got %s", dest.name, expected_sha256, digest)
+        part.unlink(missing_ok=True)
+        return None
+    os.replace(part, dest)
+    return digest
+
+
+def download_to_file(session: requests.Session, url: str, dest: Path, expected_sha256: Optional[str] = None,
+                     resume: bool = True, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                     attempts: int = DOWNLOAD_ATTEMPTS, timeout: float = 120) -> Optional[str]:
+    """
+    Stream url to dest, returning the file's sha256 hex digest (None on failure).
+
+    If expected_sha256 is given the file is only moved into place when it matches.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part = _part_path(dest)
+    if not resume:
+        part.unlink(missing_ok=True)
+
+    for attempt in range(1, attempts + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if offset and response.status_code == 416:
+                    # Nothing left to fetch: the .part file is already complete
+                    return _finish(part, dest, _hash_existing(part).hexdigest(), expected_sha256)
+                if response.status_code not in (200, 206):
+                    logger.error("Download of %s failed with status %s", url, response.status_code)
+                    # Don't let a later call resume from bytes of an output that may be gone or replaced
+                    part.unlink(missing_ok=True)
+                    return None
+                if offset and response.status_code == 200:
+                    # Server ignored the Range header; start over
+                    offset = 0
+
+                hasher = _hash_existing(part) if offset else hashlib.sha256()
+                with open(part, "ab" if offset else "wb") as f:
+                    for block in response.iter_content(chunk_size=chunk_size):
+                        f.write(block)
+                        hasher.update(block)
+            return _finish(part, dest, hasher.hexdigest(), expected_sha256)
+        except requests.exceptions.RequestException as e:
+            logger.debug("Download attempt %s/%s for %s interrupted: %s", attempt, attempts, dest.name, e)
+
+    logger.error("Giving up downloading %s", url)
+    return None
+
+
+async def async_download_to_file(session: aiohttp.ClientSession, url: str, dest: Path,
+                                 expected_sha256: Optional[str] = None, resume: bool = True,
+                                 chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                                 attempts: int = DOWNLOAD_ATTEMPTS) -> Optional[str]:
+    """Async twin of download_to_file for aiohttp sessions"""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part = _part_path(dest)
+    if not resume:
+        part.unlink(missing_ok=True)
+
+    for attempt in range(1, attempts + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            async with session.get(url, headers=headers) as resp:
+                if offset and resp.status == 416:
+                    hasher = await asyncio.to_thread(_hash_existing, part)
+                    return _finish(part, dest, hasher.hexdigest(), expected_sha256)
+                if resp.status not in (200, 206):
+                    logger.error("Download of %s failed with status %s", url, resp.status)
+                    part.unlink(missing_ok=True)
+                    return None
+                if offset and resp.status == 200:
+                    offset = 0
+
+                # Re-reading a large partial file would block the event loop
+                hasher = await asyncio.to_thread(_hash_existing, part) if offset else hashlib.sha256()
+                async with aiofiles.open(part, "ab" if offset else "wb") as f:
+                    async for block in resp.content.iter_chunked(chunk_size):
+                        await f.write(block)
+                        hasher.update(block)
+            return _finish(part, dest, hasher.hexdigest(), expected_sha256)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("Download attempt %s/%s for %s interrupted: %s", attempt, attempts, dest.name, e)
+
+    logger.error("Giving up downloading %s", url)
+    return None
+
+
+def download_frames(session: requests.Session, urls: List[str], dest_dir: Path,
+                    max_workers: int = FRAME_DOWNLOAD_WORKERS) -> List[Path]:
+    """
+    Fetch image-sequence frames concurrently over the session's pooled connections.
+
+    Frames are written as frame_00000.png, frame_00001.png, ... in the order of
+    urls. Failed frames are skipped and the rest renumbered so the sequence
+    stays contiguous for ffmpeg. Returns the saved paths in frame order.
+    """
+    dest_dir = Path(dest_dir)
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+
+    def fetch(indexed_url):
+        i, url = indexed_url
+        frame_path = dest_dir / f"frame_{i:05d}.png"
+        if download_to_file(session, url, frame_path, attempts=2, timeout=30):
+            return frame_path
+        logger.error("Error downloading frame %s: %s", i, url)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        results = list(pool.map(fetch, enumerate(urls)))
+
+    frame_paths = []
+    for path in results:
+        if path is None:
+            continue
+        expected = dest_dir / f"frame_{len(frame_paths):05d}.png"
+        if path != expected:
+            path.rename(expected)
+        frame_paths.append(expected)
+
+    elapsed = max(time.time() - start, 1e-6)
+    total_bytes = sum(p.stat().st_size for p in frame_paths)
+    logger.debug("Downloaded %s/%s frames (%.1f MB) in %.2fs - %.1f frames/s, %.1f MB/s",
+                 len(frame_paths), len(urls), total_bytes / 1e6, elapsed,
+                 len(frame_paths) / elapsed, total_bytes / 1e6 / elapsed)
+    return frame_paths
+
+
+def iter_frames(session: requests.Session, urls: List[str],
+                max_workers: int = FRAME_DOWNLOAD_WORKERS, timeout: float = 30) -> Iterator[Optional[bytes]]:
+    """
+    Yield each frame's bytes in order (None for a failed frame) while later
+    frames are still downloading.
+
+    At most 2 * max_workers frames are held in memory at once.
+    """
+    def fetch(url):
+        for attempt in range(2):
+            try:
+                response = session.get(url, timeout=timeout)
+                if response.status_code == 200:
+                    return response.content
+                logger.error("Error downloading frame %s: %s", url, response.status_code)
+                return None
+            except requests.exceptions.RequestException as e:
+                logger.error("Exception downloading frame %s: %s", url, e)
+        return None
+
+    window = max(1, max_workers) * 2
+    start = time.time()
+    received = 0
+    total_bytes = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        pending = deque()
+        url_iter = iter(urls)
+        for url in url_iter:
+            pending.append(pool.submit(fetch, url))
+            if len(pending) >= window:
+                break
+        while pending:
+            data = pending.popleft().result()
+            next_url = next(url_iter, None)
+            if next_url is not None:
+                pending.append(pool.submit(fetch, next_url))
+            if data is not None:
+                received += 1
+                total_bytes += len(data)
+            yield data
+
+    elapsed = max(time.time() - start, 1e-6)
+    logger.debug("Streamed %s/%s frames (%.1f MB) in %.2fs - %.1f frames/s, %.1f MB/s",
+                 received, len(urls), total_bytes / 1e6, elapsed, received / elapsed, total_bytes / 1e6 / elapsed)
@@ -1,251 +1,631 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, List, Tuple
 from pathlib import Path
-import json
-import requests
+import asyncio
+import logging
 import time
 import subprocess
 import shutil
 import tempfile
 import os
+import uuid
 from .comfy_wrapper import ComfyUIWrapper
+from .downloads import download_to_file, async_download_to_file, download_frames, iter_frames
+from .video_stitcher import encode_frame_stream, ensure_faststart
+from .result_cache import ResultCache, result_cache_key
+from .upload_cache import sha256_file
+from .workflow_template import WorkflowTemplate, job_params, FPS
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Receives partial job updates, e.g. {"progress": 42, "phase": "sampling", "message": "..."}
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+# Share of the progress bar given to each phase; sampling fills the gap between
+PROGRESS_UPLOADING = 2
+PROGRESS_QUEUED = 5
+PROGRESS_SAMPLING_START = 10
+PROGRESS_SAMPLING_END = 85
+PROGRESS_DECODING = 87
+PROGRESS_ENCODING = 92
+PROGRESS_DOWNLOADING = 96
+
+# Errors raised by both the sync and async paths
+COMFYUI_UNREACHABLE = "Could not connect to ComfyUI. Check if it's running."
+UPLOAD_FAILED = "Failed to upload image to ComfyUI"
+QUEUE_FAILED = "Failed to queue workflow in ComfyUI. Check ComfyUI logs for errors."
+
+# Node classes whose execution time is reported as a job phase
+NODE_PHASES = {
+    "UNETLoader": "model_load",
+    "CLIPLoader": "model_load",
+    "CLIPVisionLoader": "model_load",
+    "VAELoader": "model_load",
+    "KSampler": "sampling",
+    "VAEDecode": "vae_decode",
+    "VHS_VideoCombine": "video_encode",
+}
+
+
+def report_progress(progress_callback: Optional[ProgressCallback], **update):
+    """Send an update to progress_callback, never letting it break generation"""
+    if progress_callback is None:
+        return
+    try:
+        progress_callback(update)
+    except Exception as e:
+        logger.debug("progress callback failed: %s", e)
+
+
+def record_prompt_phases(state, node_classes: Dict[str, str], queued_at: float):
+    """
+    Observe the ComfyUI-side phases of a finished prompt.
+
+    Uses the timings the event stream collected on its PromptState: queue wait
+    until execution_start, then the time spent in loader, sampler, decode and
+    encode nodes. Prompts without event timings (polled, resumed) are skipped.
+    """
+    if state is None or state.started_at is None:
+        return
+    metrics.PHASE_SECONDS.observe(max(0.0, state.started_at - queued_at), phase="queue_wait")
+    totals: Dict[str, float] = {}
+    for node_id, seconds in state.node_seconds.items():
+        phase = NODE_PHASES.get(node_classes.get(node_id))
+        if phase:
+            totals[phase] = totals.get(phase, 0.0) + seconds
+    for phase, seconds in totals.items():
+        metrics.PHASE_SECONDS.observe(seconds, phase=phase)
 
 
 class VideoGenerator(ABC):
     """Abstract base class for video generators"""
     
     @abstractmethod
-    def generate(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False) -> Optional[str]:
+    def generate(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False,
+                 progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
         """Generate a video from an image and prompt. Returns path to output video."""
         pass
+    
+    def resume(self, prompt_id: str, progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Reattach to a job queued before a restart. Backends that can't do this return None."""
+        return None
+    
+    async def agenerate(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False,
+                        progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """
+        generate() for the event loop.
+        
+        This default runs generate() in a worker thread; backends override it
+        with a native implementation that holds no thread while waiting.
+        """
+        return await asyncio.to_thread(self.generate, image_path, prompt, duration_seconds,
+                                       fast_mode=fast_mode, progress_callback=progress_callback)
+    
+    async def aresume(self, prompt_id: str, progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """resume() for the event loop (worker thread unless overridden)"""
+        return await asyncio.to_thread(self.resume, prompt_id, progress_callback=progress_callback)
+    
+    def generate_batch(self, image_path: str, variants: List[Dict[str, Any]],
+                       progress_callbacks: Optional[List[Optional[ProgressCallback]]] = None) -> List[Any]:
+        """
+        Generate one video per variant from a single image.
+        
+        Each variant is a dict with "prompt", "duration" and optionally "fast_mode".
+        Returns one entry per variant, in order: the video path, None if no video
+        was produced, or the exception that variant raised. This default just
+        runs generate() for each variant in turn.
+        """
+        callbacks = progress_callbacks or [None] * len(variants)
+        results: List[Any] = []
+        for variant, callback in zip(variants, callbacks):
+            try:
+                results.append(self.generate(image_path, variant["prompt"], variant["duration"],
+                                             fast_mode=variant.get("fast_mode", False), progress_callback=callback))
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    async def agenerate_batch(self, image_path: str, variants: List[Dict[str, Any]],
+                              progress_callbacks: Optional[List[Optional[ProgressCallback]]] = None) -> List[Any]:
+        """generate_batch() for the event loop (worker thread unless overridden)"""
+        return await asyncio.to_thread(self.generate_batch, image_path, variants, progress_callbacks)
 
 
 class LocalComfyUIGenerator(VideoGenerator):
     """Local ComfyUI-based video generator"""
     
-    def __init__(self, comfyui_path: str = "comfyui", workflow_path: str = "workflows/video_generation.json"):
+    def __init__(self, comfyui_path: str = "comfyui", workflow_path: str = "workflows/video_generation.json",
+                 stream_frames: bool = os.getenv("PIXELDOJO_STREAM_FRAMES", "true").lower() == "true"):
         self.comfy = ComfyUIWrapper(comfyui_path)
+        # Pipe image-sequence outputs straight into ffmpeg instead of a temp dir
+        self.stream_frames = stream_frames
         # Handle both relative and absolute paths
         if Path(workflow_path).is_absolute():
             self.workflow_path = Path(workflow_path)
         else:
             # Assume workflow is relative to backend directory
             self.workflow_path = Path(__file__).parent.parent / workflow_path
+        # Parsed once; re-read only when the file changes on disk
+        self.template = WorkflowTemplate(self.workflow_path)
         # Output directory relative to backend
         self.output_dir = Path(__file__).parent.parent / "outputs"
         self.output_dir.mkdir(exist_ok=True)
+        # Identical inputs reproduce identical videos (the workflow pins its seed)
+        cache_mb = int(os.getenv("PIXELDOJO_RESULT_CACHE_MB", "10240"))
+        self.result_cache = ResultCache(self.output_dir / "cache", cache_mb * 1024 * 1024)
     
-    def _load_workflow(self) -> Dict[str, Any]:
-        """Load the workflow template"""
-        if not self.workflow_path.exists():
-            raise FileNotFoundError(f"Workflow not found: {self.workflow_path}")
-        
-        with open(self.workflow_path, 'r') as f:
-            return json.load(f)
-    
-    def _inject_image_and_prompt(self, workflow: Dict[str, Any], image_filename: str, prompt: str, duration_seconds: int = 5, fast_mode: bool = False) -> Dict[str, Any]:
-        """Inject image, prompt, and duration into workflow. If fast_mode, also apply speed optimizations."""
-        
-        # Calculate frame count for duration
-        # Wan model uses 16fps, and length must be (multiple of 4) + 1
-        fps = 16
-        raw_frames = duration_seconds * fps
-        # Round to nearest valid value: (multiple of 4) + 1
-        frame_count = ((raw_frames // 4) * 4) + 1
-        # Clamp between reasonable limits
-        frame_count = max(17, min(frame_count, 481))  # 17 frames (~1s) to 481 frames (~30s)
-        
-        print(f"DEBUG: Duration {duration_seconds}s -> {frame_count} frames at {fps}fps")
-        
-        for node_id, node_data in workflow.items():
-            if isinstance(node_data, dict):
-                # Look for image input nodes (typically LoadImage)
-                if node_data.get("class_type") == "LoadImage":
-                    node_data["inputs"]["image"] = image_filename
-                
-                # Look for text prompt nodes (typically CLIPTextEncode with "Positive" in title)
-                if node_data.get("class_type") == "CLIPTextEncode":
-                    if node_data.get("_meta", {}).get("title") == "Positive Prompt":
-                        node_data["inputs"]["text"] = prompt
-                
-                # Set frame count in WanImageToVideo node
-                if node_data.get("class_type") == "WanImageToVideo":
-                    node_data["inputs"]["length"] = frame_count
-                    print(f"DEBUG: Set WanImageToVideo length to {frame_count}")
-                    
-                    # Fast mode: also lower resolution
-                    if fast_mode:
-                        node_data["inputs"]["width"] = 640
-                        node_data["inputs"]["height"] = 384
-                        print(f"DEBUG: Fast mode - reduced resolution to 640x384")
-                
-                # Fast mode optimizations
-                if fast_mode:
-                    # Reduce steps from 30 to 15 (aggressive)
-                    if node_data.get("class_type") == "KSampler":
-                        original_steps = node_data["inputs"].get("steps", 30)
-                        node_data["inputs"]["steps"] = 15
-                        # Lower CFG for faster convergence
-                        node_data["inputs"]["cfg"] = 3.5
-                        print(f"DEBUG: Fast mode - reduced steps from {original_steps} to 15, CFG to 3.5")
-                    
-                    # Use FP8 quantization for faster inference
-                    if node_data.get("class_type") == "UNETLoader":
-                        original_dtype = node_data["inputs"].get("weight_dtype", "default")
-                        node_data["inputs"]["weight_dtype"] = "fp8_e4m3fn"
-                        print(f"DEBUG: Fast mode - changed weight_dtype from {original_dtype} to fp8_e4m3fn")
-        
-        return workflow
-    
-    def generate(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False) -> Optional[str]:
-        """Generate video using local ComfyUI"""
-        print(f"DEBUG: Starting generation with image={image_path}, prompt={prompt}, fast_mode={fast_mode}")
-        
-        # Ensure ComfyUI is running
+    def result_key(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False,
+                   image_digest: Optional[str] = None) -> str:
+        """Cache key for a job: the fully injected workflow plus the input image's content hash"""
+        # The uploaded filename can vary, so key on a placeholder and the image bytes instead
+        workflow = self._build_workflow("<input-image>", prompt, duration_seconds=duration_seconds, fast_mode=fast_mode)
+        return result_cache_key(workflow, image_digest or sha256_file(image_path))
+    
+    def lookup_cached(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False) -> Optional[str]:
+        """Return a previously generated video for exactly these inputs, if cached"""
+        if not self.result_cache.enabled:
+            return None
+        return self.result_cache.get(self.result_key(image_path, prompt, duration_seconds, fast_mode))
+    
+    def _build_workflow(self, image_filename: str, prompt: str, duration_seconds: int = 5, fast_mode: bool = False) -> Dict[str, Any]:
+        """Render the workflow template with image, prompt, and duration. If fast_mode, also apply speed optimizations."""
+        params = job_params(duration_seconds, fast_mode)
+        logger.debug("Duration %ss -> %s frames at %sfps%s", duration_seconds, params['length'], FPS,
+                     " (fast mode)" if fast_mode else "")
+        return self.template.render(image=image_filename, prompt=prompt, **params)
+    
+    def _progress_listener(self, progress_callback: ProgressCallback):
+        """Translate ComfyUI node events into job progress updates"""
+        node_classes = self.template.class_types()
+        
+        def on_event(state, event_type):
+            node_class = node_classes.get(state.current_node)
+            if event_type == "progress" and node_class == "KSampler" and state.progress_max:
+                span = PROGRESS_SAMPLING_END - PROGRESS_SAMPLING_START
+                progress = PROGRESS_SAMPLING_START + int(span * state.progress_value / state.progress_max)
+                report_progress(progress_callback, progress=progress, phase="sampling",
+                                message=f"Sampling step {state.progress_value}/{state.progress_max}")
+            elif event_type == "executing" and node_class == "VAEDecode":
+                report_progress(progress_callback, progress=PROGRESS_DECODING, phase="decoding",
+                                message="Decoding frames")
+            elif event_type == "executing" and node_class == "VHS_VideoCombine":
+                report_progress(progress_callback, progress=PROGRESS_ENCODING, phase="encoding",
+                                message="Encoding video")
+            elif event_type == "executing" and node_class in ("UNETLoader", "CLIPLoader", "CLIPVisionLoader"):
+                report_progress(progress_callback, progress=PROGRESS_QUEUED, phase="loading",
+                                message="Loading models")
+        
+        return on_event
+    
+    def _ensure_comfyui(self):
+        """Start (or reach) ComfyUI and follow its event stream"""
         if not self.comfy.is_running():
-            print("DEBUG: ComfyUI not running, attempting to start...")
+            logger.debug("ComfyUI not running, attempting to start...")
             if not self.comfy.start():
-                print("ERROR: Failed to start/connect to ComfyUI")
-                raise RuntimeError("Could not connect to ComfyUI. Check if it's running.")
+                logger.error("Failed to start/connect to ComfyUI")
+                raise RuntimeError(COMFYUI_UNREACHABLE)
+        logger.debug("ComfyUI is running at %s", self.comfy.base_url)
+        # Listen for completion events before queueing so none are missed
+        self.comfy.start_event_stream()
+    
+    async def _aensure_comfyui(self):
+        """Event-loop twin of _ensure_comfyui()"""
+        if not await self.comfy.ais_running():
+            logger.debug("ComfyUI not running, attempting to start...")
+            # Launching a local ComfyUI process is a one-off; let a thread wait for it
+            if not await asyncio.to_thread(self.comfy.start):
+                logger.error("Failed to start/connect to ComfyUI")
+                raise RuntimeError(COMFYUI_UNREACHABLE)
+        logger.debug("ComfyUI is running at %s", self.comfy.base_url)
+        await self.comfy.astart_event_stream()
+    
+    def _variant_workflow(self, image_filename: str, variant: Dict[str, Any]) -> Dict[str, Any]:
+        return self._build_workflow(image_filename, variant["prompt"], duration_seconds=variant["duration"],
+                                    fast_mode=variant.get("fast_mode", False))
+    
+    def _upload_may_be_stale(self, image_filename: str, queued_any: bool) -> bool:
+        """After a failed queue: whether to upload the image again and retry (once, before anything queued)"""
+        if queued_any or not self.comfy.upload_cache.forget_name(image_filename):
+            return False
+        # A cached upload may be gone (e.g. ComfyUI's input dir was cleared)
+        logger.debug("Queue failed with a cached upload, re-uploading image and retrying")
+        return True
+    
+    def _on_queued(self, prompt_id: str, workflow: Dict[str, Any], progress_callback: Optional[ProgressCallback],
+                   tracker):
+        """Bookkeeping once a prompt is in ComfyUI's queue: model affinity, progress, event listener"""
+        logger.debug("Prompt queued with ID: %s", prompt_id)
+        self.comfy.use_model(self.template.model_key(workflow))
+        report_progress(progress_callback, progress=PROGRESS_QUEUED, phase="queued",
+                        message="Waiting for ComfyUI", prompt_id=prompt_id)
+        if progress_callback is not None:
+            tracker.add_listener(prompt_id, self._progress_listener(progress_callback))
+    
+    @staticmethod
+    def _single_result(results: List[Any]) -> Optional[str]:
+        """Unwrap a one-variant batch result, raising what the variant raised"""
+        if isinstance(results[0], Exception):
+            raise results[0]
+        return results[0]
+    
+    @staticmethod
+    def _resumable(prompt_id: str, history: Optional[Dict[str, Any]], queue: Dict[str, Any]) -> bool:
+        """Whether ComfyUI still knows a prompt (finished, running or pending)"""
+        if history and prompt_id in history:
+            return True
+        queued_ids = {item[1] for item in queue.get("queue_running", []) + queue.get("queue_pending", [])}
+        if prompt_id not in queued_ids:
+            logger.debug("Prompt %s is unknown to ComfyUI; cannot resume", prompt_id)
+            return False
+        return True
+    
+    def generate(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False,
+                 progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Generate video using local ComfyUI (a batch of one)"""
+        variant = {"prompt": prompt, "duration": duration_seconds, "fast_mode": fast_mode}
+        return self._single_result(self.generate_batch(image_path, [variant], [progress_callback]))
+    
+    def resume(self, prompt_id: str, progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Reattach to a prompt queued before a restart and return its output path"""
+        if not self.comfy.is_running():
+            raise RuntimeError(COMFYUI_UNREACHABLE)
+        history = self.comfy.get_history(prompt_id)
+        queue = {} if history and prompt_id in history else self.comfy.get_queue_status()
+        if not self._resumable(prompt_id, history, queue):
+            return None
         
-        print(f"DEBUG: ComfyUI is running at {self.comfy.base_url}")
+        logger.debug("Resuming prompt %s", prompt_id)
+        report_progress(progress_callback, phase="queued", message="Reattached to ComfyUI job")
+        # Its events go to the client that queued it, so poll /history instead
+        return self._wait_for_completion(prompt_id, progress_callback=progress_callback, use_events=False)
+    
+    async def agenerate(self, image_path: str, prompt: str, duration_seconds: int, fast_mode: bool = False,
+                        progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """
+        Event-loop twin of generate().
         
-        # Upload image
-        print(f"DEBUG: Uploading image {image_path}...")
-        image_filename = self.comfy.upload_image(image_path)
+        Every wait (HTTP, event stream, polling, downloads) is awaited, so a job
+        occupies no thread while ComfyUI works. Only short CPU or disk steps
+        (hashing, cache links, frame encodes) borrow a thread.
+        """
+        variant = {"prompt": prompt, "duration": duration_seconds, "fast_mode": fast_mode}
+        return self._single_result(await self.agenerate_batch(image_path, [variant], [progress_callback]))
+    
+    async def aresume(self, prompt_id: str, progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Event-loop twin of resume()"""
+        if not await self.comfy.ais_running():
+            raise RuntimeError(COMFYUI_UNREACHABLE)
+        history = await self.comfy.aget_history(prompt_id)
+        queue = {} if history and prompt_id in history else await self.comfy.aget_queue_status()
+        if not self._resumable(prompt_id, history, queue):
+            return None
+        
+        logger.debug("Resuming prompt %s", prompt_id)
+        report_progress(progress_callback, phase="queued", message="Reattached to ComfyUI job")
+        return await self._await_completion(prompt_id, progress_callback=progress_callback, use_events=False)
+    
+    async def _await_completion(self, prompt_id: str, timeout: int = 1200, poll_interval: float = 2,
+                                progress_callback: Optional[ProgressCallback] = None,
+                                use_events: bool = True) -> Optional[str]:
+        """Async _wait_for_completion, driven by async_tracker"""
+        start_time = time.time()
+        tracker = self.comfy.async_tracker
+        outputs = None
+        
+        with metrics.span("wait", prompt_id=prompt_id):
+            if use_events and tracker is not None and tracker.connected:
+                finished = await tracker.wait(prompt_id, timeout)
+                if finished is False:
+                    logger.error("Timed out waiting for prompt %s", prompt_id)
+                    return None
+                if finished is None:
+                    logger.debug("Event stream dropped while waiting, polling /history instead")
+                else:
+                    state = tracker.get_state(prompt_id)
+                    if state and state.error:
+                        logger.error("ComfyUI reported an error for %s: %s", prompt_id, state.error)
+            
+            while time.time() - start_time < timeout:
+                metrics.HISTORY_POLLS.inc()
+                history = await self.comfy.aget_history(prompt_id)
+                if history and prompt_id in history:
+                    logger.debug("Found history for %s", prompt_id)
+                    outputs = history[prompt_id].get("outputs", {})
+                    break
+                
+                # Once the stream says we're done, history is moments away
+                state = tracker.get_state(prompt_id) if tracker is not None else None
+                await asyncio.sleep(0.25 if state and state.finished else poll_interval)
+        
+        if outputs is None:
+            return None
+        if tracker is not None:
+            record_prompt_phases(tracker.get_state(prompt_id), self.template.class_types(), start_time)
+        with metrics.span("download", prompt_id=prompt_id):
+            return await self._asave_outputs(outputs, progress_callback)
+    
+    async def _asave_outputs(self, outputs: Dict[str, Any],
+                             progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Async _save_outputs"""
+        report_progress(progress_callback, progress=PROGRESS_DOWNLOADING, phase="downloading",
+                        message="Downloading video")
+        video_urls, frame_urls = self._output_urls(outputs)
+        session = await self.comfy.get_async_session()
+        
+        for video_url in video_urls:
+            output_path = self._new_output_path()
+            digest = await async_download_to_file(session, video_url, output_path)
+            if digest:
+                logger.debug("Video saved to %s (sha256 %s)", output_path, digest[:12])
+                return str(await asyncio.to_thread(ensure_faststart, output_path))
+            logger.error("Failed to download video %s", video_url)
+        
+        if not frame_urls:
+            logger.debug("No video or image outputs found")
+            return None
+        # Image-sequence workflows are the exception; their download + encode borrows a thread
+        return await asyncio.to_thread(self._encode_frames, frame_urls)
+    
+    async def aclose(self):
+        """Release the async client (event stream and aiohttp session)"""
+        await self.comfy.aclose()
+    
+    def _batch_cache_lookup(self, image_path: str, variants: List[Dict[str, Any]],
+                            image_digest: str) -> Tuple[List[Any], List[Optional[str]]]:
+        """(results with result-cache hits filled in, cache keys) for a batch"""
+        results: List[Any] = [None] * len(variants)
+        keys: List[Optional[str]] = [None] * len(variants)
+        if self.result_cache.enabled:
+            for i, variant in enumerate(variants):
+                keys[i] = self.result_key(image_path, variant["prompt"], variant["duration"],
+                                          variant.get("fast_mode", False), image_digest=image_digest)
+                results[i] = self.result_cache.get(keys[i])
+                if results[i]:
+                    logger.debug("Result cache hit for variant %s: %s", i, results[i])
+        return results, keys
+    
+    @staticmethod
+    def _batch_queue_order(variants: List[Dict[str, Any]], pending: List[int]) -> List[int]:
+        """
+        Order in which to queue a batch's variants.
+        
+        fast_mode loads the UNet in another dtype, so variants are grouped by it
+        (the first variant's mode first, otherwise keeping submission order) and
+        ComfyUI swaps weights at most once per batch.
+        """
+        if not pending:
+            return []
+        first_mode = bool(variants[pending[0]].get("fast_mode"))
+        return sorted(pending, key=lambda i: bool(variants[i].get("fast_mode")) != first_mode)
+    
+    def generate_batch(self, image_path: str, variants: List[Dict[str, Any]],
+                       progress_callbacks: Optional[List[Optional[ProgressCallback]]] = None) -> List[Any]:
+        """
+        Generate every variant from one upload, with all prompts queued back to back.
+        
+        The image is hashed and uploaded once and every prompt is queued before
+        the first is waited on, so ComfyUI runs them without idle gaps and with
+        the models still resident.
+        """
+        logger.debug("Starting batch of %s variants with image=%s", len(variants), image_path)
+        callbacks = progress_callbacks or [None] * len(variants)
+        digest = sha256_file(image_path)
+        results, cache_keys = self._batch_cache_lookup(image_path, variants, digest)
+        order = self._batch_queue_order(variants, [i for i, result in enumerate(results) if not result])
+        if not order:
+            return results
+        
+        self._ensure_comfyui()
+        for i in order:
+            report_progress(callbacks[i], progress=PROGRESS_UPLOADING, phase="uploading", message="Uploading image")
+        with metrics.span("upload"):
+            image_filename = self.comfy.upload_image(image_path, digest=digest)
         if not image_filename:
-            print("ERROR: Failed to upload image")
-            raise RuntimeError("Failed to upload image to ComfyUI")
-        print(f"DEBUG: Image uploaded as {image_filename}")
+            raise RuntimeError(UPLOAD_FAILED)
+        
+        prompt_ids: Dict[int, str] = {}
+        for i in order:
+            workflow = self._variant_workflow(image_filename, variants[i])
+            with metrics.span("queue"):
+                prompt_id = self.comfy.queue_prompt(workflow)
+                if not prompt_id and self._upload_may_be_stale(image_filename, bool(prompt_ids)):
+                    image_filename = self.comfy.upload_image(image_path, digest=digest)
+                    if not image_filename:
+                        raise RuntimeError(UPLOAD_FAILED)
+                    workflow = self.template.apply(workflow, image=image_filename)
+                    prompt_id = self.comfy.queue_prompt(workflow)
+            if not prompt_id:
+                results[i] = RuntimeError(QUEUE_FAILED)
+                continue
+            prompt_ids[i] = prompt_id
+            self._on_queued(prompt_id, workflow, callbacks[i], self.comfy.tracker)
+        logger.debug("Queued %s/%s batch prompts", len(prompt_ids), len(order))
         
-        # Load and prepare workflow
-        print(f"DEBUG: Loading workflow from {self.workflow_path}")
-        workflow = self._load_workflow()
-        workflow = self._inject_image_and_prompt(workflow, image_filename, prompt, duration_seconds=duration_seconds, fast_mode=fast_mode)
+        # ComfyUI runs them in queue order, so waiting in that order costs nothing
+        for i, prompt_id in prompt_ids.items():
+            try:
+                results[i] = self._wait_for_completion(prompt_id, progress_callback=callbacks[i])
+            except Exception as e:
+                results[i] = e
+                continue
+            if results[i] and cache_keys[i]:
+                self.result_cache.put(cache_keys[i], results[i])
+        return results
+    
+    async def agenerate_batch(self, image_path: str, variants: List[Dict[str, Any]],
+                              progress_callbacks: Optional[List[Optional[ProgressCallback]]] = None) -> List[Any]:
+        """Event-loop twin of generate_batch(); the variants are awaited concurrently"""
+        logger.debug("Starting batch of %s variants with image=%s", len(variants), image_path)
+        callbacks = progress_callbacks or [None] * len(variants)
+        digest = await asyncio.to_thread(sha256_file, image_path)
+        results, cache_keys = await asyncio.to_thread(self._batch_cache_lookup, image_path, variants, digest)
+        order = self._batch_queue_order(variants, [i for i, result in enumerate(results) if not result])
+        if not order:
+            return results
         
-        # Queue prompt
-        print("DEBUG: Queuing video generation...")
-        prompt_id = self.comfy.queue_prompt(workflow)
+        await self._aensure_comfyui()
+        for i in order:
+            report_progress(callbacks[i], progress=PROGRESS_UPLOADING, phase="uploading", message="Uploading image")
+        with metrics.span("upload"):
+            image_filename = await self.comfy.aupload_image(image_path, digest=digest)
+        if not image_filename:
+            raise RuntimeError(UPLOAD_FAILED)
         
-        if not prompt_id:
-            print("ERROR: Failed to queue prompt")
-            raise RuntimeError("Failed to queue workflow in ComfyUI. Check ComfyUI logs for errors.")
+        prompt_ids: Dict[int, str] = {}
+        for i in order:
+            workflow = self._variant_workflow(image_filename, variants[i])
+            with metrics.span("queue"):
+                prompt_id = await self.comfy.aqueue_prompt(workflow)
+                if not prompt_id and self._upload_may_be_stale(image_filename, bool(prompt_ids)):
+                    image_filename = await self.comfy.aupload_image(image_path, digest=digest)
+                    if not image_filename:
+                        raise RuntimeError(UPLOAD_FAILED)
+                    workflow = self.template.apply(workflow, image=image_filename)
+                    prompt_id = await self.comfy.aqueue_prompt(workflow)
+            if not prompt_id:
+                results[i] = RuntimeError(QUEUE_FAILED)
+                continue
+            prompt_ids[i] = prompt_id
+            self._on_queued(prompt_id, workflow, callbacks[i], self.comfy.async_tracker)
+        logger.debug("Queued %s/%s batch prompts", len(prompt_ids), len(order))
         
-        print(f"DEBUG: Prompt queued with ID: {prompt_id}")
+        async def finish(i: int, prompt_id: str):
+            try:
+                results[i] = await self._await_completion(prompt_id, progress_callback=callbacks[i])
+            except Exception as e:
+                results[i] = e
+                return
+            if results[i] and cache_keys[i]:
+                await asyncio.to_thread(self.result_cache.put, cache_keys[i], results[i])
         
-        # Wait for completion
-        return self._wait_for_completion(prompt_id)
+        await asyncio.gather(*(finish(i, prompt_id) for i, prompt_id in prompt_ids.items()))
+        return results
     
-    def _wait_for_completion(self, prompt_id: str, timeout: int = 1200) -> Optional[str]:
+    def _wait_for_completion(self, prompt_id: str, timeout: int = 1200, poll_interval: float = 2,
+                             progress_callback: Optional[ProgressCallback] = None,
+                             use_events: bool = True) -> Optional[str]:
         """Wait for a prompt to complete and return the output path"""
         start_time = time.time()
+        outputs = None
         
-        while time.time() - start_time < timeout:
-            # Check history
-            history = self.comfy.get_history(prompt_id)
-            if history and prompt_id in history:
-                print(f"DEBUG: Found history for {prompt_id}")
-                outputs = history[prompt_id].get("outputs", {})
-                
-                # First check for VHS video outputs (gifs key contains videos too)
-                for node_id, node_output in outputs.items():
-                    if "gifs" in node_output:
-                        for video in node_output["gifs"]:
-                            filename = video["filename"]
-                            subfolder = video.get("subfolder", "")
-                            type_ = video.get("type", "output")
-                            
-                            print(f"DEBUG: Found VHS video output: {filename}")
-                            
-                            # Download the video file
-                            video_url = f"{self.comfy.base_url}/view?filename={filename}&subfolder={subfolder}&type={type_}"
-                            
-                            try:
-                                response = requests.get(video_url)
-                                if response.status_code == 200:
-                                    output_filename = f"video_{int(time.time())}.mp4"
-                                    output_path = self.output_dir / output_filename
-                                    self.output_dir.mkdir(parents=True, exist_ok=True)
-                                    
-                                    with open(output_path, "wb") as f:
-                                        f.write(response.content)
-                                    
-                                    print(f"DEBUG: Video saved to {output_path}")
-                                    return str(output_path)
-                                else:
-                                    print(f"ERROR: Failed to download video: {response.status_code}")
-                            except Exception as e:
-                                print(f"ERROR: Exception downloading video: {e}")
-                
-                # Fallback: Check for image outputs and stitch them
-                image_files = []
-                for node_id, node_output in outputs.items():
-                    if "images" in node_output:
-                        for image in node_output["images"]:
-                            image_files.append(image)
-                
-                if not image_files:
-                    print("DEBUG: No video or image outputs found")
+        with metrics.span("wait", prompt_id=prompt_id):
+            # Prefer the event stream: it tells us the moment the prompt is done
+            if use_events and self.comfy.tracker.connected:
+                finished = self.comfy.tracker.wait(prompt_id, timeout)
+                if finished is False:
+                    logger.error("Timed out waiting for prompt %s", prompt_id)
                     return None
+                if finished is None:
+                    logger.debug("Event stream dropped while waiting, polling /history instead")
+                else:
+                    state = self.comfy.tracker.get_state(prompt_id)
+                    if state and state.error:
+                        logger.error("ComfyUI reported an error for %s: %s", prompt_id, state.error)
+            
+            while time.time() - start_time < timeout:
+                # Check history
+                metrics.HISTORY_POLLS.inc()
+                history = self.comfy.get_history(prompt_id)
+                if history and prompt_id in history:
+                    logger.debug("Found history for %s", prompt_id)
+                    outputs = history[prompt_id].get("outputs", {})
+                    break
                 
-                print(f"DEBUG: Found {len(image_files)} frames. Downloading and stitching...")
+                # Once the stream says we're done, history is moments away
+                state = self.comfy.tracker.get_state(prompt_id)
+                time.sleep(0.25 if state and state.finished else poll_interval)
+        
+        if outputs is None:
+            return None
+        record_prompt_phases(self.comfy.tracker.get_state(prompt_id), self.template.class_types(), start_time)
+        with metrics.span("download", prompt_id=prompt_id):
+            return self._save_outputs(outputs, progress_callback)
+    
+    def _output_urls(self, outputs: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+        """(video URLs, frame image URLs) among a finished prompt's outputs"""
+        video_urls = []
+        frame_urls = []
+        for node_id, node_output in outputs.items():
+            # VHS video outputs (gifs key contains videos too)
+            for video in node_output.get("gifs", []):
+                logger.debug("Found VHS video output: %s", video['filename'])
+                video_urls.append(f"{self.comfy.base_url}/view?filename={video['filename']}"
+                                  f"&subfolder={video.get('subfolder', '')}&type={video.get('type', 'output')}")
+            for img in node_output.get("images", []):
+                frame_urls.append(f"{self.comfy.base_url}/view?filename={img['filename']}"
+                                  f"&subfolder={img['subfolder']}&type={img['type']}")
+        return video_urls, frame_urls
+    
+    def _new_output_path(self) -> Path:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Unique even for jobs finishing in the same second
+        return self.output_dir / f"video_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
+    
+    def _save_outputs(self, outputs: Dict[str, Any], progress_callback: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Download a finished prompt's outputs and return the local video path"""
+        report_progress(progress_callback, progress=PROGRESS_DOWNLOADING, phase="downloading",
+                        message="Downloading video")
+        video_urls, frame_urls = self._output_urls(outputs)
+        
+        for video_url in video_urls:
+            output_path = self._new_output_path()
+            # Stream to disk so large clips never sit in memory
+            digest = download_to_file(self.comfy.session, video_url, output_path)
+            if digest:
+                logger.debug("Video saved to %s (sha256 %s)", output_path, digest[:12])
+                return str(ensure_faststart(output_path))
+            logger.error("Failed to download video %s", video_url)
+        
+        # Fallback: stitch image outputs
+        if not frame_urls:
+            logger.debug("No video or image outputs found")
+            return None
+        return self._encode_frames(frame_urls)
+    
+    def _encode_frames(self, frame_urls: List[str]) -> Optional[str]:
+        """Download image-sequence outputs and encode them into a video"""
+        logger.debug("Found %s frames. Downloading and stitching...", len(frame_urls))
+        output_path = self._new_output_path()
+        
+        if self.stream_frames:
+            # Encode while frames are still arriving; no disk round trip
+            if encode_frame_stream(iter_frames(self.comfy.session, frame_urls), output_path, fps=16):
+                logger.debug("Video saved to %s", output_path)
+                return str(output_path)
+            logger.error("Streaming encode failed")
+            return None
+        
+        # Create temp directory for frames
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            
+            # Download all frames in parallel, saved with sequential naming for ffmpeg
+            frame_paths = download_frames(self.comfy.session, frame_urls, temp_path)
+            
+            if not frame_paths:
+                logger.error("Failed to download any frames")
+                return None
                 
-                # Create temp directory for frames
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    temp_path = Path(temp_dir)
-                    frame_paths = []
-                    
-                    # Download all frames
-                    for i, img in enumerate(image_files):
-                        filename = img["filename"]
-                        subfolder = img["subfolder"]
-                        type_ = img["type"]
-                        
-                        img_url = f"{self.comfy.base_url}/view?filename={filename}&subfolder={subfolder}&type={type_}"
-                        
-                        try:
-                            response = requests.get(img_url)
-                            if response.status_code == 200:
-                                # Save with sequential naming for ffmpeg
-                                frame_name = f"frame_{i:05d}.png"
-                                frame_path = temp_path / frame_name
-                                with open(frame_path, "wb") as f:
-                                    f.write(response.content)
-                                frame_paths.append(frame_path)
-                            else:
-                                print(f"Error downloading frame {filename}: {response.status_code}")
-                        except Exception as e:
-                            print(f"Exception downloading frame {filename}: {e}")
-                    
-                    if not frame_paths:
-                        print("ERROR: Failed to download any frames")
-                        return None
-                        
-                    # Stitch with ffmpeg
-                    output_filename = f"video_{int(time.time())}.mp4"
-                    output_path = self.output_dir / output_filename
-                    self.output_dir.mkdir(parents=True, exist_ok=True)
-                    
-                    # ffmpeg command: 16 fps, glob pattern for inputs
-                    ffmpeg_cmd = [
-                        "ffmpeg",
-                        "-y",
-                        "-framerate", "16",
-                        "-i", str(temp_path / "frame_%05d.png"),
-                        "-c:v", "libx264",
-                        "-pix_fmt", "yuv420p",
-                        str(output_path)
-                    ]
-                    
-                    print(f"DEBUG: Running ffmpeg: {' '.join(ffmpeg_cmd)}")
-                    try:
-                        subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
-                        print(f"DEBUG: Video saved to {output_path}")
-                        return str(output_path)
-                    except subprocess.CalledProcessError as e:
-                        print(f"ERROR: ffmpeg failed: {e.stderr.decode()}")
-                        return None
+            # Stitch with ffmpeg
+            # ffmpeg command: 16 fps, glob pattern for inputs
+            ffmpeg_cmd = [
+                "ffmpeg",
+                "-y",
+                "-framerate", "16",
+                "-i", str(temp_path / "frame_%05d.png"),
+                "-c:v", "libx264",
+                "-pix_fmt", "yuv420p",
+                "-movflags", "+faststart",
+                str(output_path)
+            ]
             
-            time.sleep(2)
-        
-        return None
+            logger.debug("Running ffmpeg: %s", ' '.join(ffmpeg_cmd))
+            try:
+                subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+                logger.debug("Video saved to %s", output_path)
+                return str(output_path)
+            except subprocess.CalledProcessError as e:
+                logger.error("ffmpeg failed: %s", e.stderr.decode())
+                return None
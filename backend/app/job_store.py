@@ -0,0 +1,290 @@
+"""
+Persistent job records for the API.
+
+Job state lives outside the process so it survives restarts and can be shared
+by several uvicorn workers. `JobStore` is the interface; `SQLiteJobStore` is
+the default (WAL mode, safe for concurrent readers and writers on one host)
+and `MemoryJobStore` is a process-local implementation for tests and
+single-process use.
+
+In-flight jobs carry an owner and a lease. The owning process renews its
+leases periodically; any process may claim jobs whose lease has expired (e.g.
+after a crash or restart) and reattach to their ComfyUI prompt_id.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+
+# Statuses after which a job never changes again
+FINISHED_STATUSES = ("completed", "failed")
+
+
+class JobStore(ABC):
+    """Interface for job record storage"""
+
+    @abstractmethod
+    def create(self, job_id: str, owner: Optional[str] = None, lease_seconds: float = 0, **fields) -> Dict[str, Any]:
+        """Insert a new job record and return it"""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job record, or None if unknown"""
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """Merge fields into a job record and return the new record (None if unknown)"""
+
+    @abstractmethod
+    def delete(self, job_id: str) -> bool:
+        """Remove a job record"""
+
+    @abstractmethod
+    def list_jobs(self, status: Optional[str] = None, older_than: Optional[float] = None,
+                  limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """List jobs, optionally filtered by status and last update before older_than (epoch secs)"""
+
+    @abstractmethod
+    def evict_finished(self, ttl_seconds: float) -> int:
+        """Delete finished jobs not updated for ttl_seconds. Returns the number removed."""
+
+    @abstractmethod
+    def renew_leases(self, owner: str, lease_seconds: float) -> int:
+        """Extend the lease on every in-flight job owned by owner"""
+
+    @abstractmethod
+    def claim_orphans(self, owner: str, lease_seconds: float) -> List[Dict[str, Any]]:
+        """Atomically take over in-flight jobs whose lease has expired"""
+
+
+def _merge(record: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    record = dict(record)
+    record.update(fields)
+    record["updated_at"] = time.time()
+    return record
+
+
+class MemoryJobStore(JobStore):
+    """Process-local job store (state is lost on restart)"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, owner=None, lease_seconds=0, **fields):
+        now = time.time()
+        record = dict(fields, job_id=job_id, created_at=now, updated_at=now,
+                      owner=owner, lease_expires=now + lease_seconds)
+        with self._lock:
+            self._jobs[job_id] = record
+            return dict(record)
+
+    def get(self, job_id):
+        with self._lock:
+            record = self._jobs.get(job_id)
+            return dict(record) if record else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id not in self._jobs:
+                return None
+            self._jobs[job_id] = _merge(self._jobs[job_id], fields)
+            return dict(self._jobs[job_id])
+
+    def delete(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None) is not None
+
+    def list_jobs(self, status=None, older_than=None, limit=None):
+        with self._lock:
+            jobs = [
+                dict(r) for r in self._jobs.values()
+                if (status is None or r.get("status") == status)
+                and (older_than is None or r["updated_at"] < older_than)
+            ]
+        jobs.sort(key=lambda r: r["created_at"])
+        return jobs[:limit] if limit else jobs
+
+    def evict_finished(self, ttl_seconds):
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, r in self._jobs.items()
+                if r.get("status") in FINISHED_STATUSES and r["updated_at"] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def renew_leases(self, owner, lease_seconds):
+        expires = time.time() + lease_seconds
+        renewed = 0
+        with self._lock:
+            for r in self._jobs.values():
+                if r.get("owner") == owner and r.get("status") not in FINISHED_STATUSES:
+                    r["lease_expires"] = expires
+                    renewed += 1
+        return renewed
+
+    def claim_orphans(self, owner, lease_seconds):
+        now = time.time()
+        claimed = []
+        with self._lock:
+            for r in self._jobs.values():
+                if r.get("status") not in FINISHED_STATUSES and r.get("lease_expires", 0) < now:
+                    r["owner"] = owner
+                    r["lease_expires"] = now + lease_seconds
+                    claimed.append(dict(r))
+        return claimed
+
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLite-backed job store in WAL mode.
+
+    Frequently filtered attributes (status, timestamps, lease) are real,
+    indexed columns; everything else is kept in a JSON `data` column.
+    """
+
+    _COLUMNS = ("job_id", "status", "created_at", "updated_at", "owner", "lease_expires")
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                lease_expires REAL NOT NULL DEFAULT 0,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated_at);
+            CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; the generator reports progress from worker threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _to_record(self, row: sqlite3.Row) -> Dict[str, Any]:
+        record = json.loads(row["data"])
+        for column in self._COLUMNS:
+            record[column] = row[column]
+        return record
+
+    def _write(self, conn: sqlite3.Connection, record: Dict[str, Any]):
+        data = {k: v for k, v in record.items() if k not in self._COLUMNS}
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, created_at, updated_at, owner, lease_expires, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (record["job_id"], record.get("status") or "unknown", record["created_at"], record["updated_at"],
+             record.get("owner"), record.get("lease_expires") or 0, json.dumps(data)),
+        )
+
+    def create(self, job_id, owner=None, lease_seconds=0, **fields):
+        now = time.time()
+        record = dict(fields, job_id=job_id, created_at=now, updated_at=now,
+                      owner=owner, lease_expires=now + lease_seconds)
+        self._write(self._conn(), record)
+        return record
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_record(row) if row else None
+
+    def update(self, job_id, **fields):
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent merges don't interleave
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            record = _merge(self._to_record(row), fields)
+            self._write(conn, record)
+            conn.execute("COMMIT")
+            return record
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, job_id):
+        cursor = self._conn().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return cursor.rowcount > 0
+
+    def list_jobs(self, status=None, older_than=None, limit=None):
+        query = "SELECT * FROM jobs WHERE 1=1"
+        params: List[Any] = []
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if older_than is not None:
+            query += " AND updated_at < ?"
+            params.append(older_than)
+        query += " ORDER BY created_at"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [self._to_record(row) for row in self._conn().execute(query, params)]
+
+    def evict_finished(self, ttl_seconds):
+        placeholders = ",".join("?" for _ in FINISHED_STATUSES)
+        cursor = self._conn().execute(
+            f"DELETE FROM jobs WHERE status IN ({placeholders}) AND updated_at < ?",
+            (*FINISHED_STATUSES, time.time() - ttl_seconds),
+        )
+        return cursor.rowcount
+
+    def renew_leases(self, owner, lease_seconds):
+        placeholders = ",".join("?" for _ in FINISHED_STATUSES)
+        cursor = self._conn().execute(
+            f"UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status NOT IN ({placeholders})",
+            (time.time() + lease_seconds, owner, *FINISHED_STATUSES),
+        )
+        return cursor.rowcount
+
+    def claim_orphans(self, owner, lease_seconds):
+        conn = self._conn()
+        now = time.time()
+        placeholders = ",".join("?" for _ in FINISHED_STATUSES)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE status NOT IN ({placeholders}) AND lease_expires < ?",
+                (*FINISHED_STATUSES, now),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                conn.execute(
+                    "UPDATE jobs SET owner = ?, lease_expires = ? WHERE job_id = ?",
+                    (owner, now + lease_seconds, row["job_id"]),
+                )
+                record = self._to_record(row)
+                record["owner"] = owner
+                record["lease_expires"] = now + lease_seconds
+                claimed.append(record)
+            conn.execute("COMMIT")
+            return claimed
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
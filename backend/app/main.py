@@ -1,16 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pathlib import Path
+import asyncio
+import logging
+import json
+import socket
 import uuid
 import shutil
 import os
-from typing import Optional
+from typing import Optional, Awaitable
 from .generator import LocalComfyUIGenerator
+from .parallel_generator import ParallelVideoGenerator
+from .worker_pool import ComfyWorker, WorkerPool, parse_worker_urls
+from .job_store import JobStore, SQLiteJobStore, FINISHED_STATUSES
+from .upload_cache import sha256_stream, content_filename
+from .video_response import video_response
+from . import metrics
+from .scheduler import (JobScheduler, QueueFullError, parse_concurrency,
+                        PRIORITY_FAST, PRIORITY_FULL, PRIORITY_RECOVERED)
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
+# Level for the app's own loggers; DEBUG adds per-phase spans and ComfyUI traffic
+LOG_LEVEL = os.getenv("PIXELDOJO_LOG_LEVEL", "INFO").upper()
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logging.getLogger(__package__).setLevel(LOG_LEVEL)
+
 app = FastAPI(title="PixelDojo API", version="1.0.0")
 
 # CORS middleware for local development
@@ -27,13 +46,237 @@ app.add_middleware(
 # Initialize generator (paths relative to backend directory)
 import os
 backend_dir = Path(__file__).parent.parent
-generator = LocalComfyUIGenerator(
-    comfyui_path=str(backend_dir / "comfyui"),
-    workflow_path=str(backend_dir / "workflows" / "video_generation.json")
+workflow_path = str(backend_dir / "workflows" / "video_generation.json")
+
+# COMFYUI_WORKERS switches to chunked generation across a pool of ComfyUI pods;
+# otherwise the pool just health-checks the single local/remote instance
+WORKER_URLS = parse_worker_urls(os.getenv("COMFYUI_WORKERS"))
+if WORKER_URLS:
+    worker_pool = WorkerPool(WORKER_URLS)
+    generator = ParallelVideoGenerator(workflow_path=workflow_path, pool=worker_pool)
+    GENERATOR_BACKEND = "parallel"
+else:
+    generator = LocalComfyUIGenerator(
+        comfyui_path=str(backend_dir / "comfyui"),
+        workflow_path=workflow_path
+    )
+    worker_pool = WorkerPool([generator.comfy.base_url])
+    GENERATOR_BACKEND = "local"
+# The in-progress (re)start of a local ComfyUI, if any
+comfyui_start_task: Optional[asyncio.Task] = None
+
+# Guards the worker admin endpoints when set
+ADMIN_TOKEN = os.getenv("PIXELDOJO_ADMIN_TOKEN")
+
+# Persistent job records, shared by all API workers on this host
+job_store: JobStore = SQLiteJobStore(os.getenv("PIXELDOJO_JOB_DB", str(backend_dir / "jobs.db")))
+
+# Identifies this process as the owner of the jobs it runs
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+# In-flight jobs whose lease isn't renewed for this long are taken over by another process
+JOB_LEASE_SECONDS = 60
+# Finished jobs are evicted after this many seconds
+JOB_TTL_SECONDS = float(os.getenv("PIXELDOJO_JOB_TTL", str(24 * 3600)))
+MAINTENANCE_INTERVAL = 20
+
+# Bounded queue in front of the generator; overflow gets 429
+scheduler = JobScheduler(
+    max_queue=int(os.getenv("PIXELDOJO_MAX_QUEUE", "50")),
+    concurrency=parse_concurrency(os.getenv("PIXELDOJO_CONCURRENCY", "2")),
 )
+# Suggested client back-off when the queue is full
+RETRY_AFTER_SECONDS = 30
+# Most variants one /generate/batch request may carry
+MAX_BATCH_VARIANTS = int(os.getenv("PIXELDOJO_MAX_BATCH", "16"))
+# A batch waits in the scheduler as one entry: its id -> the variant job ids
+batch_jobs: dict[str, list[str]] = {}
+
+# Per-job queues of live /status/{job_id}/stream clients
+job_subscribers: dict[str, set[asyncio.Queue]] = {}
+event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Seconds between keep-alive comments on idle status streams, and between
+# store re-reads (catches updates made by other worker processes)
+STREAM_KEEPALIVE = 15
+STREAM_POLL_INTERVAL = 2
+
+# Internal bookkeeping not returned by /status
+PRIVATE_JOB_FIELDS = ("owner", "lease_expires", "image_path", "prompt_text", "preview_path")
+
+
+def public_job(record: dict) -> dict:
+    job = {k: v for k, v in record.items() if k not in PRIVATE_JOB_FIELDS}
+    if record.get("preview_path") and record.get("status") == "processing":
+        # Partial video of the chunks finished so far (parallel backend)
+        job["preview_url"] = f"/video/{record['job_id']}/preview"
+    return job
+
+
+@app.on_event("startup")
+async def on_startup():
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    worker_pool.start()
+    if GENERATOR_BACKEND == "local":
+        # Keeps the ComfyUI health cache warm when COMFYUI_HEARTBEAT_INTERVAL is set
+        generator.comfy.start_heartbeat()
+        # Cold-start a local ComfyUI now rather than inside the first job, and
+        # again whenever it stops answering: it is the only worker
+        restart_local_comfyui()
+        worker_pool.on_eject = restart_local_comfyui
+    scheduler.on_change = publish_queue_positions
+    asyncio.create_task(job_maintenance_loop())
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await scheduler.stop()
+    if GENERATOR_BACKEND == "parallel":
+        await generator.close()
+    else:
+        await generator.aclose()
+        await worker_pool.stop()
+
+
+async def warm_start_comfyui():
+    try:
+        # Launching the ComfyUI process blocks while it boots, so that part gets a thread
+        if await asyncio.to_thread(generator.comfy.start):
+            await generator.comfy.astart_event_stream()
+            # Readmit now instead of after the breaker cooldown
+            for worker in worker_pool.workers:
+                await worker_pool.probe(worker)
+    except Exception as e:
+        logger.error("Could not start ComfyUI: %s", e)
+
+
+def restart_local_comfyui(worker: Optional[ComfyWorker] = None):
+    """(Re)start the local ComfyUI unless a start is already underway"""
+    global comfyui_start_task
+    if comfyui_start_task is not None and not comfyui_start_task.done():
+        return
+    if worker is not None:
+        logger.warning("Local ComfyUI was ejected (%s), restarting it", worker.last_error)
+    comfyui_start_task = asyncio.create_task(warm_start_comfyui())
+
+
+async def job_maintenance_loop():
+    """Renew our job leases, adopt orphaned jobs and evict old finished ones"""
+    while True:
+        try:
+            await asyncio.to_thread(job_store.renew_leases, WORKER_ID, JOB_LEASE_SECONDS)
+            orphans = await asyncio.to_thread(job_store.claim_orphans, WORKER_ID, JOB_LEASE_SECONDS)
+            for job in orphans:
+                await recover_job(job)
+            evicted = await asyncio.to_thread(job_store.evict_finished, JOB_TTL_SECONDS)
+            if evicted:
+                logger.debug("Evicted %s finished jobs", evicted)
+        except Exception as e:
+            logger.error("Job maintenance failed: %s", e)
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+def job_runner(job_id: str, image_path: str, prompt: str, duration: int, fast_mode: bool = False):
+    """The scheduler callable that generates one job on the configured backend"""
+    if GENERATOR_BACKEND == "parallel":
+        return lambda: parallel_video_task(job_id, image_path, prompt, duration, fast_mode)
+    return lambda: generate_video_task(job_id, image_path, prompt, duration, fast_mode)
+
+
+async def recover_job(job: dict):
+    """Continue a job whose previous owner went away"""
+    job_id = job["job_id"]
+    if job.get("prompt_id") and GENERATOR_BACKEND == "local":
+        logger.debug("Reattaching job %s to ComfyUI prompt %s", job_id, job['prompt_id'])
+        run = lambda: resume_video_task(job_id, job["prompt_id"])
+    elif job.get("image_path") and os.path.exists(job["image_path"]):
+        logger.debug("Restarting job %s that never finished", job_id)
+        run = job_runner(job_id, job["image_path"], job["prompt_text"], job["duration"], job.get("fast_mode", False))
+    else:
+        await update_job(job_id, status="failed", phase="failed", message="Interrupted by server restart")
+        return
+    # Recovered work jumps the queue and is never refused
+    asyncio.create_task(scheduler.submit(job_id, run, priority=PRIORITY_RECOVERED,
+                                         backend=GENERATOR_BACKEND, force=True))
+
+
+def publish_queue_positions(backend: str):
+    """Tell streaming clients of still-queued jobs their new position"""
+    positions = [(job_id, position)
+                 for position, entry_id in enumerate(scheduler.queued_job_ids(backend), start=1)
+                 for job_id in batch_jobs.get(entry_id, (entry_id,))
+                 if job_subscribers.get(job_id)]
+    if positions:
+        asyncio.create_task(_publish_positions(positions))
+
+
+async def _publish_positions(positions: list[tuple[str, int]]):
+    for job_id, position in positions:
+        record = await asyncio.to_thread(job_store.get, job_id)
+        if record is not None:
+            _publish(job_id, dict(public_job(record), queue_position=position,
+                                  message=f"Queued (position {position})"))
+
 
-# Store job status
-job_status: dict[str, dict] = {}
+def _publish(job_id: str, snapshot: dict):
+    for queue in job_subscribers.get(job_id, ()):
+        queue.put_nowait(snapshot)
+
+
+async def update_job(job_id: str, **fields):
+    """Merge fields into a job record and push it to any streaming clients.
+
+    The store write (SQLite, possibly waiting on another process's lock) runs
+    in a thread, like the lease loop's, so it never stalls the event loop.
+    """
+    record = await asyncio.to_thread(job_store.update, job_id, **fields)
+    if record is not None and job_subscribers.get(job_id):
+        _publish(job_id, public_job(record))
+    return record
+
+
+class JobProgress:
+    """
+    A job's progress callback that coalesces updates into the store.
+
+    Sampling reports every step, so updates are merged in memory and written
+    by at most one in-flight update_job per job; whatever arrives meanwhile
+    goes out in the next write. Call flush() before recording the outcome so
+    a late progress write cannot land on top of it.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.pending: dict = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def __call__(self, update: dict):
+        """Safe to call from the event loop or a generator's worker thread"""
+        try:
+            on_loop = asyncio.get_running_loop() is event_loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._add(update)
+        elif event_loop is not None:
+            event_loop.call_soon_threadsafe(self._add, update)
+
+    def _add(self, update: dict):
+        self.pending.update(update)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self.pending:
+            fields, self.pending = self.pending, {}
+            try:
+                await update_job(self.job_id, **fields)
+            except Exception as e:
+                logger.warning("Could not record progress for job %s: %s", self.job_id, e)
+
+    async def flush(self):
+        if self.task is not None:
+            await self.task
 
 
 @app.get("/")
@@ -46,37 +289,146 @@ async def health():
     return {"status": "healthy"}
 
 
-def generate_video_task(job_id: str, image_path: str, prompt: str, duration: int, fast_mode: bool = False):
-    """Background task for video generation"""
+async def generate_video_task(job_id: str, image_path: str, prompt: str, duration: int, fast_mode: bool = False):
+    """Scheduled task for video generation (runs on the event loop; holds no thread while waiting)"""
+    await update_job(
+        job_id,
+        status="processing",
+        phase="starting",
+        message=f"Starting generation...{' (Fast Mode)' if fast_mode else ''}"
+    )
+    
+    progress = JobProgress(job_id)
+    await run_video_job(job_id, generator.agenerate(image_path, prompt, duration, fast_mode=fast_mode,
+                                                    progress_callback=progress), progress)
+
+
+async def resume_video_task(job_id: str, prompt_id: str):
+    """Background task that reattaches to an already-queued ComfyUI prompt"""
+    progress = JobProgress(job_id)
+    await run_video_job(job_id, generator.aresume(prompt_id, progress_callback=progress), progress)
+
+
+async def parallel_video_task(job_id: str, image_path: str, prompt: str, duration: int, fast_mode: bool = False):
+    """Scheduled task for chunked generation across the worker pool (runs on the event loop)"""
+    await update_job(
+        job_id,
+        status="processing",
+        phase="starting",
+        message=f"Starting generation...{' (Fast Mode)' if fast_mode else ''}"
+    )
+    
+    progress = JobProgress(job_id)
+    await run_video_job(job_id, generator.generate_parallel(image_path, prompt, duration, fast_mode=fast_mode,
+                                                            progress_callback=progress), progress)
+
+
+async def batch_video_task(batch_id: str, image_path: str, job_ids: list[str], variants: list[dict]):
+    """Scheduled task for a batch: one upload, with every variant's prompt queued together"""
+    batch_jobs.pop(batch_id, None)
+    if GENERATOR_BACKEND == "parallel":
+        # Each variant already spreads across the whole pool, so run them one after another
+        for job_id, variant in zip(job_ids, variants):
+            await parallel_video_task(job_id, image_path, variant["prompt"], variant["duration"],
+                                      variant["fast_mode"])
+        return
+    
+    callbacks = []
+    for job_id, variant in zip(job_ids, variants):
+        await update_job(
+            job_id,
+            status="processing",
+            phase="starting",
+            message=f"Starting generation...{' (Fast Mode)' if variant['fast_mode'] else ''}"
+        )
+        callbacks.append(JobProgress(job_id))
+    
     try:
-        video_path = generator.generate(image_path, prompt, duration, fast_mode=fast_mode)
-        
-        if video_path:
-            job_status[job_id] = {
-                "status": "completed",
-                "progress": 100,
-                "message": "Generation complete",
-                "video_path": video_path
-            }
+        results = await generator.agenerate_batch(image_path, variants, progress_callbacks=callbacks)
+    except Exception as e:
+        results = [e] * len(job_ids)
+    for job_id, result, progress in zip(job_ids, results, callbacks):
+        await progress.flush()
+        if isinstance(result, Exception):
+            await record_job_failure(job_id, result)
         else:
-            job_status[job_id] = {
-                "status": "failed",
-                "progress": 0,
-                "message": "Generation failed - no video produced",
-                "video_path": None
-            }
+            await record_job_result(job_id, result)
+
+
+async def run_video_job(job_id: str, produce_video: Awaitable[Optional[str]], progress: JobProgress):
+    """Await a generation coroutine and record its outcome on the job"""
+    try:
+        video_path = await produce_video
     except Exception as e:
-        job_status[job_id] = {
-            "status": "failed",
-            "progress": 0,
-            "message": str(e),
-            "video_path": None
-        }
+        await progress.flush()
+        await record_job_failure(job_id, e)
+        return
+    await progress.flush()
+    await record_job_result(job_id, video_path)
+
+
+def observe_job(record: Optional[dict]):
+    """Count a finished job and its time from submission in the job metrics"""
+    if record is None:
+        return
+    metrics.JOBS.inc(backend=GENERATOR_BACKEND, status=record["status"])
+    metrics.JOB_SECONDS.observe(record["updated_at"] - record["created_at"],
+                                backend=GENERATOR_BACKEND, status=record["status"])
+
+
+async def record_job_result(job_id: str, video_path: Optional[str]):
+    if video_path:
+        record = await update_job(
+            job_id,
+            status="completed",
+            progress=100,
+            phase="completed",
+            message="Generation complete",
+            video_path=video_path
+        )
+    else:
+        record = await update_job(
+            job_id,
+            status="failed",
+            phase="failed",
+            message="Generation failed - no video produced",
+            video_path=None
+        )
+    observe_job(record)
+
+
+async def record_job_failure(job_id: str, error: Exception):
+    observe_job(await update_job(
+        job_id,
+        status="failed",
+        phase="failed",
+        message=str(error),
+        video_path=None
+    ))
+
+
+def save_upload(image: UploadFile) -> Path:
+    """Store an uploaded image content-addressed in uploads/ and return its path"""
+    upload_dir = Path("uploads")
+    upload_dir.mkdir(exist_ok=True)
+    
+    image.file.seek(0)
+    digest = sha256_stream(image.file)
+    image_path = upload_dir / content_filename(digest, image.filename or "image.png")
+    if image_path.exists():
+        return image_path
+    
+    # Write to a temp name first so concurrent requests never see a partial file
+    image.file.seek(0)
+    partial_path = image_path.with_name(f"{image_path.name}.{uuid.uuid4().hex[:8]}.part")
+    with open(partial_path, "wb") as buffer:
+        shutil.copyfileobj(image.file, buffer)
+    os.replace(partial_path, image_path)
+    return image_path
 
 
 @app.post("/generate")
 async def generate_video(
-    background_tasks: BackgroundTasks,
     image: UploadFile = File(...),
     prompt: str = Form(...),
     duration: int = Form(30),
@@ -88,54 +440,390 @@ async def generate_video(
     # Parse fast_mode from string to boolean
     is_fast_mode = fast_mode.lower() == "true"
     
-    # Save uploaded image
-    upload_dir = Path("uploads")
-    upload_dir.mkdir(exist_ok=True)
-    image_path = upload_dir / f"{job_id}_{image.filename}"
+    # Save uploaded image under its content hash; repeat images are already on disk
+    image_path = await asyncio.to_thread(save_upload, image)
     
-    with open(image_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+    # Exact repeat of an earlier job: answer from the result cache, no GPU time
+    cached_path = None
+    if GENERATOR_BACKEND == "local":
+        cached_path = await asyncio.to_thread(generator.lookup_cached, str(image_path), prompt, duration, is_fast_mode)
+    if cached_path:
+        await asyncio.to_thread(
+            job_store.create,
+            job_id,
+            image_path=str(image_path),
+            prompt_text=prompt,
+            duration=duration,
+            fast_mode=is_fast_mode,
+            status="completed",
+            progress=100,
+            phase="completed",
+            message="Generation complete (cached)",
+            video_path=cached_path,
+            cached=True
+        )
+        return {
+            "job_id": job_id,
+            "status": "completed",
+            "cached": True,
+            "message": "Returned cached result"
+        }
+    
+    # No admitted ComfyUI worker: fail fast instead of queueing behind a dead or cold backend
+    if not worker_pool.available():
+        raise HTTPException(status_code=503, detail="No healthy ComfyUI workers available, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    
+    # Refuse rather than accept work we can't queue
+    if scheduler.is_full(GENERATOR_BACKEND):
+        raise HTTPException(status_code=429, detail="Generation queue is full, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
     
     # Initialize job status
-    job_status[job_id] = {
-        "status": "processing",
-        "progress": 0,
-        "message": f"Starting generation...{' (Fast Mode)' if is_fast_mode else ''}",
-        "video_path": None
-    }
+    await asyncio.to_thread(
+        job_store.create,
+        job_id,
+        owner=WORKER_ID,
+        lease_seconds=JOB_LEASE_SECONDS,
+        image_path=str(image_path),
+        prompt_text=prompt,
+        duration=duration,
+        fast_mode=is_fast_mode,
+        status="queued",
+        progress=0,
+        phase="queued",
+        message="Queued",
+        video_path=None
+    )
     
-    # Start background task
-    background_tasks.add_task(generate_video_task, job_id, str(image_path), prompt, duration, is_fast_mode)
+    # Hand the job to the scheduler; fast jobs go ahead of full-quality ones
+    try:
+        position = await scheduler.submit(
+            job_id,
+            job_runner(job_id, str(image_path), prompt, duration, is_fast_mode),
+            priority=PRIORITY_FAST if is_fast_mode else PRIORITY_FULL,
+            backend=GENERATOR_BACKEND
+        )
+    except QueueFullError as e:
+        # The upload stays: it is content-addressed and may be shared with other jobs
+        await asyncio.to_thread(job_store.delete, job_id)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
     
     return {
         "job_id": job_id,
-        "status": "processing",
-        "message": "Generation started"
+        "status": "queued",
+        "queue_position": position,
+        "message": "Generation queued"
+    }
+
+
+def parse_variants(spec: str, duration: int, fast_mode: bool) -> list[dict]:
+    """Validate the JSON variant list of a batch request; duration and fast_mode fill in defaults"""
+    try:
+        items = json.loads(spec)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="variants must be a JSON array")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="variants must be a non-empty JSON array")
+    if len(items) > MAX_BATCH_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_VARIANTS} variants per batch")
+    
+    variants = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("prompt"), str) or not item["prompt"]:
+            raise HTTPException(status_code=400, detail="Each variant needs a prompt")
+        variant_fast = item.get("fast_mode", fast_mode)
+        if isinstance(variant_fast, str):
+            variant_fast = variant_fast.lower() == "true"
+        try:
+            variant_duration = int(item.get("duration", duration))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Variant durations must be integers")
+        variants.append({"prompt": item["prompt"], "duration": variant_duration, "fast_mode": bool(variant_fast)})
+    return variants
+
+
+@app.post("/generate/batch")
+async def generate_video_batch(
+    image: UploadFile = File(...),
+    variants: str = Form(...),
+    duration: int = Form(30),
+    fast_mode: str = Form("false")
+):
+    """
+    Generate several videos from one image.
+    
+    variants is a JSON array of {"prompt", "duration"?, "fast_mode"?} objects;
+    each variant becomes its own job, trackable through /status/{job_id}.
+    """
+    batch_id = str(uuid.uuid4())
+    variant_list = parse_variants(variants, duration, fast_mode.lower() == "true")
+    image_path = await asyncio.to_thread(save_upload, image)
+    
+    jobs = []
+    pending_ids, pending_variants = [], []
+    for variant in variant_list:
+        job_id = str(uuid.uuid4())
+        cached_path = None
+        if GENERATOR_BACKEND == "local":
+            cached_path = await asyncio.to_thread(generator.lookup_cached, str(image_path), variant["prompt"],
+                                                  variant["duration"], variant["fast_mode"])
+        jobs.append({"job_id": job_id, "prompt": variant["prompt"], "cached": bool(cached_path),
+                     "status": "completed" if cached_path else "queued"})
+        if cached_path:
+            await asyncio.to_thread(
+                job_store.create,
+                job_id,
+                batch_id=batch_id,
+                image_path=str(image_path),
+                prompt_text=variant["prompt"],
+                duration=variant["duration"],
+                fast_mode=variant["fast_mode"],
+                status="completed",
+                progress=100,
+                phase="completed",
+                message="Generation complete (cached)",
+                video_path=cached_path,
+                cached=True
+            )
+        else:
+            pending_ids.append(job_id)
+            pending_variants.append(variant)
+    
+    if not pending_ids:
+        return {"batch_id": batch_id, "jobs": jobs, "status": "completed", "message": "Returned cached results"}
+    
+    if not worker_pool.available():
+        raise HTTPException(status_code=503, detail="No healthy ComfyUI workers available, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    if scheduler.is_full(GENERATOR_BACKEND):
+        raise HTTPException(status_code=429, detail="Generation queue is full, try again later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    
+    for job_id, variant in zip(pending_ids, pending_variants):
+        await asyncio.to_thread(
+            job_store.create,
+            job_id,
+            owner=WORKER_ID,
+            lease_seconds=JOB_LEASE_SECONDS,
+            batch_id=batch_id,
+            image_path=str(image_path),
+            prompt_text=variant["prompt"],
+            duration=variant["duration"],
+            fast_mode=variant["fast_mode"],
+            status="queued",
+            progress=0,
+            phase="queued",
+            message="Queued",
+            video_path=None
+        )
+    
+    # The whole batch is one scheduler entry, so its prompts reach ComfyUI together
+    batch_jobs[batch_id] = pending_ids
+    all_fast = all(variant["fast_mode"] for variant in pending_variants)
+    try:
+        position = await scheduler.submit(
+            batch_id,
+            lambda: batch_video_task(batch_id, str(image_path), pending_ids, pending_variants),
+            priority=PRIORITY_FAST if all_fast else PRIORITY_FULL,
+            backend=GENERATOR_BACKEND
+        )
+    except QueueFullError as e:
+        batch_jobs.pop(batch_id, None)
+        for job_id in pending_ids:
+            await asyncio.to_thread(job_store.delete, job_id)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    
+    return {
+        "batch_id": batch_id,
+        "jobs": jobs,
+        "status": "queued",
+        "queue_position": position,
+        "message": f"Batch of {len(pending_ids)} queued"
     }
 
 
 @app.get("/status/{job_id}")
 async def get_status(job_id: str):
     """Get the status of a generation job"""
-    if job_id not in job_status:
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    return job_status[job_id]
+    status = public_job(job)
+    # Batch variants wait in the scheduler under their batch id
+    position = scheduler.position(job.get("batch_id") or job_id)
+    if position is not None:
+        status["queue_position"] = position
+        status["message"] = f"Queued (position {position})"
+    return status
+
+
+@app.get("/queue")
+async def get_queue():
+    """Scheduler occupancy per backend"""
+    return scheduler.stats()
+
+
+def require_admin(token: Optional[str]):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.get("/workers")
+async def list_workers():
+    """Health, VRAM, queue and model-affinity metrics for every ComfyUI worker"""
+    snapshot = worker_pool.snapshot()
+    if GENERATOR_BACKEND == "local":
+        # The local generator queues through its own client, which tracks the loaded model
+        for worker in snapshot["workers"]:
+            worker.update(loaded_model=generator.comfy.loaded_model, model_reloads=generator.comfy.model_reloads)
+        snapshot["model_reloads"] = generator.comfy.model_reloads
+    return dict(snapshot, backend=GENERATOR_BACKEND)
+
+
+def collect_live_metrics():
+    """Refresh the worker and scheduler gauges (and per-worker totals) for a /metrics scrape"""
+    live_metrics = (metrics.WORKER_UP, metrics.WORKER_BUSY, metrics.WORKER_QUEUE_DEPTH,
+                     metrics.WORKER_SECONDS_PER_FRAME, metrics.WORKER_VRAM_FREE, metrics.WORKER_MODEL_RELOADS,
+                     metrics.WORKER_CHUNKS, metrics.SCHEDULER_JOBS)
+    # Start over each scrape so removed workers drop out
+    for metric in live_metrics:
+        metric.clear()
+    for worker in worker_pool.workers:
+        metrics.WORKER_UP.set(int(worker.available), worker=worker.name)
+        metrics.WORKER_BUSY.set(int(worker.busy), worker=worker.name)
+        metrics.WORKER_QUEUE_DEPTH.set(worker.queue_depth, worker=worker.name)
+        if worker.seconds_per_frame is not None:
+            metrics.WORKER_SECONDS_PER_FRAME.set(worker.seconds_per_frame, worker=worker.name)
+        if worker.vram_free is not None:
+            metrics.WORKER_VRAM_FREE.set(worker.vram_free, worker=worker.name)
+        # The local generator tracks model switches on its own client (see /workers)
+        reloads = generator.comfy.model_reloads if GENERATOR_BACKEND == "local" else worker.model_reloads
+        metrics.WORKER_MODEL_RELOADS.set(reloads, worker=worker.name)
+        metrics.WORKER_CHUNKS.set(worker.chunks_done, worker=worker.name, outcome="done")
+        metrics.WORKER_CHUNKS.set(worker.chunks_failed, worker=worker.name, outcome="failed")
+    for backend, stats in scheduler.stats().items():
+        metrics.SCHEDULER_JOBS.set(stats["queued"], backend=backend, state="queued")
+        metrics.SCHEDULER_JOBS.set(stats["running"], backend=backend, state="running")
+
+
+metrics.add_collector(collect_live_metrics)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition: job and phase timings, ComfyUI traffic, caches, workers"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.post("/workers")
+async def add_worker(url: str = Form(...), name: Optional[str] = Form(None),
+                     x_admin_token: Optional[str] = Header(None)):
+    """Add a ComfyUI worker to the pool at runtime"""
+    require_admin(x_admin_token)
+    if GENERATOR_BACKEND != "parallel":
+        raise HTTPException(status_code=409, detail="Set COMFYUI_WORKERS to run with a worker pool")
+    worker = worker_pool.add_worker(url, name)
+    await worker_pool.probe(worker)
+    return worker.status()
 
 
-@app.get("/video/{job_id}")
-async def get_video(job_id: str):
-    """Download the generated video"""
-    if job_id not in job_status:
+@app.delete("/workers/{name}")
+async def remove_worker(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Remove a ComfyUI worker; chunks already running on it finish first"""
+    require_admin(x_admin_token)
+    if GENERATOR_BACKEND != "parallel":
+        raise HTTPException(status_code=409, detail="Set COMFYUI_WORKERS to run with a worker pool")
+    if not worker_pool.remove_worker(name):
+        raise HTTPException(status_code=404, detail="Worker not found")
+    return {"removed": name}
+
+
+@app.get("/status/{job_id}/stream")
+async def stream_status(job_id: str, request: Request):
+    """Push job status updates as Server-Sent Events until the job finishes"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    video_path = job_status[job_id].get("video_path")
-    if not video_path or not os.path.exists(video_path):
-        raise HTTPException(status_code=404, detail="Video not found")
+    queue: asyncio.Queue = asyncio.Queue()
+    job_subscribers.setdefault(job_id, set()).add(queue)
     
-    return FileResponse(
-        video_path,
-        media_type="video/mp4",
-        filename=f"pixeldojo_{job_id}.mp4"
+    async def events():
+        try:
+            snapshot = public_job(job)
+            idle = 0.0
+            while True:
+                yield f"data: {json.dumps(snapshot)}\n\n"
+                if snapshot.get("status") in FINISHED_STATUSES:
+                    return
+                
+                while True:
+                    try:
+                        snapshot = await asyncio.wait_for(queue.get(), STREAM_POLL_INTERVAL)
+                        break
+                    except asyncio.TimeoutError:
+                        # The job may be running in another worker process
+                        latest = await asyncio.to_thread(job_store.get, job_id)
+                        if latest is None:
+                            return
+                        if latest["updated_at"] != snapshot.get("updated_at"):
+                            snapshot = public_job(latest)
+                            break
+                        idle += STREAM_POLL_INTERVAL
+                        if idle >= STREAM_KEEPALIVE:
+                            idle = 0.0
+                            if await request.is_disconnected():
+                                return
+                            yield ": keep-alive\n\n"
+                
+                # Collapse bursts (e.g. sampling steps) into the latest state
+                while not queue.empty():
+                    snapshot = queue.get_nowait()
+        finally:
+            subscribers = job_subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    job_subscribers.pop(job_id, None)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+
+@app.api_route("/video/{job_id}/preview", methods=["GET", "HEAD"])
+async def get_video_preview(job_id: str, request: Request):
+    """The part of a running job's video that is ready so far (fragmented MP4, grows as chunks finish)"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    preview_path = job.get("preview_path")
+    if job.get("status") != "processing" or not preview_path:
+        raise HTTPException(status_code=404, detail="No preview available")
+    
+    try:
+        return await video_response(request, preview_path, cache_control="no-store")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="No preview available")
+
+
+@app.api_route("/video/{job_id}", methods=["GET", "HEAD"])
+async def get_video(job_id: str, request: Request):
+    """Download or stream the generated video (supports Range and conditional requests)"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    video_path = job.get("video_path")
+    if not video_path:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    try:
+        return await video_response(request, video_path, filename=f"pixeldojo_{job_id}.mp4")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Video not found")
@@ -0,0 +1,242 @@
+"""
+Process-wide metrics in the Prometheus text format, and timing spans.
+
+A small registry rather than prometheus_client: counters, gauges and
+histograms only need a dict and a lock. Gauges that mirror live state
+(workers, scheduler queues) are filled in at scrape time by collectors
+registered with add_collector().
+
+Values live in the process that serves the scrape. Under `uvicorn --workers N`
+each worker process keeps its own registry (and its own worker pool and
+scheduler), so every sample carries a `pid` label. Sum over it in queries, and
+expect one scrape to see only the process that answered it.
+
+`span(phase)` times one phase of a job (upload, queue, sampling, stitch, ...)
+into pixeldojo_phase_seconds and logs it at DEBUG level.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds; covers a quick upload through a full-quality chunk
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    # Tell apart the processes of a multi-worker deployment
+    pairs = list(zip(names, values)) + [("pid", str(os.getpid()))]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """For a counter: mirror a monotonic total kept elsewhere (e.g. on a ComfyWorker)"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["counts"][i] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(entry['sum'])}")
+                lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Call collector() before every scrape, to refresh gauges from live state"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", getattr(collector, "__name__", collector), e)
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+# Jobs and phases
+JOBS = counter("pixeldojo_jobs_total", "Finished jobs by backend and outcome", ("backend", "status"))
+JOB_SECONDS = histogram("pixeldojo_job_seconds", "Time from submission to a finished job", ("backend", "status"))
+PHASE_SECONDS = histogram("pixeldojo_phase_seconds", "Time spent in each phase of a job", ("phase",))
+CHUNK_SECONDS = histogram("pixeldojo_chunk_seconds", "Wall time of one parallel chunk attempt", ("worker",))
+CHUNK_RETRIES = counter("pixeldojo_chunk_retries_total", "Parallel chunks requeued after a failure or timeout")
+SPECULATIVE_CHUNKS = counter("pixeldojo_speculative_chunks_total", "Tail chunks speculatively re-run on another worker")
+
+# ComfyUI traffic
+COMFYUI_REQUESTS = counter("pixeldojo_comfyui_requests_total", "HTTP requests sent to ComfyUI", ("endpoint",))
+COMFYUI_RETRIES = counter("pixeldojo_comfyui_retries_total",
+                          "ComfyUI requests retried after a connection error or gateway status")
+HISTORY_POLLS = counter("pixeldojo_history_polls_total", "/history polls while waiting for a prompt")
+CACHE_LOOKUPS = counter("pixeldojo_cache_lookups_total", "Upload and result cache lookups", ("cache", "result"))
+
+# Live state, refreshed by collectors at scrape time
+WORKER_UP = gauge("pixeldojo_worker_up", "1 while a worker's circuit is not open", ("worker",))
+WORKER_BUSY = gauge("pixeldojo_worker_busy", "1 while a worker runs a chunk", ("worker",))
+WORKER_QUEUE_DEPTH = gauge("pixeldojo_worker_queue_depth", "Prompts other clients queued on a worker", ("worker",))
+WORKER_SECONDS_PER_FRAME = gauge("pixeldojo_worker_seconds_per_frame", "Measured seconds per frame of a worker",
+                                 ("worker",))
+WORKER_VRAM_FREE = gauge("pixeldojo_worker_vram_free_bytes", "Free VRAM reported by a worker", ("worker",))
+WORKER_MODEL_RELOADS = counter("pixeldojo_worker_model_reloads_total", "Model switches a worker has made", ("worker",))
+WORKER_CHUNKS = counter("pixeldojo_worker_chunks_total", "Chunks a worker has finished, by outcome",
+                        ("worker", "outcome"))
+SCHEDULER_JOBS = gauge("pixeldojo_scheduler_jobs", "Jobs queued or running per backend", ("backend", "state"))
+
+
+def endpoint_label(path: str) -> str:
+    """Collapse a request path to its route (/history/<id> -> /history) to bound label cardinality"""
+    parts = [part for part in path.split("?", 1)[0].split("/") if part]
+    if not parts:
+        return "/"
+    if parts[0] == "upload" and len(parts) > 1:
+        return f"/upload/{parts[1]}"
+    return f"/{parts[0]}"
+
+
+@contextmanager
+def span(phase: str, **fields) -> Iterator[None]:
+    """Time a block into pixeldojo_phase_seconds{phase} and log it at DEBUG"""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "failed"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        PHASE_SECONDS.observe(elapsed, phase=phase)
+        if logger.isEnabledFor(logging.DEBUG):
+            extra = "".join(f" {key}={value}" for key, value in fields.items())
+            logger.debug("span phase=%s seconds=%.3f outcome=%s%s", phase, elapsed, outcome, extra)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def add_collector(collector: Callable[[], None]):
+    REGISTRY.add_collector(collector)
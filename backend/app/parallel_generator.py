@@ -1,28 +1,35 @@
 """
 Parallel Video Generation System
 
-Strategy: Generate video in 5-second chunks across multiple ComfyUI instances,
-then stitch them together for longer videos.
+Strategy: Generate video in chunks across multiple ComfyUI instances, sized
+for the available workers and their measured speed (see chunk_planner), then
+stitch them together for longer videos.
 """
 
+import logging
 import os
 import asyncio
 import aiohttp
 import tempfile
-import subprocess
 from pathlib import Path
-from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
-import json
+from typing import List, Optional, Dict, Any, Callable
 import time
+import uuid
+from .completion_tracker import AsyncCompletionTracker
+from .comfy_wrapper import DEFAULT_POOL_SIZE
+from .downloads import async_download_to_file
+from .assembler import IncrementalAssembler
+from .upload_cache import sha256_file, content_filename
+from .workflow_template import WorkflowTemplate, FAST_MODE_PARAMS, CHAIN_PREVIEW_NODE
+from .dispatcher import ChunkDispatcher, DEFAULT_SECONDS_PER_FRAME
+from .chunk_planner import (ChunkPlan, WorkerEstimate, estimate_workers, plan_chunks, CHUNK_OVERHEAD_SECONDS,
+                            MAX_CHUNK_FRAMES)
+from .generator import (ProgressCallback, report_progress, record_prompt_phases, PROGRESS_UPLOADING,
+                        PROGRESS_SAMPLING_START, PROGRESS_SAMPLING_END, PROGRESS_ENCODING)
+from . import metrics
+from .worker_pool import ComfyWorker, WorkerPool
 
-
-@dataclass
-class ComfyWorker:
-    """Represents a ComfyUI worker instance"""
-    url: str
-    name: str
-    busy: bool = False
+logger = logging.getLogger(__name__)
 
 
 class ParallelVideoGenerator:
@@ -34,86 +41,128 @@ class ParallelVideoGenerator:
     - With 6 workers: ~5 minutes (6x speedup)
     """
     
-    def __init__(self, workers: List[str] = None, workflow_path: str = None):
+    def __init__(self, workers: List[str] = None, workflow_path: str = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 pool: Optional[WorkerPool] = None,
+                 chain_chunks: bool = os.getenv("PIXELDOJO_CHAIN_CHUNKS", "false").lower() == "true"):
         """
         Initialize with list of ComfyUI worker URLs.
         
         Args:
             workers: List of ComfyUI URLs, e.g., ["http://worker1:8188", "http://worker2:8188"]
             workflow_path: Path to the video generation workflow JSON
+            pool_size: Max pooled keep-alive connections per worker
+            pool: Shared, health-checked worker pool (workers are ignored when given)
+            chain_chunks: Default for chaining mode (see generate_parallel)
         """
-        self.workers = [ComfyWorker(url=url, name=f"worker_{i}") for i, url in enumerate(workers or [])]
+        self.pool = pool or WorkerPool(workers, pool_size=pool_size)
         self.workflow_path = Path(workflow_path) if workflow_path else None
+        self.template = WorkflowTemplate(self.workflow_path) if self.workflow_path else None
         self.output_dir = Path(__file__).parent.parent / "outputs"
         self.output_dir.mkdir(exist_ok=True)
         self.fps = 16
-        self.chunk_duration = 5  # seconds per chunk
+        # Chunk sizing: longest chunk, and the fixed seconds each extra chunk costs
+        self.max_chunk_frames = MAX_CHUNK_FRAMES
+        self.chunk_overhead = CHUNK_OVERHEAD_SECONDS
+        # Seed each chunk from the previous chunk's last frame (coherent motion, less parallelism)
+        self.chain_chunks = chain_chunks
+        self.trackers: Dict[str, AsyncCompletionTracker] = {}
+    
+    @property
+    def workers(self) -> List[ComfyWorker]:
+        """Workers currently admitted by the pool's circuit breakers"""
+        return self.pool.available()
         
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the pool's shared session"""
+        return await self.pool.get_session()
+    
+    async def close(self):
+        """Close event streams and the pool's session"""
+        await self.stop_trackers()
+        await self.pool.stop()
+    
     def add_worker(self, url: str):
         """Add a ComfyUI worker"""
-        self.workers.append(ComfyWorker(url=url, name=f"worker_{len(self.workers)}"))
+        self.pool.add_worker(url)
         
-    def calculate_chunks(self, total_duration: int) -> List[Dict]:
+    def chunk_plan(self, total_duration: int, workers: Optional[List[ComfyWorker]] = None,
+                   model_key: Optional[str] = None, chain: bool = False) -> ChunkPlan:
+        """
+        Pick chunk lengths that finish the job soonest on these workers.
+        
+        Uses each worker's measured seconds per frame, the model reload it would
+        need for model_key and its foreign queue backlog (see chunk_planner).
+        """
+        workers = self.workers if workers is None else workers
+        estimates = estimate_workers(workers, model_key, self.chunk_overhead, self.max_chunk_frames)
+        if not estimates:
+            estimates = [WorkerEstimate("default", DEFAULT_SECONDS_PER_FRAME)]
+        return plan_chunks(total_duration * self.fps + 1, estimates, self.chunk_overhead,
+                           self.max_chunk_frames, chained=chain)
+    
+    def calculate_chunks(self, total_duration: int, workers: Optional[List[ComfyWorker]] = None,
+                         model_key: Optional[str] = None, chain: bool = False) -> List[Dict]:
         """
         Split duration into chunks for parallel processing.
         
         Returns list of chunk configs with start_frame, end_frame, etc.
         """
-        chunks = []
-        chunk_frames = self.chunk_duration * self.fps + 1  # 81 frames for 5 sec
-        total_frames = total_duration * self.fps + 1
-        
-        current_frame = 0
-        chunk_id = 0
-        
-        while current_frame < total_frames:
-            end_frame = min(current_frame + chunk_frames, total_frames)
-            chunks.append({
-                "chunk_id": chunk_id,
-                "start_frame": current_frame,
-                "end_frame": end_frame,
-                "frame_count": end_frame - current_frame,
-                "is_first": chunk_id == 0,
-                "is_last": end_frame >= total_frames
-            })
-            # Overlap by 1 frame for smooth transitions
-            current_frame = end_frame - 1
-            chunk_id += 1
-            
-        return chunks
+        return self.chunk_plan(total_duration, workers, model_key, chain).chunks()
     
-    async def upload_image(self, session: aiohttp.ClientSession, worker: ComfyWorker, image_path: str) -> Optional[str]:
-        """Upload image to a worker"""
+    async def upload_image(self, session: aiohttp.ClientSession, worker: ComfyWorker, image_path: str,
+                           digest: Optional[str] = None) -> Optional[str]:
+        """Upload image to a worker, skipping content it already has"""
+        if digest is None:
+            digest = await asyncio.to_thread(sha256_file, image_path)
+        cached_name = worker.upload_cache.get(digest)
+        if cached_name:
+            return cached_name
         try:
-            with open(image_path, 'rb') as f:
-                data = aiohttp.FormData()
-                data.add_field('image', f, filename=os.path.basename(image_path))
-                data.add_field('overwrite', 'true')
-                
-                async with session.post(f"{worker.url}/upload/image", data=data) as resp:
-                    if resp.status == 200:
-                        result = await resp.json()
-                        return result.get("name")
+            # Read in a thread; the event loop never touches the disk
+            image_bytes = await asyncio.to_thread(Path(image_path).read_bytes)
+            data = aiohttp.FormData()
+            data.add_field('image', image_bytes, filename=content_filename(digest, image_path))
+            data.add_field('overwrite', 'true')
+            
+            async with session.post(f"{worker.url}/upload/image", data=data) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    name = result.get("name")
+                    if name:
+                        worker.upload_cache.put(digest, name)
+                    return name
         except Exception as e:
-            print(f"Error uploading to {worker.name}: {e}")
+            logger.error("Error uploading to %s: %s", worker.name, e)
         return None
     
+    async def refresh_uploads(self, session: aiohttp.ClientSession, worker: ComfyWorker,
+                              uploads: Dict[str, str]) -> bool:
+        """
+        After /prompt rejected a chunk, upload again whatever the worker's upload
+        cache claimed it had (uploads maps filename -> local path). True if the
+        queue is worth retrying.
+        """
+        stale = {name: path for name, path in uploads.items() if worker.upload_cache.forget_name(name)}
+        if not stale:
+            return False
+        # A cached upload may be gone (e.g. the pod restarted with an empty input dir)
+        logger.debug("[%s] Queue failed with cached uploads, re-uploading %s image(s)", worker.name, len(stale))
+        for name, path in stale.items():
+            # Names are content-addressed, so the workflow stays valid only if it comes back the same
+            if await self.upload_image(session, worker, path) != name:
+                return False
+        return True
+    
     async def queue_prompt(self, session: aiohttp.ClientSession, worker: ComfyWorker, 
                           workflow: Dict, chunk_info: Dict) -> Optional[str]:
         """Queue a generation prompt on a worker"""
         try:
-            # Modify workflow for this chunk
-            workflow_copy = json.loads(json.dumps(workflow))  # Deep copy
-            
-            # Set frame count for this chunk
-            for node_id, node_data in workflow_copy.items():
-                if isinstance(node_data, dict):
-                    if node_data.get("class_type") == "WanImageToVideo":
-                        node_data["inputs"]["length"] = chunk_info["frame_count"]
+            # Structural copy with this chunk's frame count
+            workflow_copy = self.template.apply(workflow, length=chunk_info["frame_count"])
             
             prompt_data = {
                 "prompt": workflow_copy,
-                "client_id": f"parallel-{chunk_info['chunk_id']}"
+                "client_id": worker.client_id
             }
             
             async with session.post(f"{worker.url}/prompt", json=prompt_data) as resp:
@@ -121,14 +170,25 @@ class ParallelVideoGenerator:
                     result = await resp.json()
                     return result.get("prompt_id")
         except Exception as e:
-            print(f"Error queueing on {worker.name}: {e}")
+            logger.error("Error queueing on %s: %s", worker.name, e)
         return None
     
     async def wait_for_completion(self, session: aiohttp.ClientSession, worker: ComfyWorker,
                                   prompt_id: str, timeout: int = 600) -> Optional[Dict]:
         """Wait for a prompt to complete and return output info"""
         start = time.time()
+        
+        # Prefer the worker's event stream, fall back to polling if it drops
+        tracker = self.trackers.get(worker.name)
+        if tracker and tracker.connected:
+            finished = await tracker.wait(prompt_id, timeout)
+            if finished is False:
+                return None
+            if finished is None:
+                logger.debug("[%s] Event stream dropped, polling /history", worker.name)
+        
         while time.time() - start < timeout:
+            metrics.HISTORY_POLLS.inc()
             try:
                 async with session.get(f"{worker.url}/history/{prompt_id}") as resp:
                     if resp.status == 200:
@@ -137,9 +197,33 @@ class ParallelVideoGenerator:
                             return history[prompt_id].get("outputs", {})
             except:
                 pass
-            await asyncio.sleep(2)
+            state = tracker.get_state(prompt_id) if tracker else None
+            await asyncio.sleep(0.25 if state and state.finished else 2)
         return None
     
+    async def start_trackers(self, session: aiohttp.ClientSession):
+        """Open a completion-event stream to every worker that doesn't have one"""
+        # Close streams to workers that have left the pool
+        members = {worker.name for worker in self.pool.workers}
+        for name in [name for name in self.trackers if name not in members]:
+            await self.trackers.pop(name).stop()
+        new_trackers = []
+        for worker in self.workers:
+            if worker.name not in self.trackers:
+                tracker = AsyncCompletionTracker(session, worker.url, worker.client_id)
+                self.trackers[worker.name] = tracker
+                new_trackers.append(tracker)
+        if not new_trackers:
+            return
+        results = await asyncio.gather(*(t.start() for t in new_trackers))
+        connected = sum(1 for r in results if r)
+        logger.info("Event streams connected: %s/%s", connected, len(new_trackers))
+    
+    async def stop_trackers(self):
+        """Close all worker event streams"""
+        await asyncio.gather(*(t.stop() for t in self.trackers.values()))
+        self.trackers.clear()
+    
     async def download_video(self, session: aiohttp.ClientSession, worker: ComfyWorker,
                             output_info: Dict, save_path: Path) -> bool:
         """Download generated video from worker"""
@@ -152,75 +236,139 @@ class ParallelVideoGenerator:
                     
                     url = f"{worker.url}/view?filename={filename}&subfolder={subfolder}&type={type_}"
                     
-                    try:
-                        async with session.get(url) as resp:
-                            if resp.status == 200:
-                                with open(save_path, 'wb') as f:
-                                    f.write(await resp.read())
-                                return True
-                    except Exception as e:
-                        print(f"Error downloading from {worker.name}: {e}")
+                    # Stream to disk so chunks never sit in memory
+                    if await async_download_to_file(session, url, save_path):
+                        return True
+                    logger.error("Error downloading from %s: %s", worker.name, filename)
         return False
     
     async def generate_chunk(self, session: aiohttp.ClientSession, worker: ComfyWorker,
-                            workflow: Dict, chunk_info: Dict, image_filename: str,
-                            temp_dir: Path) -> Optional[Path]:
-        """Generate a single chunk on a worker"""
-        print(f"[{worker.name}] Starting chunk {chunk_info['chunk_id']} ({chunk_info['frame_count']} frames)")
+                            workflow: Dict, chunk_info: Dict, uploads: Dict[str, str],
+                            temp_dir: Path,
+                            on_last_frame: Optional[Callable[[Path], None]] = None) -> Optional[Path]:
+        """
+        Generate a single chunk on a worker.
+        
+        uploads maps the input filenames the workflow uses to their local files,
+        for re-uploading if the worker has lost them.
+        
+        With on_last_frame (chaining mode; the workflow must carry the chain nodes),
+        the chunk's last frame is downloaded and handed over as soon as ComfyUI
+        has decoded it, while the video is still being encoded.
+        """
+        started = time.perf_counter()
+        try:
+            return await self._generate_chunk(session, worker, workflow, chunk_info, uploads, temp_dir,
+                                              on_last_frame)
+        finally:
+            metrics.CHUNK_SECONDS.observe(time.perf_counter() - started, worker=worker.name)
+    
+    async def _generate_chunk(self, session: aiohttp.ClientSession, worker: ComfyWorker, workflow: Dict,
+                              chunk_info: Dict, uploads: Dict[str, str], temp_dir: Path,
+                              on_last_frame: Optional[Callable[[Path], None]]) -> Optional[Path]:
+        logger.debug("[%s] Starting chunk %s (%s frames)",
+                     worker.name, chunk_info['chunk_id'], chunk_info['frame_count'])
         
         # Queue the prompt
-        prompt_id = await self.queue_prompt(session, worker, workflow, chunk_info)
+        with metrics.span("queue", worker=worker.name):
+            prompt_id = await self.queue_prompt(session, worker, workflow, chunk_info)
+            if not prompt_id and await self.refresh_uploads(session, worker, uploads):
+                prompt_id = await self.queue_prompt(session, worker, workflow, chunk_info)
+        queued_at = time.time()
         if not prompt_id:
-            print(f"[{worker.name}] Failed to queue chunk {chunk_info['chunk_id']}")
+            logger.error("[%s] Failed to queue chunk %s", worker.name, chunk_info['chunk_id'])
             return None
         
-        print(f"[{worker.name}] Queued chunk {chunk_info['chunk_id']}, prompt_id: {prompt_id}")
+        logger.debug("[%s] Queued chunk %s, prompt_id: %s", worker.name, chunk_info['chunk_id'], prompt_id)
         
-        # Wait for completion
-        outputs = await self.wait_for_completion(session, worker, prompt_id)
-        if not outputs:
-            print(f"[{worker.name}] Timeout waiting for chunk {chunk_info['chunk_id']}")
-            return None
-        
-        # Download result
-        output_path = temp_dir / f"chunk_{chunk_info['chunk_id']:03d}.mp4"
-        if await self.download_video(session, worker, outputs, output_path):
-            print(f"[{worker.name}] Completed chunk {chunk_info['chunk_id']}")
-            return output_path
+        frame_task = None
+        if on_last_frame is not None:
+            frame_task = asyncio.create_task(
+                self.fetch_last_frame(session, worker, prompt_id, chunk_info, temp_dir, on_last_frame))
+        try:
+            # Wait for completion
+            with metrics.span("wait", worker=worker.name, prompt_id=prompt_id):
+                outputs = await self.wait_for_completion(session, worker, prompt_id)
+            if not outputs:
+                logger.debug("[%s] Timeout waiting for chunk %s", worker.name, chunk_info['chunk_id'])
+                return None
+            tracker = self.trackers.get(worker.name)
+            if tracker is not None:
+                record_prompt_phases(tracker.get_state(prompt_id), self.template.class_types(), queued_at)
+            
+            if frame_task is not None and await frame_task is None:
+                # No event stream: take the last frame from /history instead
+                frame_path = await self.download_last_frame(session, worker, outputs.get(CHAIN_PREVIEW_NODE),
+                                                            chunk_info, temp_dir)
+                if frame_path is None:
+                    logger.debug("[%s] Chunk %s produced no last frame", worker.name, chunk_info['chunk_id'])
+                    return None
+                on_last_frame(frame_path)
+            
+            # Download result (named per worker: a speculative copy may be writing the same chunk)
+            output_path = temp_dir / f"chunk_{chunk_info['chunk_id']:03d}_{worker.name}.mp4"
+            with metrics.span("download", worker=worker.name, prompt_id=prompt_id):
+                downloaded = await self.download_video(session, worker, outputs, output_path)
+            if downloaded:
+                logger.debug("[%s] Completed chunk %s", worker.name, chunk_info['chunk_id'])
+                return output_path
+        except asyncio.CancelledError:
+            # Superseded or timed out: free the worker's GPU for other work
+            await asyncio.shield(self.cancel_prompt(session, worker, prompt_id))
+            raise
+        finally:
+            if frame_task is not None and not frame_task.done():
+                frame_task.cancel()
         
         return None
     
-    def stitch_videos(self, chunk_paths: List[Path], output_path: Path) -> bool:
-        """Stitch video chunks together using ffmpeg"""
-        if not chunk_paths:
-            return False
-        
-        # Create concat file
-        concat_file = output_path.parent / "concat_list.txt"
-        with open(concat_file, 'w') as f:
-            for path in sorted(chunk_paths):
-                f.write(f"file '{path}'\n")
-        
-        # Use ffmpeg to concatenate
-        cmd = [
-            "ffmpeg", "-y",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", str(concat_file),
-            "-c", "copy",
-            str(output_path)
-        ]
-        
+    async def fetch_last_frame(self, session: aiohttp.ClientSession, worker: ComfyWorker, prompt_id: str,
+                               chunk_info: Dict, temp_dir: Path,
+                               on_last_frame: Callable[[Path], None], timeout: int = 600) -> Optional[Path]:
+        """Hand over a chunk's last frame as soon as the worker reports it (needs the event stream)"""
+        tracker = self.trackers.get(worker.name)
+        if not (tracker and tracker.connected):
+            return None
+        output = await tracker.wait_for_output(prompt_id, CHAIN_PREVIEW_NODE, timeout)
+        frame_path = await self.download_last_frame(session, worker, output, chunk_info, temp_dir)
+        if frame_path is not None:
+            logger.debug("[%s] Last frame of chunk %s ready", worker.name, chunk_info['chunk_id'])
+            on_last_frame(frame_path)
+        return frame_path
+    
+    async def download_last_frame(self, session: aiohttp.ClientSession, worker: ComfyWorker,
+                                  node_output: Optional[Dict], chunk_info: Dict, temp_dir: Path) -> Optional[Path]:
+        """Download the image from the chain preview node's output"""
+        images = (node_output or {}).get("images") or []
+        if not images:
+            return None
+        image = images[-1]
+        url = (f"{worker.url}/view?filename={image['filename']}&subfolder={image.get('subfolder', '')}"
+               f"&type={image.get('type', 'temp')}")
+        frame_path = temp_dir / f"chunk_{chunk_info['chunk_id']:03d}_{worker.name}_last.png"
+        if await async_download_to_file(session, url, frame_path):
+            return frame_path
+        return None
+    
+    async def cancel_prompt(self, session: aiohttp.ClientSession, worker: ComfyWorker, prompt_id: str):
+        """Remove a prompt from a worker's queue, interrupting it if it is already running"""
         try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            concat_file.unlink()  # Clean up
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"FFmpeg error: {e.stderr.decode()}")
-            return False
+            async with session.post(f"{worker.url}/queue", json={"delete": [prompt_id]}) as resp:
+                await resp.read()
+            async with session.get(f"{worker.url}/queue") as resp:
+                queue = await resp.json() if resp.status == 200 else {}
+            if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+                # Newer ComfyUI only interrupts the given prompt; older versions interrupt whatever runs
+                async with session.post(f"{worker.url}/interrupt", json={"prompt_id": prompt_id}) as resp:
+                    await resp.read()
+            logger.debug("[%s] Cancelled prompt %s", worker.name, prompt_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug("[%s] Could not cancel prompt %s: %s", worker.name, prompt_id, e)
     
     async def generate_parallel(self, image_path: str, prompt: str, 
-                               duration_seconds: int) -> Optional[str]:
+                               duration_seconds: int, fast_mode: bool = False,
+                               progress_callback: Optional[ProgressCallback] = None,
+                               chain: Optional[bool] = None) -> Optional[str]:
         """
         Generate a long video using parallel workers.
         
@@ -228,74 +376,146 @@ class ParallelVideoGenerator:
             image_path: Path to the source image
             prompt: Text prompt for generation
             duration_seconds: Total video duration
+            fast_mode: Apply the fast-mode resolution/steps/dtype to every chunk
+            progress_callback: Receives partial job updates as chunks complete
+            chain: Chaining mode: each chunk starts from the previous chunk's last frame
+                and is dispatched as soon as that frame exists (default: self.chain_chunks)
             
         Returns:
             Path to the final stitched video, or None on failure
         """
         if not self.workers:
-            raise ValueError("No workers configured")
+            raise ValueError("No healthy workers available" if self.pool.workers else "No workers configured")
         
         if not self.workflow_path or not self.workflow_path.exists():
             raise FileNotFoundError("Workflow not found")
         
-        # Load workflow
-        with open(self.workflow_path) as f:
-            base_workflow = json.load(f)
+        chain = self.chain_chunks if chain is None else chain
+        
+        # Size chunks for the current workers, their speed and the weights they hold
+        model_key = self.template.model_key(self.template.render(**(FAST_MODE_PARAMS if fast_mode else {})))
+        plan = self.chunk_plan(duration_seconds, model_key=model_key, chain=chain)
+        chunks = plan.chunks()
+        logger.info("Splitting %ss video into %s chunks of %s frames (~%.0fs estimated on %s workers)",
+                    duration_seconds, len(chunks), plan.frame_counts, plan.makespan, len(self.workers))
+        report_progress(progress_callback, chunk_plan=plan.summary())
         
-        # Calculate chunks
-        chunks = self.calculate_chunks(duration_seconds)
-        print(f"Splitting {duration_seconds}s video into {len(chunks)} chunks")
+        # Reuse pooled connections and event streams across jobs
+        session = await self.get_session()
+        await self.start_trackers(session)
+        return await self._run_chunks(session, chunks, image_path, prompt, fast_mode, progress_callback, chain)
+    
+    async def _run_chunks(self, session: aiohttp.ClientSession, chunks: List[Dict], image_path: str, prompt: str,
+                          fast_mode: bool = False, progress_callback: Optional[ProgressCallback] = None,
+                          chain: bool = False) -> Optional[str]:
+        """Upload, generate and stitch all chunks over an open session"""
+        # Upload image to all workers (hash once; workers that have it skip the upload)
+        logger.info("Uploading image to workers...")
+        report_progress(progress_callback, progress=PROGRESS_UPLOADING, phase="uploading", message="Uploading image")
+        digest = await asyncio.to_thread(sha256_file, image_path)
+        candidates = self.workers
+        with metrics.span("upload", workers=len(candidates)):
+            filenames = await asyncio.gather(
+                *(self.upload_image(session, worker, image_path, digest) for worker in candidates)
+            )
+        # Only workers that have the image can take chunks
+        workers = [worker for worker, filename in zip(candidates, filenames) if filename]
+        for worker, filename in zip(candidates, filenames):
+            if not filename:
+                self.pool.record_failure(worker, "image upload failed")
+        # Content-addressed names are the same on every worker
+        image_filename = next((filename for filename in filenames if filename), None)
+        if not image_filename:
+            logger.error("Failed to upload image to any worker")
+            return None
+        base_workflow = self.template.render(image=image_filename, prompt=prompt,
+                                             **(FAST_MODE_PARAMS if fast_mode else {}))
         
-        async with aiohttp.ClientSession() as session:
-            # Upload image to all workers
-            print("Uploading image to workers...")
-            image_filename = None
-            for worker in self.workers:
-                filename = await self.upload_image(session, worker, image_path)
-                if filename:
-                    image_filename = filename
-                    # Update workflow with image filename
-                    for node_id, node_data in base_workflow.items():
-                        if isinstance(node_data, dict):
-                            if node_data.get("class_type") == "LoadImage":
-                                node_data["inputs"]["image"] = filename
-                            if node_data.get("class_type") == "CLIPTextEncode":
-                                if node_data.get("_meta", {}).get("title") == "Positive Prompt":
-                                    node_data["inputs"]["text"] = prompt
+        # Create temp directory for chunks
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir)
+            
+            # Chunks are cut into the final video (and a growing preview) as they arrive in order
+            preview_path = None
+            if progress_callback is not None:
+                preview_path = self.output_dir / "previews" / f"preview_{uuid.uuid4().hex[:12]}.mp4"
+                preview_path.parent.mkdir(exist_ok=True)
+            
+            def on_preview(path: Path, seconds: float):
+                report_progress(progress_callback, preview_path=str(path), preview_seconds=round(seconds, 2))
+            
+            assembler = IncrementalAssembler(chunks, temp_path / "assembly", preview_path, fps=self.fps,
+                                             on_preview=on_preview)
+            
+            # Idle workers pull the next chunk, least estimated finish time first;
+            # failed chunks are retried elsewhere and stragglers re-run speculatively
+            # Chaining mode: chunk_id -> local copy of that chunk's last frame
+            last_frames: Dict[int, Path] = {}
             
-            if not image_filename:
-                print("Failed to upload image to any worker")
+            def chunk_ready(chunk: Dict) -> bool:
+                return not chain or chunk["chunk_id"] == 0 or chunk["chunk_id"] - 1 in last_frames
+            
+            async def run_chunk(worker: ComfyWorker, chunk: Dict) -> Optional[Path]:
+                chunk_id = chunk["chunk_id"]
+                workflow, on_last_frame = base_workflow, None
+                uploads = {image_filename: image_path}
+                if chain:
+                    start_image = image_filename
+                    if chunk_id > 0:
+                        start_image = await self.upload_image(session, worker, str(last_frames[chunk_id - 1]))
+                        if not start_image:
+                            return None
+                        uploads[start_image] = str(last_frames[chunk_id - 1])
+                    workflow = self.template.with_chain_nodes(base_workflow, start_image, chunk["frame_count"] - 1)
+                    
+                    def on_last_frame(frame_path: Path):
+                        # First delivery wins; a retried chunk reproduces the same frame
+                        if chunk_id not in last_frames:
+                            last_frames[chunk_id] = frame_path
+                            dispatcher.wake()
+                path = await self.generate_chunk(session, worker, workflow, chunk,
+                                                 uploads, temp_path, on_last_frame)
+                # Chunk outcomes feed the worker's circuit breaker alongside probes
+                if path is None:
+                    self.pool.record_failure(worker, f"chunk {chunk['chunk_id']} failed")
+                else:
+                    self.pool.record_success(worker)
+                    assembler.add(chunk_id, path)
+                    done = len(dispatcher.results) + 1
+                    span = PROGRESS_SAMPLING_END - PROGRESS_SAMPLING_START
+                    report_progress(progress_callback, progress=PROGRESS_SAMPLING_START + span * done // len(chunks),
+                                    phase="sampling", message=f"Generated chunk {done}/{len(chunks)}")
+                return path
+            
+            report_progress(progress_callback, progress=PROGRESS_SAMPLING_START, phase="sampling",
+                            message=f"Generating {len(chunks)} chunks on {len(workers)} workers")
+            # model_key steers chunks to workers already holding these weights. Copies of a
+            # chained chunk could end on different frames, so no speculation there
+            dispatcher = ChunkDispatcher(session, workers, run_chunk, ready=chunk_ready,
+                                         model_key=self.template.model_key(base_workflow),
+                                         **({"speculate_after": 0} if chain else {}))
+            try:
+                results = await dispatcher.run(chunks)
+            except BaseException:
+                await assembler.abort()
+                raise
+            
+            if len(results) != len(chunks):
+                # A video with a missing chunk would jump; fail the job instead
+                missing = sorted(chunk["chunk_id"] for chunk in dispatcher.failed)
+                logger.error("Only %s/%s chunks completed (failed: %s)", len(results), len(chunks), missing)
+                await assembler.abort()
                 return None
             
-            # Create temp directory for chunks
-            with tempfile.TemporaryDirectory() as temp_dir:
-                temp_path = Path(temp_dir)
-                
-                # Generate chunks in parallel
-                tasks = []
-                for i, chunk in enumerate(chunks):
-                    worker = self.workers[i % len(self.workers)]
-                    task = self.generate_chunk(session, worker, base_workflow, chunk, 
-                                              image_filename, temp_path)
-                    tasks.append(task)
-                
-                # Wait for all chunks
-                chunk_paths = await asyncio.gather(*tasks)
-                chunk_paths = [p for p in chunk_paths if p is not None]
-                
-                if len(chunk_paths) != len(chunks):
-                    print(f"Warning: Only {len(chunk_paths)}/{len(chunks)} chunks completed")
-                
-                if not chunk_paths:
-                    return None
-                
-                # Stitch together
-                output_filename = f"video_{int(time.time())}.mp4"
-                output_path = self.output_dir / output_filename
-                
-                if self.stitch_videos(chunk_paths, output_path):
-                    print(f"Final video saved to {output_path}")
-                    return str(output_path)
+            # Only the last seam is left to encode; the rest is a remux
+            output_filename = f"video_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
+            output_path = self.output_dir / output_filename
+            report_progress(progress_callback, progress=PROGRESS_ENCODING, phase="stitching",
+                            message="Stitching chunks")
+            
+            if await assembler.finish(output_path):
+                logger.info("Final video saved to %s", output_path)
+                return str(output_path)
         
         return None
 
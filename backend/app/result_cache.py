@@ -0,0 +1,155 @@
+"""
+Cache of finished videos keyed on everything that determines the output.
+
+The workflow pins its KSampler seed, so the same injected workflow run on the
+same input image produces the same video. The key is a hash of the canonical
+workflow JSON plus the image's content hash.
+
+Entries are private copies under outputs/cache/, so evicting one frees its
+space. They are evicted least-recently-used once the cache exceeds its size
+cap. Recency is kept on a `.used` sidecar per entry, so the videos' own mtimes
+(and the ETag/Last-Modified derived from them) never change. A hit hands the
+job its own hard link to the entry, which stays valid after eviction.
+"""
+
+import logging
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def result_cache_key(workflow: Dict[str, Any], image_digest: str) -> str:
+    """Canonical hash of an injected workflow and its input image content"""
+    canonical = json.dumps(workflow, sort_keys=True, separators=(",", ":"))
+    hasher = hashlib.sha256()
+    hasher.update(canonical.encode("utf-8"))
+    hasher.update(b"\0")
+    hasher.update(image_digest.encode("ascii"))
+    return hasher.hexdigest()
+
+
+def _link_or_copy(source: Path, dest: Path):
+    """Hard-link source to dest, copying across filesystems (FileNotFoundError if source is gone)"""
+    try:
+        os.link(source, dest)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+class ResultCache:
+    """Size-capped LRU cache of output videos on local disk"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int, output_dir: Optional[Path] = None):
+        self.cache_dir = Path(cache_dir)
+        # Where hits are linked for the jobs that receive them
+        self.output_dir = Path(output_dir) if output_dir else self.cache_dir.parent
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp4"
+
+    @staticmethod
+    def _used_path(path: Path) -> Path:
+        return path.with_suffix(".used")
+
+    def _touch(self, path: Path):
+        """Mark an entry as just used (the sidecar's mtime is its LRU time)"""
+        self._used_path(path).touch()
+
+    def _last_used(self, path: Path, stat: os.stat_result) -> float:
+        try:
+            return self._used_path(path).stat().st_mtime
+        except FileNotFoundError:
+            return stat.st_mtime
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return a new output path holding the cached video for key, or None.
+
+        The path is the caller's own hard link (or copy) of the entry, so it
+        outlives the entry's eviction.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        output = self.output_dir / f"video_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
+        try:
+            _link_or_copy(path, output)
+            self._touch(path)
+        except FileNotFoundError:
+            self.misses += 1
+            metrics.CACHE_LOOKUPS.inc(cache="result", result="miss")
+            return None
+        self.hits += 1
+        metrics.CACHE_LOOKUPS.inc(cache="result", result="hit")
+        return str(output)
+
+    def put(self, key: str, video_path: str) -> Optional[str]:
+        """Add a copy of a finished video to the cache and enforce the size cap"""
+        if not self.enabled:
+            return None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        partial = path.with_name(f"{path.name}.{os.getpid()}.part")
+        try:
+            # A copy, not a link: the job keeps its file, and eviction really frees the space
+            shutil.copyfile(video_path, partial)
+            os.replace(partial, path)
+            self._touch(path)
+        except OSError as e:
+            logger.debug("Could not add %s to result cache: %s", video_path, e)
+            partial.unlink(missing_ok=True)
+            return None
+        self.evict()
+        return str(path)
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in self.cache_dir.glob("*.mp4"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((self._last_used(entry, stat), stat.st_size, entry))
+                total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, entry in sorted(entries, key=lambda e: e[0]):
+                if total <= self.max_bytes:
+                    break
+                entry.unlink(missing_ok=True)
+                self._used_path(entry).unlink(missing_ok=True)
+                total -= size
+                logger.debug("Evicted %s from result cache", entry.name)
+
+    def stats(self) -> Dict[str, Any]:
+        entries = list(self.cache_dir.glob("*.mp4")) if self.cache_dir.exists() else []
+        return {
+            "entries": len(entries),
+            "bytes": sum(e.stat().st_size for e in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
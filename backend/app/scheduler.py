@@ -0,0 +1,163 @@
+"""
+Bounded job scheduler for the API process.
+
+Jobs wait in a per-backend priority queue and are run by a fixed number of
+worker tasks per backend, so a burst of requests can't pin an unbounded
+number of threads while ComfyUI works through them one at a time anyway.
+When a backend's queue is full, submit() raises QueueFullError and the API
+answers 429.
+"""
+
+import asyncio
+import logging
+import heapq
+import itertools
+from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Callable, Awaitable, Any
+
+logger = logging.getLogger(__name__)
+
+
+# Lower runs first
+PRIORITY_RECOVERED = 0
+PRIORITY_FAST = 1
+PRIORITY_FULL = 2
+
+
+class QueueFullError(Exception):
+    """Raised when a backend's queue has no room for another job"""
+
+
+@dataclass(order=True)
+class _QueuedJob:
+    priority: int
+    seq: int
+    job_id: str = field(compare=False)
+    run: Callable[[], Awaitable[Any]] = field(compare=False)
+
+
+def parse_concurrency(spec: str, default: int = 1) -> Dict[str, int]:
+    """Parse "2" or "local=2,parallel=1" into a per-backend limit map ("*" is the fallback)"""
+    limits = {"*": default}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "=" in part:
+            backend, value = part.split("=", 1)
+            limits[backend.strip()] = max(1, int(value))
+        else:
+            limits["*"] = max(1, int(part))
+    return limits
+
+
+class JobScheduler:
+    """
+    Priority queue plus a fixed pool of worker tasks per backend.
+
+    Must be started from inside the running event loop.
+    """
+
+    def __init__(self, max_queue: int = 50, concurrency: Optional[Dict[str, int]] = None):
+        self.max_queue = max_queue
+        self.concurrency = concurrency or {"*": 1}
+        self._queues: Dict[str, List[_QueuedJob]] = {}
+        self._conditions: Dict[str, asyncio.Condition] = {}
+        self._workers: Dict[str, List[asyncio.Task]] = {}
+        self._running: Dict[str, set] = {}
+        self._seq = itertools.count()
+        # Called with the backend name whenever its queue order changes
+        self.on_change: Optional[Callable[[str], None]] = None
+
+    def _limit(self, backend: str) -> int:
+        return self.concurrency.get(backend, self.concurrency.get("*", 1))
+
+    def _ensure_backend(self, backend: str):
+        if backend in self._queues:
+            return
+        self._queues[backend] = []
+        self._running[backend] = set()
+        self._conditions[backend] = asyncio.Condition()
+        self._workers[backend] = [
+            asyncio.create_task(self._worker(backend), name=f"scheduler-{backend}-{i}")
+            for i in range(self._limit(backend))
+        ]
+
+    def is_full(self, backend: str) -> bool:
+        return len(self._queues.get(backend, ())) >= self.max_queue
+
+    async def submit(self, job_id: str, run: Callable[[], Awaitable[Any]], priority: int = PRIORITY_FULL,
+                     backend: str = "local", force: bool = False) -> int:
+        """
+        Queue a job and return its 1-based queue position.
+
+        Raises QueueFullError when the backend's queue is full, unless force is set.
+        """
+        self._ensure_backend(backend)
+        if not force and self.is_full(backend):
+            raise QueueFullError(f"Queue for backend '{backend}' is full ({self.max_queue} jobs)")
+        heapq.heappush(self._queues[backend], _QueuedJob(priority, next(self._seq), job_id, run))
+        condition = self._conditions[backend]
+        async with condition:
+            condition.notify()
+        self._changed(backend)
+        return self.position(job_id) or 1
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based position of a queued job, or None if it isn't waiting"""
+        for queue in self._queues.values():
+            for index, queued in enumerate(sorted(queue)):
+                if queued.job_id == job_id:
+                    return index + 1
+        return None
+
+    def queued_job_ids(self, backend: str) -> List[str]:
+        return [queued.job_id for queued in sorted(self._queues.get(backend, ()))]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            backend: {
+                "queued": len(self._queues[backend]),
+                "running": len(self._running[backend]),
+                "concurrency": self._limit(backend),
+                "max_queue": self.max_queue,
+            }
+            for backend in self._queues
+        }
+
+    def _changed(self, backend: str):
+        if self.on_change is not None:
+            try:
+                self.on_change(backend)
+            except Exception as e:
+                logger.debug("scheduler on_change failed: %s", e)
+
+    async def _worker(self, backend: str):
+        queue = self._queues[backend]
+        condition = self._conditions[backend]
+        while True:
+            async with condition:
+                await condition.wait_for(lambda: len(queue) > 0)
+                job = heapq.heappop(queue)
+            self._running[backend].add(job.job_id)
+            self._changed(backend)
+            try:
+                await job.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Scheduled job %s crashed: %s", job.job_id, e)
+            finally:
+                self._running[backend].discard(job.job_id)
+
+    async def stop(self):
+        """Cancel all worker tasks (queued jobs are dropped)"""
+        for tasks in self._workers.values():
+            for task in tasks:
+                task.cancel()
+        for tasks in self._workers.values():
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+        self._running.clear()
+        self._conditions.clear()
@@ -0,0 +1,80 @@
+"""
+Content-addressed upload dedup.
+
+Input images are named after a hash of their bytes, and each ComfyUI
+instance gets an LRU map of content hash -> uploaded filename. Re-running the
+same image (same product shot, many prompts) then skips the upload.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, BinaryIO
+
+from . import metrics
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_stream(stream: BinaryIO) -> str:
+    """Hash a binary stream from its current position to EOF"""
+    hasher = hashlib.sha256()
+    for block in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        hasher.update(block)
+    return hasher.hexdigest()
+
+
+def sha256_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return sha256_stream(f)
+
+
+def content_filename(digest: str, original_name: str) -> str:
+    """Stable upload name for some content, keeping the original extension"""
+    suffix = Path(original_name).suffix.lower() or ".png"
+    return f"{digest[:32]}{suffix}"
+
+
+class UploadCache:
+    """Thread-safe LRU map of content hash -> filename on one ComfyUI instance"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            name = self._entries.get(digest)
+            if name is None:
+                self.misses += 1
+                metrics.CACHE_LOOKUPS.inc(cache="upload", result="miss")
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            metrics.CACHE_LOOKUPS.inc(cache="upload", result="hit")
+            return name
+
+    def put(self, digest: str, name: str):
+        with self._lock:
+            self._entries[digest] = name
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget_name(self, name: str) -> bool:
+        """Drop whichever entry points at name (e.g. ComfyUI lost the file)"""
+        with self._lock:
+            for digest, cached in list(self._entries.items()):
+                if cached == name:
+                    del self._entries[digest]
+                    return True
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
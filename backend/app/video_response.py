@@ -0,0 +1,172 @@
+"""
+Conditional, byte-range responses for video files.
+
+The pinned Starlette's FileResponse always sends the whole file and ignores
+validators, so browsers cannot seek in a long video without downloading it
+first. Videos are served through here instead:
+
+- 200 with the whole body
+- 206 for a single byte range
+- 304 when the client's copy is current (If-None-Match, If-Modified-Since)
+- 416 for ranges past the end
+
+If-Range falls back to the whole file when the client's copy is stale. Multi-range
+requests also get the whole file, which RFC 9110 allows.
+"""
+
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple, AsyncIterator, Dict
+
+import aiofiles
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+# Bytes read per body chunk
+READ_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def file_validators(stat: os.stat_result) -> Tuple[str, str]:
+    """(ETag, Last-Modified) for a file; the ETag changes whenever size or mtime do"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"', formatdate(stat.st_mtime, usegmt=True)
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a Range header into an inclusive (first, last) byte span.
+
+    Returns None when the header should be ignored (not bytes, malformed, or
+    several ranges) and raises RangeNotSatisfiable when it starts past the end.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            # Suffix range: the final N bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header: str, etag: str, weak: bool = True) -> bool:
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def _if_range_matches(header: str, etag: str, mtime: float) -> bool:
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        # If-Range needs a strong match
+        return _etag_matches(header, etag, weak=False)
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return since is not None and int(mtime) == int(since.timestamp())
+
+
+async def _read_file(f, start: int, length: int) -> AsyncIterator[bytes]:
+    try:
+        await f.seek(start)
+        while length > 0:
+            data = await f.read(min(READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        await f.close()
+
+
+async def video_response(request: Request, path: str, filename: Optional[str] = None,
+                         media_type: str = "video/mp4", cache_control: str = "no-cache") -> Response:
+    """Serve a file honouring Range, If-Range and the conditional-GET headers"""
+    # Stat the open file, so the headers describe exactly the bytes that get sent
+    # even if the path is replaced meanwhile (growing previews are)
+    f = await aiofiles.open(path, "rb")
+    try:
+        response = _build_response(request, f, os.fstat(f.fileno()), filename, media_type, cache_control)
+    except BaseException:
+        await f.close()
+        raise
+    if not isinstance(response, StreamingResponse):
+        await f.close()
+    return response
+
+
+def _build_response(request: Request, f, stat: os.stat_result, filename: Optional[str],
+                    media_type: str, cache_control: str) -> Response:
+    size = stat.st_size
+    etag, last_modified = file_validators(stat)
+    headers: Dict[str, str] = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": cache_control,
+    }
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif _not_modified_since(request.headers.get("if-modified-since", ""), stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    start, end = 0, size - 1
+    status_code = 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or _if_range_matches(if_range, etag, stat.st_mtime)):
+        try:
+            span = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if span is not None:
+            start, end = span
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1 if size else 0
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(_read_file(f, start, length), status_code=status_code,
+                             headers=headers, media_type=media_type)
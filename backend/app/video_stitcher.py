@@ -1,50 +1,409 @@
+import logging
+import os
+import shutil
 import subprocess
+import tempfile
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Iterable, Dict, Any, Tuple
 
+from . import metrics
 
-def stitch_videos(video_paths: List[str], output_path: Path) -> Optional[Path]:
-    """Stitch multiple video clips together using FFmpeg"""
-    if not video_paths:
+logger = logging.getLogger(__name__)
+
+
+# Frames blended across each seam (0 = just drop the frames chunks share)
+CROSSFADE_FRAMES = int(os.getenv("PIXELDOJO_CROSSFADE_FRAMES", "0"))
+# Quality for the re-encoded seam windows; high so they match the copied stretches
+SEAM_CRF = 17
+
+FFMPEG = ["ffmpeg", "-y", "-v", "error"]
+
+
+def _run_ffmpeg(args: List[str]) -> bytes:
+    return subprocess.run(FFMPEG + args, check=True, capture_output=True).stdout
+
+
+def probe_args(path: Path) -> List[str]:
+    """Packet-level scan of a clip's video stream, without decoding"""
+    return ["-i", str(path), "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+
+
+def parse_probe(output: bytes, fps: int, path: Path) -> Tuple[int, List[int], int]:
+    """Turn probe_args output into (frame_count, keyframe indices, stream timescale)"""
+    timescale = 0
+    pts_list: List[int] = []
+    key_pts: List[int] = []
+    for line in output.decode(errors="replace").splitlines():
+        if line.startswith("#tb 0:"):
+            timescale = int(line.split("/")[-1])
+        elif line and not line.startswith("#"):
+            fields = [field.strip() for field in line.split(",")]
+            pts_list.append(int(fields[2]))
+            if not any(field.startswith("F=") for field in fields[6:]):
+                key_pts.append(int(fields[2]))
+    if not pts_list or not timescale:
+        raise ValueError(f"No video stream in {path}")
+    first = min(pts_list)
+    keyframes = sorted(round((pts - first) * fps / timescale) for pts in key_pts)
+    return len(pts_list), keyframes, timescale
+
+
+def probe_video(path: Path, fps: int = 16) -> Tuple[int, List[int], int]:
+    """(frame_count, keyframe indices, stream timescale) of a clip"""
+    return parse_probe(_run_ffmpeg(probe_args(path)), fps, path)
+
+
+def prepare_clips(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Copies of the chunk dicts in chunk_id order, each with "overlap" set.
+
+    The overlap with the previous chunk is taken from "overlap" when given,
+    or else from "start_frame"/"end_frame" as produced by calculate_chunks.
+    """
+    clips = [dict(chunk) for chunk in sorted(chunks, key=lambda chunk: chunk["chunk_id"])]
+    for previous, clip in zip([None] + clips, clips):
+        if "overlap" in clip:
+            continue
+        clip["overlap"] = 0
+        if previous is not None and "end_frame" in previous and "start_frame" in clip:
+            clip["overlap"] = max(0, previous["end_frame"] - clip["start_frame"])
+    return clips
+
+
+def plan_clip(clips: List[Dict[str, Any]], i: int, crossfade_frames: int,
+              window: List[Tuple[int, int, int]]) -> Tuple[List[Tuple], List[Tuple[int, int, int]]]:
+    """
+    Plan clip i, given the seam window still open from the clips before it.
+
+    Only clip i needs to be probed ("frame_count", "keyframes"); later clips
+    just need their "overlap". Returns the segments that are now complete and
+    the window left open for clip i + 1.
+    """
+    clip = clips[i]
+    n, keyframes = clip["frame_count"], clip["keyframes"]
+    if i == 0:
+        lead, head_need = 0, 0
+    elif crossfade_frames:
+        lead, head_need = 0, max(crossfade_frames, clip["overlap"])
+    else:
+        # Shared frames are dropped from the start of the later clip
+        lead = head_need = clip["overlap"]
+    tail_need = 0
+    if crossfade_frames and i + 1 < len(clips):
+        tail_need = max(crossfade_frames, clips[i + 1]["overlap"])
+    copy_start = min((k for k in keyframes if k >= head_need), default=n)
+    copy_end = n if not tail_need else max((k for k in keyframes if k <= n - tail_need), default=0)
+    if copy_start >= copy_end:
+        return [], window + [(i, lead, n)]
+    segments: List[Tuple] = []
+    if copy_start > lead:
+        window = window + [(i, lead, copy_start)]
+    if window:
+        segments.append(("encode", window))
+    segments.append(("copy", i, copy_start, copy_end))
+    return segments, [(i, copy_end, n)] if copy_end < n else []
+
+
+def plan_segments(clips: List[Dict[str, Any]], crossfade_frames: int = 0) -> List[Tuple]:
+    """
+    Split a stitch into stream-copied ranges and re-encoded seam windows.
+
+    Each clip needs "frame_count", "keyframes" and "overlap" (frames it shares
+    with the previous clip). Copied ranges run keyframe to keyframe (x264's
+    GOPs are closed, so such a range decodes on its own); everything between
+    the last keyframe before a seam and the first keyframe after it goes into
+    a window. Returns ("copy", clip_index, start, end) and
+    ("encode", [(clip_index, start, end), ...]) entries in output order.
+    """
+    segments: List[Tuple] = []
+    window: List[Tuple[int, int, int]] = []
+    for i in range(len(clips)):
+        done, window = plan_clip(clips, i, crossfade_frames, window)
+        segments += done
+    if window:
+        segments.append(("encode", window))
+    return segments
+
+
+def full_reencode_plan(clips: List[Dict[str, Any]], crossfade_frames: int) -> List[Tuple]:
+    """A single window over every clip, for when cutting at keyframes fails"""
+    return [("encode", [(i, 0 if i == 0 or crossfade_frames else clip["overlap"], clip["frame_count"])
+                        for i, clip in enumerate(clips)])]
+
+
+def segment_frames(clips: List[Dict[str, Any]], segment: Tuple, crossfade_frames: int) -> int:
+    """Frames a planned segment contributes to the output"""
+    if segment[0] == "copy":
+        return segment[3] - segment[2]
+    parts = segment[1]
+    length = sum(end - start for _, start, end in parts)
+    if crossfade_frames:
+        length -= sum(max(crossfade_frames, clips[i]["overlap"]) for i, _, _ in parts[1:])
+    return length
+
+
+def segment_args(clips: List[Dict[str, Any]], segment: Tuple, output_path: Path, fps: int,
+                 crossfade_frames: int, timescale: int) -> Optional[List[str]]:
+    """ffmpeg arguments that write one planned segment (None: a whole clip, usable as is)"""
+    if segment[0] == "copy":
+        _, i, start, end = segment
+        clip = clips[i]
+        if start == 0 and end == clip["frame_count"]:
+            return None
+        # Seeking a copy lands exactly on the keyframe; a closed GOP run is
+        # contiguous in decode order, so a packet count ends it cleanly
+        return ["-ss", f"{start / fps}", "-i", str(clip["path"]), "-map", "0:v:0",
+                "-c", "copy", "-frames:v", str(end - start), str(output_path)]
+
+    # Seam window: the clip parts joined, with shared frames dropped or blended
+    parts = segment[1]
+    inputs: List[str] = []
+    filters: List[str] = []
+    for j, (i, start, end) in enumerate(parts):
+        inputs += ["-i", str(clips[i]["path"])]
+        filters.append(f"[{j}:v]trim=start_frame={start}:end_frame={end},setpts=PTS-STARTPTS,"
+                       f"fps={fps},format=yuv420p[p{j}]")
+    if crossfade_frames:
+        label, length = "p0", parts[0][2] - parts[0][1]
+        for j, (i, start, end) in enumerate(parts[1:], start=1):
+            blend = max(crossfade_frames, clips[i]["overlap"])
+            filters.append(f"[{label}][p{j}]xfade=transition=fade:duration={blend / fps}:"
+                           f"offset={(length - blend) / fps}[x{j}]")
+            label, length = f"x{j}", length + (end - start) - blend
+    else:
+        filters.append("".join(f"[p{j}]" for j in range(len(parts))) + f"concat=n={len(parts)}:v=1:a=0[x]")
+        label = "x"
+    return inputs + [
+        "-filter_complex", ";".join(filters), "-map", f"[{label}]",
+        "-frames:v", str(segment_frames(clips, segment, crossfade_frames)),
+        "-c:v", "libx264", "-crf", str(SEAM_CRF), "-pix_fmt", "yuv420p", "-r", str(fps),
+        "-video_track_timescale", str(timescale), str(output_path)
+    ]
+
+
+def write_concat_list(files: List[Path], concat_file: Path):
+    with open(concat_file, "w") as f:
+        for path in files:
+            # Escape single quotes for the concat demuxer
+            escaped = str(Path(path).resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def concat_args(concat_file: Path, output_path: Path, movflags: str = "+faststart") -> List[str]:
+    """Stream-copy the files in a concat list into one MP4"""
+    return ["-f", "concat", "-safe", "0", "-i", str(concat_file), "-map", "0:v:0", "-c", "copy",
+            "-movflags", movflags, "-f", "mp4", str(output_path)]
+
+
+def _write_segments(clips: List[Dict[str, Any]], segments: List[Tuple], temp_path: Path, fps: int,
+                    crossfade_frames: int, timescale: int) -> List[Path]:
+    """Produce one file per planned segment; whole-clip copies use the clip itself"""
+    files: List[Path] = []
+    for index, segment in enumerate(segments):
+        segment_path = temp_path / f"segment_{index:03d}.mp4"
+        args = segment_args(clips, segment, segment_path, fps, crossfade_frames, timescale)
+        if args is None:
+            files.append(Path(clips[segment[1]]["path"]))
+            continue
+        _run_ffmpeg(args)
+        files.append(segment_path)
+    return files
+
+
+def stitch_chunks(chunks: List[Dict[str, Any]], output_path: Path, fps: int = 16,
+                  crossfade_frames: int = CROSSFADE_FRAMES) -> Optional[Path]:
+    """
+    Join chunk videos, removing (or crossfading) the frames neighbouring chunks share.
+
+    Each chunk dict needs "path" and "chunk_id" (see prepare_clips for the
+    overlap). Only a short window around each seam is re-encoded, from the
+    last keyframe before it to the first keyframe after it; everything else
+    is stream-copied. Intermediate files and the concat list live in a
+    private temp dir, so concurrent jobs never collide.
+    """
+    if not chunks:
         return None
-    
-    if len(video_paths) == 1:
-        # Just copy the single video
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        subprocess.run(["cp", video_paths[0], str(output_path)], check=True)
-        return output_path
-    
-    # Create a file list for FFmpeg concat
-    concat_file = output_path.parent / "concat_list.txt"
-    with open(concat_file, 'w') as f:
-        for video_path in video_paths:
-            # Use absolute path and escape single quotes
-            abs_path = Path(video_path).resolve()
-            f.write(f"file '{abs_path}'\n")
-    
-    # Use FFmpeg to concatenate
+    output_path = Path(output_path)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    
+    clips = prepare_clips(chunks)
+    partial_path = output_path.with_name(output_path.name + ".part")
+
+    with metrics.span("stitch", chunks=len(clips)):
+        try:
+            if len(clips) == 1:
+                shutil.copyfile(clips[0]["path"], partial_path)
+                os.replace(partial_path, output_path)
+                return ensure_faststart(output_path)
+            with tempfile.TemporaryDirectory(prefix="stitch_") as temp_dir:
+                temp_path = Path(temp_dir)
+                timescale = 0
+                for clip in clips:
+                    clip["frame_count"], clip["keyframes"], timescale = probe_video(clip["path"], fps)
+                if crossfade_frames:
+                    # xfade needs every part at least as long as the blend on either side
+                    crossfade_frames = min(crossfade_frames, min(clip["frame_count"] for clip in clips) // 2)
+                segments = plan_segments(clips, crossfade_frames)
+                try:
+                    files = _write_segments(clips, segments, temp_path, fps, crossfade_frames, timescale)
+                except subprocess.CalledProcessError as e:
+                    # Odd GOP structure or mixed codecs: re-encode the whole thing in one pass
+                    logger.debug("Seam-window stitch failed (%s); re-encoding all %s chunks",
+                                 e.stderr.decode(errors='replace').strip(), len(clips))
+                    segments = full_reencode_plan(clips, crossfade_frames)
+                    files = _write_segments(clips, segments, temp_path, fps, crossfade_frames, timescale)
+                copied = sum(segment[3] - segment[2] for segment in segments if segment[0] == "copy")
+                total = sum(clip["frame_count"] for clip in clips)
+                logger.debug("Stitching %s chunks from %s segments (%s/%s frames stream-copied)",
+                             len(clips), len(segments), copied, total)
+
+                concat_file = temp_path / "concat_list.txt"
+                write_concat_list(files, concat_file)
+                _run_ffmpeg(concat_args(concat_file, partial_path))
+            os.replace(partial_path, output_path)
+            return output_path
+        except subprocess.CalledProcessError as e:
+            logger.error("FFmpeg error: %s", e.stderr.decode(errors='replace') if e.stderr else 'Unknown error')
+        except (OSError, ValueError) as e:
+            logger.error("Stitch error: %s", e)
+    partial_path.unlink(missing_ok=True)
+    return None
+
+
+def moov_first(path: Path) -> Optional[bool]:
+    """Whether an MP4's moov atom precedes its media data (None if neither is found)"""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            size, box_type = int.from_bytes(header[:4], "big"), header[4:8]
+            if box_type == b"moov":
+                return True
+            if box_type == b"mdat":
+                return False
+            if size == 1:
+                size = int.from_bytes(f.read(8), "big") - 8
+            elif size == 0:
+                return None
+            f.seek(size - 8, os.SEEK_CUR)
+
+
+def ensure_faststart(path: Path) -> Path:
+    """
+    Move the moov atom to the front if it trails the media data.
+
+    Players can then start (and seek with range requests) before the whole
+    file has downloaded. A stream-copy remux, so it costs one file copy.
+    """
+    path = Path(path)
     try:
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-f", "concat",
-                "-safe", "0",
-                "-i", str(concat_file),
-                "-c", "copy",
-                "-y",  # Overwrite output file
-                str(output_path)
-            ],
-            check=True,
-            capture_output=True
-        )
-        
-        # Clean up concat file
-        concat_file.unlink()
-        
-        return output_path
+        if moov_first(path) is not False:
+            return path
+        partial_path = path.with_name(path.name + ".part")
+        _run_ffmpeg(["-i", str(path), "-map", "0", "-c", "copy", "-movflags", "+faststart",
+                     "-f", "mp4", str(partial_path)])
+        os.replace(partial_path, path)
+        logger.debug("Moved moov atom to the front of %s", path.name)
     except subprocess.CalledProcessError as e:
-        print(f"FFmpeg error: {e.stderr.decode() if e.stderr else 'Unknown error'}")
-        return None
+        logger.debug("faststart remux of %s failed: %s", path.name, e.stderr.decode(errors='replace').strip())
+        path.with_name(path.name + ".part").unlink(missing_ok=True)
+    except OSError as e:
+        logger.debug("faststart check of %s failed: %s", path.name, e)
+    return path
+
+
+def stitch_videos(video_paths: List[str], output_path: Path, overlap_frames: int = 0) -> Optional[Path]:
+    """
+    Stitch video clips together in the given order using FFmpeg.
+
+    overlap_frames is how many leading frames of each clip repeat the end of
+    the one before; those are dropped at the seams.
+    """
+    chunks = [
+        {"chunk_id": chunk_id, "path": path, "overlap": overlap_frames if chunk_id else 0}
+        for chunk_id, path in enumerate(video_paths)
+    ]
+    return stitch_chunks(chunks, output_path, crossfade_frames=0)
 
+
+def encode_frame_stream(frames: Iterable[Optional[bytes]], output_path: Path, fps: int = 16) -> Optional[Path]:
+    """
+    Encode PNG frames into an H.264 MP4 by piping them into ffmpeg's stdin.
+
+    Frames are consumed as they are produced (e.g. while still downloading),
+    so encoding overlaps the transfer and nothing is written to a temp dir.
+    A None entry (a failed frame) is filled with the nearest earlier frame, or
+    the first good one, so the clip keeps its length and timing. If the frame
+    source raises, ffmpeg is stopped, the partial file removed and the error
+    re-raised.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Encode to a sibling temp name and rename, so readers never see a partial file
+    partial_path = output_path.with_name(output_path.name + ".part")
+    
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-loglevel", "error",
+        "-f", "image2pipe",
+        "-framerate", str(fps),
+        "-c:v", "png",
+        "-i", "-",
+        "-c:v", "libx264",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        "-f", "mp4",
+        str(partial_path)
+    ]
+    
+    # stderr goes to a file: a full pipe would stall ffmpeg while we block on stdin
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        frame_count = 0
+        missing = 0
+        previous: Optional[bytes] = None
+        try:
+            try:
+                for frame in frames:
+                    if frame is None:
+                        missing += 1
+                        if previous is None:
+                            # Nothing to repeat yet; the first good frame covers for it below
+                            continue
+                        frame = previous
+                    elif previous is None:
+                        # Leading gaps take the first frame that did arrive
+                        for _ in range(missing):
+                            process.stdin.write(frame)
+                            frame_count += 1
+                    process.stdin.write(frame)
+                    frame_count += 1
+                    previous = frame
+            except BrokenPipeError:
+                pass
+            except BaseException:
+                # Don't let ffmpeg finish a truncated video
+                process.kill()
+                raise
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                process.wait()
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+        
+        if missing and frame_count:
+            logger.warning("Filled %s missing frame(s) of %s with a neighbouring frame", missing, frame_count)
+        if process.returncode != 0 or frame_count == 0:
+            stderr_file.seek(0)
+            error = stderr_file.read().decode(errors="replace")
+            logger.error("FFmpeg error: %s", error or 'no frames received')
+            partial_path.unlink(missing_ok=True)
+            return None
+    
+    os.replace(partial_path, output_path)
+    return output_path
@@ -0,0 +1,265 @@
+"""
+Long-lived pool of ComfyUI workers for the API process.
+
+The pool probes every worker's /system_stats and /queue on a fixed interval,
+keeping VRAM and queue metrics current. Each worker has a circuit breaker:
+after enough consecutive failures (probes or chunks) the worker is ejected
+("open"). Once a cooldown passes it is probed again ("half_open") and
+readmitted on the first success. Membership can change at runtime. Jobs only
+ever see the workers that are currently admitted, so no request has to wait
+on a dead pod or a cold start. `on_eject` lets the owner react to an ejection,
+e.g. by restarting a local ComfyUI that nothing else would bring back.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional, Dict, Any, Callable
+
+import aiohttp
+
+from .comfy_wrapper import build_async_session, DEFAULT_POOL_SIZE
+from .upload_cache import UploadCache
+
+logger = logging.getLogger(__name__)
+
+
+PROBE_INTERVAL = float(os.getenv("COMFYUI_PROBE_INTERVAL", "10"))
+PROBE_TIMEOUT = 5
+# Consecutive failures that eject a worker, and seconds before it is re-probed
+BREAKER_THRESHOLD = int(os.getenv("COMFYUI_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("COMFYUI_BREAKER_COOLDOWN", "30"))
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+@dataclass
+class ComfyWorker:
+    """Represents a ComfyUI worker instance"""
+    url: str
+    name: str
+    busy: bool = False
+    # Expected end of the running chunk (set by whichever job's dispatcher launched it)
+    busy_until: float = 0
+    # ComfyUI sends prompt events only to the client that queued the prompt
+    client_id: str = field(default_factory=lambda: f"pixeldojo-{uuid.uuid4().hex[:12]}")
+    # Content hash -> filename already in this worker's input dir
+    upload_cache: UploadCache = field(default_factory=UploadCache)
+    # Load signals for the dispatcher
+    seconds_per_frame: Optional[float] = None  # rolling average; None until a chunk is timed
+    queue_depth: int = 0  # prompts from other clients in this worker's /queue
+    queue_probed_at: float = 0
+    chunks_done: int = 0
+    chunks_failed: int = 0
+    # Model affinity: the model key (see WorkflowTemplate.model_key) last queued here
+    loaded_model: Optional[str] = None
+    model_reloads: int = 0
+    # Health, from /system_stats probes and chunk outcomes
+    circuit: str = CIRCUIT_CLOSED
+    consecutive_failures: int = 0
+    opened_at: float = 0
+    last_probe: float = 0
+    last_error: Optional[str] = None
+    probe_latency: Optional[float] = None
+    vram_total: Optional[int] = None
+    vram_free: Optional[int] = None
+    device: Optional[str] = None
+
+    @property
+    def available(self) -> bool:
+        return self.circuit != CIRCUIT_OPEN
+
+    def use_model(self, model_key: str) -> bool:
+        """Record the model a prompt queued here loads. Returns True if that means a reload."""
+        reload = self.loaded_model is not None and self.loaded_model != model_key
+        if reload:
+            self.model_reloads += 1
+            logger.debug("Worker %s switching model %s -> %s", self.name, self.loaded_model, model_key)
+        self.loaded_model = model_key
+        return reload
+
+    def status(self) -> Dict[str, Any]:
+        """Public view of the worker for the admin API"""
+        return {
+            "name": self.name,
+            "url": self.url,
+            "circuit": self.circuit,
+            "busy": self.busy,
+            "device": self.device,
+            "vram_total": self.vram_total,
+            "vram_free": self.vram_free,
+            "queue_depth": self.queue_depth,
+            "seconds_per_frame": self.seconds_per_frame,
+            "chunks_done": self.chunks_done,
+            "chunks_failed": self.chunks_failed,
+            "loaded_model": self.loaded_model,
+            "model_reloads": self.model_reloads,
+            "consecutive_failures": self.consecutive_failures,
+            "last_probe": self.last_probe,
+            "probe_latency": self.probe_latency,
+            "last_error": self.last_error,
+        }
+
+
+def parse_worker_urls(spec: Optional[str]) -> List[str]:
+    """Split a comma-separated COMFYUI_WORKERS value"""
+    return [url.strip().rstrip("/") for url in (spec or "").split(",") if url.strip()]
+
+
+class WorkerPool:
+    """Health-checked, runtime-editable set of ComfyUI workers"""
+
+    def __init__(self, urls: Optional[List[str]] = None, probe_interval: float = PROBE_INTERVAL,
+                 failure_threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        self.workers: List[ComfyWorker] = []
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.pool_size = pool_size
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._next_index = 0
+        # Called with the worker whenever its circuit opens
+        self.on_eject: Optional[Callable[[ComfyWorker], None]] = None
+        for url in urls or []:
+            self.add_worker(url)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the shared pooled session, creating it on first use"""
+        if self.session is None or self.session.closed:
+            self.session = build_async_session(self.pool_size)
+        return self.session
+
+    def add_worker(self, url: str, name: Optional[str] = None) -> ComfyWorker:
+        """Add a worker (admitted optimistically; the next probe confirms it)"""
+        url = url.rstrip("/")
+        for worker in self.workers:
+            if worker.url == url:
+                return worker
+        if name is None or self.get(name) is not None:
+            name = f"worker_{self._next_index}"
+        self._next_index += 1
+        worker = ComfyWorker(url=url, name=name)
+        self.workers.append(worker)
+        logger.info("Worker %s added (%s)", name, url)
+        return worker
+
+    def remove_worker(self, name: str) -> bool:
+        """Drop a worker; chunks already running on it are allowed to finish"""
+        worker = self.get(name)
+        if worker is None:
+            return False
+        self.workers.remove(worker)
+        logger.info("Worker %s removed (%s)", name, worker.url)
+        return True
+
+    def get(self, name: str) -> Optional[ComfyWorker]:
+        return next((w for w in self.workers if w.name == name), None)
+
+    def available(self) -> List[ComfyWorker]:
+        """Workers whose circuit lets them take work"""
+        return [w for w in self.workers if w.available]
+
+    def record_success(self, worker: ComfyWorker):
+        if worker.circuit != CIRCUIT_CLOSED:
+            logger.info("Worker %s readmitted", worker.name)
+        worker.circuit = CIRCUIT_CLOSED
+        worker.consecutive_failures = 0
+        worker.last_error = None
+
+    def record_failure(self, worker: ComfyWorker, error: str):
+        worker.consecutive_failures += 1
+        worker.last_error = error
+        if worker.circuit == CIRCUIT_HALF_OPEN or (
+                worker.circuit == CIRCUIT_CLOSED and worker.consecutive_failures >= self.failure_threshold):
+            worker.circuit = CIRCUIT_OPEN
+            worker.opened_at = time.time()
+            # It may come back restarted, with an empty input dir
+            worker.upload_cache.clear()
+            logger.warning("Worker %s ejected after %s failures: %s", worker.name, worker.consecutive_failures, error)
+            if self.on_eject is not None:
+                try:
+                    self.on_eject(worker)
+                except Exception as e:
+                    logger.debug("on_eject failed for %s: %s", worker.name, e)
+
+    async def probe(self, worker: ComfyWorker) -> bool:
+        """Refresh a worker's VRAM and queue metrics. Returns True if it answered."""
+        session = await self.get_session()
+        timeout = aiohttp.ClientTimeout(total=PROBE_TIMEOUT)
+        started = time.time()
+        try:
+            async with session.get(f"{worker.url}/system_stats", timeout=timeout) as resp:
+                if resp.status != 200:
+                    raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+                stats = await resp.json()
+            async with session.get(f"{worker.url}/queue", timeout=timeout) as resp:
+                queue = await resp.json() if resp.status == 200 else {}
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            worker.last_probe = time.time()
+            # Unreachable now, so there is no telling what its input dir holds when it answers again
+            worker.upload_cache.clear()
+            self.record_failure(worker, f"probe failed: {str(e) or type(e).__name__}")
+            return False
+
+        worker.last_probe = time.time()
+        worker.probe_latency = worker.last_probe - started
+        devices = stats.get("devices") or []
+        if devices:
+            worker.device = devices[0].get("name")
+            worker.vram_total = devices[0].get("vram_total")
+            worker.vram_free = devices[0].get("vram_free")
+        running = len(queue.get("queue_running", []))
+        pending = len(queue.get("queue_pending", []))
+        worker.queue_depth = max(0, running + pending - (1 if worker.busy else 0))
+        worker.queue_probed_at = worker.last_probe
+        self.record_success(worker)
+        return True
+
+    async def probe_all(self):
+        """Probe every worker that is admitted or whose cooldown has passed"""
+        now = time.time()
+        targets = []
+        for worker in list(self.workers):
+            if worker.circuit == CIRCUIT_OPEN:
+                if now - worker.opened_at < self.cooldown:
+                    continue
+                worker.circuit = CIRCUIT_HALF_OPEN
+            targets.append(worker)
+        await asyncio.gather(*(self.probe(w) for w in targets))
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error("Worker probe pass failed: %s", e)
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self):
+        """Begin periodic probing (call from inside the running event loop)"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": [w.status() for w in self.workers],
+            "available": len(self.available()),
+            "total": len(self.workers),
+            "model_reloads": sum(w.model_reloads for w in self.workers),
+        }
@@ -0,0 +1,207 @@
+"""
+Parsed ComfyUI workflow templates.
+
+The workflow JSON is parsed once (and again only when the file's mtime
+changes). The node IDs behind each injection slot are recorded at load time,
+so building a per-job workflow is a two-level dict copy plus a handful of
+direct assignments, with no JSON round trip or node scan.
+"""
+
+import logging
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Wan generates at 16fps and needs a frame count of (multiple of 4) + 1
+FPS = 16
+MIN_FRAMES = 17   # ~1s
+MAX_FRAMES = 481  # ~30s
+
+# Node IDs added to a workflow in chaining mode
+CHAIN_START_NODE = "chain_start_image"
+CHAIN_LAST_FRAME_NODE = "chain_last_frame"
+CHAIN_PREVIEW_NODE = "chain_last_frame_preview"
+
+# Speed-over-quality settings applied in fast mode
+FAST_MODE_PARAMS = {
+    "width": 640,
+    "height": 384,
+    "steps": 15,
+    "cfg": 3.5,
+    "weight_dtype": "fp8_e4m3fn",
+}
+
+
+def frames_for_duration(duration_seconds: int) -> int:
+    """Frame count for a clip duration, rounded to Wan's (4k + 1) constraint"""
+    raw_frames = duration_seconds * FPS
+    frame_count = ((raw_frames // 4) * 4) + 1
+    return max(MIN_FRAMES, min(frame_count, MAX_FRAMES))
+
+
+def job_params(duration_seconds: int, fast_mode: bool = False) -> Dict[str, Any]:
+    """Slot values for a job's duration and quality mode"""
+    params = {"length": frames_for_duration(duration_seconds)}
+    if fast_mode:
+        params.update(FAST_MODE_PARAMS)
+    return params
+
+
+def _find_slots(nodes: Dict[str, Any]) -> Dict[str, List[Tuple[str, str]]]:
+    """Map each injectable parameter to the (node_id, input_name) pairs it sets"""
+    slots: Dict[str, List[Tuple[str, str]]] = {
+        "image": [], "prompt": [], "length": [], "width": [], "height": [],
+        "steps": [], "cfg": [], "weight_dtype": [],
+    }
+    for node_id, node_data in nodes.items():
+        if not isinstance(node_data, dict):
+            continue
+        class_type = node_data.get("class_type")
+        if class_type == "LoadImage":
+            slots["image"].append((node_id, "image"))
+        elif class_type == "CLIPTextEncode" and node_data.get("_meta", {}).get("title") == "Positive Prompt":
+            slots["prompt"].append((node_id, "text"))
+        elif class_type == "WanImageToVideo":
+            for name in ("length", "width", "height"):
+                slots[name].append((node_id, name))
+        elif class_type == "KSampler":
+            slots["steps"].append((node_id, "steps"))
+            slots["cfg"].append((node_id, "cfg"))
+        elif class_type == "UNETLoader":
+            slots["weight_dtype"].append((node_id, "weight_dtype"))
+    return slots
+
+
+def copy_workflow(nodes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Structural copy: new node dicts and new inputs dicts, shared leaf values.
+
+    Enough isolation for setting inputs, at a fraction of a deep copy's cost.
+    """
+    return {
+        node_id: dict(node_data, inputs=dict(node_data.get("inputs", {})))
+        if isinstance(node_data, dict) else node_data
+        for node_id, node_data in nodes.items()
+    }
+
+
+class WorkflowTemplate:
+    """A workflow JSON file, parsed once with its injection slots resolved"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._nodes: Dict[str, Any] = {}
+        self.slots: Dict[str, List[Tuple[str, str]]] = {}
+        self.nodes_by_class: Dict[str, List[str]] = {}
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Workflow not found: {self.path}")
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self.path, "r") as f:
+                nodes = json.load(f)
+            self._nodes = nodes
+            self.slots = _find_slots(nodes)
+            by_class: Dict[str, List[str]] = {}
+            for node_id, node_data in nodes.items():
+                if isinstance(node_data, dict):
+                    by_class.setdefault(node_data.get("class_type"), []).append(node_id)
+            self.nodes_by_class = by_class
+            self._mtime = mtime
+            logger.debug("Loaded workflow template %s (%s nodes, slots: %s)",
+                         self.path.name, len(nodes), ', '.join(k for k, v in self.slots.items() if v))
+
+    @property
+    def nodes(self) -> Dict[str, Any]:
+        """The parsed template (do not mutate; use render())"""
+        self._refresh()
+        return self._nodes
+
+    def class_types(self) -> Dict[str, str]:
+        """node_id -> class_type for every node in the template"""
+        return {
+            node_id: node_data.get("class_type")
+            for node_id, node_data in self.nodes.items()
+            if isinstance(node_data, dict)
+        }
+
+    def model_key(self, workflow: Dict[str, Any]) -> str:
+        """
+        The diffusion weights a workflow loads, as "unet_name:weight_dtype".
+
+        Consecutive prompts with different keys make ComfyUI swap the UNet,
+        which costs tens of seconds for the 14B model.
+        """
+        self._refresh()
+        parts = []
+        for node_id in self.nodes_by_class.get("UNETLoader", []):
+            inputs = workflow.get(node_id, {}).get("inputs", {})
+            parts.append(f"{inputs.get('unet_name')}:{inputs.get('weight_dtype', 'default')}")
+        return ",".join(parts)
+
+    def apply(self, workflow: Dict[str, Any], **params) -> Dict[str, Any]:
+        """Return a structural copy of workflow with the given slot values set (None = leave as is)"""
+        self._refresh()
+        result = copy_workflow(workflow)
+        for name, value in params.items():
+            if value is None:
+                continue
+            if name not in self.slots:
+                raise ValueError(f"Unknown workflow slot: {name}")
+            for node_id, input_name in self.slots[name]:
+                result[node_id]["inputs"][input_name] = value
+        return result
+
+    def render(self, image: Optional[str] = None, prompt: Optional[str] = None, length: Optional[int] = None,
+               width: Optional[int] = None, height: Optional[int] = None, steps: Optional[int] = None,
+               cfg: Optional[float] = None, weight_dtype: Optional[str] = None) -> Dict[str, Any]:
+        """Build a per-job workflow from the template"""
+        return self.apply(self.nodes, image=image, prompt=prompt, length=length, width=width,
+                          height=height, steps=steps, cfg=cfg, weight_dtype=weight_dtype)
+
+    def with_chain_nodes(self, workflow: Dict[str, Any], start_image: str, last_frame_index: int) -> Dict[str, Any]:
+        """
+        Copy of workflow for chaining mode.
+
+        WanImageToVideo starts from start_image (the previous chunk's last frame)
+        while CLIP vision keeps seeing the original image. The decoded frame at
+        last_frame_index is tapped into a PreviewImage node, so it shows up as an
+        `executed` output as soon as decoding finishes.
+        """
+        self._refresh()
+        wan_nodes = self.nodes_by_class.get("WanImageToVideo", [])
+        decode_nodes = self.nodes_by_class.get("VAEDecode", [])
+        if not wan_nodes or not decode_nodes:
+            raise ValueError("Chaining needs a WanImageToVideo and a VAEDecode node in the workflow")
+        result = copy_workflow(workflow)
+        result[CHAIN_START_NODE] = {
+            "class_type": "LoadImage",
+            "inputs": {"image": start_image, "upload": "image"},
+            "_meta": {"title": "Chain Start Frame"},
+        }
+        for node_id in wan_nodes:
+            result[node_id]["inputs"]["start_image"] = [CHAIN_START_NODE, 0]
+        result[CHAIN_LAST_FRAME_NODE] = {
+            "class_type": "ImageFromBatch",
+            "inputs": {"image": [decode_nodes[0], 0], "batch_index": last_frame_index, "length": 1},
+            "_meta": {"title": "Chain Last Frame"},
+        }
+        result[CHAIN_PREVIEW_NODE] = {
+            "class_type": "PreviewImage",
+            "inputs": {"images": [CHAIN_LAST_FRAME_NODE, 0]},
+            "_meta": {"title": "Chain Last Frame Preview"},
+        }
+        return result
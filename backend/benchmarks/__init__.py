@@ -0,0 +1,7 @@
+"""
+Orchestration benchmarks that need no GPU.
+
+`fake_comfyui` stands in for ComfyUI (HTTP + /ws) with configurable timings;
+`run` drives the generators or the HTTP API against it and reports latency,
+request counts and backend CPU/RSS. See the README's Benchmarks section.
+"""
@@ -0,0 +1,344 @@
+"""
+A stand-in ComfyUI server for benchmarks.
+
+Speaks the subset of ComfyUI's API the backend uses (/prompt, /history,
+/queue, /interrupt, /upload/image, /view, /system_stats and the /ws event
+stream). Prompts run one at a time from a FIFO queue, like a real instance.
+Each prompt "loads" its UNet when the model configuration changes, sleeps
+through its sampling steps while emitting progress events, and "decodes".
+It then outputs a real H.264 clip with the requested frame count, so stitching
+and faststart remuxes do real work. Clips can be padded to a target size to
+exercise download paths.
+
+Every request is counted per route; GET /benchmark/stats returns the counts
+and POST /benchmark/reset clears them.
+
+Run standalone:
+    python -m benchmarks.fake_comfyui --port 8188 --step-time 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import shutil
+import struct
+import subprocess
+import tempfile
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from aiohttp import web
+
+
+@dataclass
+class FakeConfig:
+    step_time: float = 0.05  # seconds per sampling step
+    steps: Optional[int] = None  # None = the workflow's KSampler steps
+    load_time: float = 1.0  # seconds to load a model configuration that isn't resident
+    decode_time: float = 0.2  # VAE decode
+    encode_time: float = 0.1  # VHS_VideoCombine
+    output_bytes: int = 0  # pad each output clip to at least this size (0 = as encoded)
+    width: int = 160
+    height: int = 96
+    fps: int = 16
+
+
+def nodes_of_class(workflow: Dict[str, Any], class_type: str) -> List[str]:
+    return [node_id for node_id, node in workflow.items()
+            if isinstance(node, dict) and node.get("class_type") == class_type]
+
+
+class FakeComfyUI:
+    """The fake server's state; build_app() exposes it over HTTP"""
+
+    def __init__(self, config: FakeConfig, work_dir: Path):
+        self.config = config
+        self.work_dir = Path(work_dir)
+        self.counts: Counter = Counter()
+        self.history: Dict[str, Dict[str, Any]] = {}
+        self.pending: List[Dict[str, Any]] = []
+        self.running: Optional[Dict[str, Any]] = None
+        self.clients: Dict[str, web.WebSocketResponse] = {}
+        self.loaded_model: Optional[str] = None
+        self.model_loads = 0
+        self.prompts_run = 0
+        self.uploads: Dict[str, int] = {}
+        self._number = 0
+        self._wakeup = asyncio.Event()
+        self._current: Optional[asyncio.Task] = None
+        self._clips: Dict[int, Path] = {}
+
+    # --- outputs ---
+
+    def clip_for(self, frames: int) -> Path:
+        """A cached test clip with this many frames (padded to config.output_bytes)"""
+        clip = self._clips.get(frames)
+        if clip is not None:
+            return clip
+        clip = self.work_dir / f"clip_{frames}.mp4"
+        config = self.config
+        subprocess.run([
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "lavfi", "-i", f"testsrc=size={config.width}x{config.height}:rate={config.fps}",
+            "-frames:v", str(frames), "-c:v", "libx264", "-preset", "ultrafast", "-g", str(config.fps),
+            "-pix_fmt", "yuv420p", "-movflags", "+faststart", str(clip),
+        ], check=True)
+        padding = config.output_bytes - clip.stat().st_size
+        if padding > 8:
+            # A trailing `free` box keeps the file a valid MP4
+            with open(clip, "ab") as f:
+                f.write(struct.pack(">I4s", padding, b"free"))
+                f.write(b"\0" * (padding - 8))
+        self._clips[frames] = clip
+        return clip
+
+    def frame_png(self) -> Path:
+        png = self.work_dir / "frame.png"
+        if not png.exists():
+            subprocess.run([
+                "ffmpeg", "-y", "-v", "error", "-f", "lavfi",
+                "-i", f"testsrc=size={self.config.width}x{self.config.height}",
+                "-frames:v", "1", str(png),
+            ], check=True)
+        return png
+
+    # --- execution ---
+
+    async def send(self, client_id: Optional[str], event_type: str, data: Dict[str, Any]):
+        ws = self.clients.get(client_id)
+        if ws is None or ws.closed:
+            return
+        try:
+            await ws.send_str(json.dumps({"type": event_type, "data": data}))
+        except ConnectionError:
+            pass
+
+    async def execute(self, item: Dict[str, Any]):
+        prompt_id, client_id, workflow = item["prompt_id"], item["client_id"], item["prompt"]
+        config = self.config
+        await self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+
+        for node_id in nodes_of_class(workflow, "UNETLoader"):
+            inputs = workflow[node_id].get("inputs", {})
+            model = f"{inputs.get('unet_name')}:{inputs.get('weight_dtype', 'default')}"
+            await self.send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+            if model != self.loaded_model:
+                self.model_loads += 1
+                self.loaded_model = model
+                await asyncio.sleep(config.load_time)
+
+        for node_id in nodes_of_class(workflow, "KSampler"):
+            steps = config.steps or int(workflow[node_id].get("inputs", {}).get("steps", 20))
+            await self.send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+            for step in range(1, steps + 1):
+                await asyncio.sleep(config.step_time)
+                await self.send(client_id, "progress",
+                                {"value": step, "max": steps, "node": node_id, "prompt_id": prompt_id})
+
+        outputs: Dict[str, Any] = {}
+        for node_id in nodes_of_class(workflow, "VAEDecode"):
+            await self.send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+            await asyncio.sleep(config.decode_time)
+        if "chain_last_frame_preview" in workflow:
+            # Chaining mode taps the decoded last frame into a preview node
+            output = {"images": [{"filename": f"last_{prompt_id}.png", "subfolder": "", "type": "temp"}]}
+            outputs["chain_last_frame_preview"] = output
+            await self.send(client_id, "executed",
+                            {"node": "chain_last_frame_preview", "output": output, "prompt_id": prompt_id})
+
+        frames = 81
+        for node_id in nodes_of_class(workflow, "WanImageToVideo"):
+            frames = int(workflow[node_id].get("inputs", {}).get("length", frames))
+        for node_id in nodes_of_class(workflow, "VHS_VideoCombine") or ["video"]:
+            await self.send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+            await asyncio.sleep(config.encode_time)
+            await asyncio.to_thread(self.clip_for, frames)
+            output = {"gifs": [{"filename": f"clip_{frames}.mp4", "subfolder": "", "type": "output"}]}
+            outputs[node_id] = output
+            await self.send(client_id, "executed", {"node": node_id, "output": output, "prompt_id": prompt_id})
+
+        self.history[prompt_id] = {"prompt": [item["number"], prompt_id, workflow, {}, []], "outputs": outputs,
+                                   "status": {"status_str": "success", "completed": True}}
+        self.prompts_run += 1
+        await self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    async def run_queue(self):
+        while True:
+            while not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            item = self.running = self.pending.pop(0)
+            self._current = asyncio.create_task(self.execute(item))
+            try:
+                await self._current
+            except asyncio.CancelledError:
+                if not self._current.cancelled():
+                    raise
+                self.history[item["prompt_id"]] = {"outputs": {}, "status": {"status_str": "error",
+                                                                              "completed": False}}
+                await self.send(item["client_id"], "execution_interrupted", {"prompt_id": item["prompt_id"]})
+            finally:
+                self.running = None
+                self._current = None
+
+    # --- HTTP ---
+
+    def queue_entry(self, item: Dict[str, Any]) -> List[Any]:
+        return [item["number"], item["prompt_id"], {}, {"client_id": item["client_id"]}, []]
+
+    async def handle_prompt(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        workflow = body.get("prompt")
+        if not isinstance(workflow, dict):
+            return web.json_response({"error": "no prompt", "node_errors": {}}, status=400)
+        self._number += 1
+        prompt_id = str(uuid.uuid4())
+        self.pending.append({"prompt_id": prompt_id, "client_id": body.get("client_id"),
+                             "prompt": workflow, "number": self._number})
+        self._wakeup.set()
+        return web.json_response({"prompt_id": prompt_id, "number": self._number, "node_errors": {}})
+
+    async def handle_history(self, request: web.Request) -> web.Response:
+        prompt_id = request.match_info["prompt_id"]
+        entry = self.history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry else {})
+
+    async def handle_queue(self, request: web.Request) -> web.Response:
+        if request.method == "POST":
+            body = await request.json()
+            drop = set(body.get("delete", []))
+            self.pending = [item for item in self.pending if item["prompt_id"] not in drop]
+            if body.get("clear"):
+                self.pending = []
+            return web.json_response({})
+        return web.json_response({
+            "queue_running": [self.queue_entry(self.running)] if self.running else [],
+            "queue_pending": [self.queue_entry(item) for item in self.pending],
+        })
+
+    async def handle_interrupt(self, request: web.Request) -> web.Response:
+        if self._current is not None:
+            self._current.cancel()
+        return web.json_response({})
+
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        image = form["image"]
+        self.uploads[image.filename] = len(image.file.read())
+        return web.json_response({"name": image.filename, "subfolder": "", "type": "input"})
+
+    async def handle_view(self, request: web.Request) -> web.StreamResponse:
+        filename = request.query.get("filename", "")
+        if filename.endswith(".png"):
+            return web.FileResponse(await asyncio.to_thread(self.frame_png))
+        if filename.startswith("clip_") and filename.endswith(".mp4"):
+            try:
+                return web.FileResponse(await asyncio.to_thread(self.clip_for, int(filename[5:-4])))
+            except ValueError:
+                pass
+        raise web.HTTPNotFound()
+
+    async def handle_system_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "system": {"os": "fake", "comfyui_version": "benchmark"},
+            "devices": [{"name": "cuda:0 Fake GPU", "type": "cuda",
+                         "vram_total": 48 * 2 ** 30, "vram_free": 40 * 2 ** 30}],
+        })
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        # Like ComfyUI, a reconnecting client replaces its previous socket
+        self.clients[client_id] = ws
+        await ws.send_str(json.dumps({"type": "status", "data": {"sid": client_id, "status": {
+            "exec_info": {"queue_remaining": len(self.pending)}}}}))
+        async for _ in ws:
+            pass
+        if self.clients.get(client_id) is ws:
+            del self.clients[client_id]
+        return ws
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "requests": dict(self.counts),
+            "prompts_run": self.prompts_run,
+            "model_loads": self.model_loads,
+            "uploads": len(self.uploads),
+            "queued": len(self.pending) + (1 if self.running else 0),
+        })
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.counts.clear()
+        self.prompts_run = 0
+        self.model_loads = 0
+        self.uploads.clear()
+        return web.json_response({})
+
+    @web.middleware
+    async def count_requests(self, request: web.Request, handler):
+        route = request.match_info.route.resource
+        path = route.canonical if route is not None else request.path
+        if not path.startswith("/benchmark"):
+            self.counts[f"{request.method} {path}"] += 1
+        return await handler(request)
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.count_requests], client_max_size=64 * 2 ** 20)
+        app.add_routes([
+            web.post("/prompt", self.handle_prompt),
+            web.get("/history/{prompt_id}", self.handle_history),
+            web.get("/queue", self.handle_queue),
+            web.post("/queue", self.handle_queue),
+            web.post("/interrupt", self.handle_interrupt),
+            web.post("/upload/image", self.handle_upload),
+            web.get("/view", self.handle_view),
+            web.get("/system_stats", self.handle_system_stats),
+            web.get("/ws", self.handle_ws),
+            web.get("/benchmark/stats", self.handle_stats),
+            web.post("/benchmark/reset", self.handle_reset),
+        ])
+
+        async def start_queue(app):
+            app["queue_task"] = asyncio.create_task(self.run_queue())
+
+        async def stop_queue(app):
+            app["queue_task"].cancel()
+            for ws in list(self.clients.values()):
+                await ws.close()
+
+        app.on_startup.append(start_queue)
+        app.on_shutdown.append(stop_queue)
+        return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fake ComfyUI server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--step-time", type=float, default=FakeConfig.step_time)
+    parser.add_argument("--steps", type=int, default=None, help="override the workflow's sampling steps")
+    parser.add_argument("--load-time", type=float, default=FakeConfig.load_time)
+    parser.add_argument("--decode-time", type=float, default=FakeConfig.decode_time)
+    parser.add_argument("--encode-time", type=float, default=FakeConfig.encode_time)
+    parser.add_argument("--output-bytes", type=int, default=0, help="pad output clips to this size")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = FakeConfig(step_time=args.step_time, steps=args.steps, load_time=args.load_time,
+                        decode_time=args.decode_time, encode_time=args.encode_time,
+                        output_bytes=args.output_bytes)
+    work_dir = Path(tempfile.mkdtemp(prefix="fake_comfyui_"))
+    try:
+        web.run_app(FakeComfyUI(config, work_dir).build_app(), host=args.host, port=args.port, print=None)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Randomised check of the chunk planner.
+
+Plans random clip lengths against random MAX_CHUNK_FRAMES values and worker
+sets, and asserts every plan is usable: at least one chunk, each 4k + 1
+frames and no longer than the max (unless the clip is too short to split),
+and the chunks, less the frame each seam shares, add up to the clip.
+
+    python -m benchmarks.planner_check --cases 5000 --seed 1
+"""
+
+import argparse
+import random
+import sys
+
+from app.chunk_planner import WorkerEstimate, plan_chunks
+from app.workflow_template import FPS, MAX_FRAMES, MIN_FRAMES
+
+
+def check_plan(total_frames: int, max_chunk_frames: int, workers, chained: bool) -> None:
+    plan = plan_chunks(total_frames, workers, overhead=15, max_chunk_frames=max_chunk_frames, chained=chained)
+    counts = plan.frame_counts
+    context = f"total={total_frames} max={max_chunk_frames} workers={len(workers)} chained={chained}: {counts}"
+    assert counts, f"empty plan ({context})"
+    assert all(count % 4 == 1 for count in counts), f"chunk not 4k + 1 frames ({context})"
+    assert sum(counts) - (len(counts) - 1) == total_frames, f"chunks do not cover the clip ({context})"
+    if len(counts) > 1:
+        longest = max(4 * ((max_chunk_frames - 1) // 4) + 1, MIN_FRAMES)
+        assert max(counts) <= longest, f"chunk over the max ({context})"
+    assigned = sorted(chunk_id for ids in plan.assignment.values() for chunk_id in ids)
+    assert assigned == list(range(len(counts))), f"chunks not all assigned ({context})"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fuzz the parallel chunk planner")
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    for _ in range(args.cases):
+        total_frames = 4 * rng.randint(0, (MAX_FRAMES - 1) // 4) + 1
+        max_chunk_frames = rng.choice([rng.randint(1, 2 * MIN_FRAMES), rng.randint(1, MAX_FRAMES)])
+        workers = [WorkerEstimate(f"w{i}", rng.uniform(0.5, 6.0), rng.choice([0.0, rng.uniform(0, 120)]))
+                   for i in range(rng.randint(1, 6))]
+        check_plan(total_frames, max_chunk_frames, workers, rng.random() < 0.3)
+    # The durations the API accepts, at the default and a small max
+    for seconds in range(1, MAX_FRAMES // FPS + 1):
+        for max_chunk_frames in (17, 21, 33, 81):
+            check_plan(seconds * FPS + 1, max_chunk_frames, [WorkerEstimate("a", 3.0)], False)
+    print(f"{args.cases} random plans OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,510 @@
+"""
+Latency/throughput benchmarks against fake ComfyUI servers.
+
+Starts one fake_comfyui process per worker, runs N jobs at a given
+concurrency through one of the drivers and reports:
+- p50/p95 job latency and throughput
+- ComfyUI requests per job, by route
+- the backend process's CPU time and peak RSS
+
+The drivers:
+    local     LocalComfyUIGenerator.agenerate in this process (--sync: generate() in threads)
+    parallel  ParallelVideoGenerator.generate_parallel in this process
+    api       uvicorn app.main:app as a subprocess; each job is POST /generate ->
+              /status/{id}/stream (or polling) -> GET /video/{id}
+
+Examples (from backend/):
+    python -m benchmarks.run local --jobs 20 --concurrency 4
+    python -m benchmarks.run parallel --workers 3 --jobs 4 --duration 15
+    python -m benchmarks.run api --jobs 50 --concurrency 50 --json results.json
+
+CPU and RSS cover the backend process only, not the ffmpeg subprocesses it starts.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Tuple
+
+import aiohttp
+import requests
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+WORKFLOW_PATH = BACKEND_DIR / "workflows" / "video_generation.json"
+
+
+@dataclass
+class JobResult:
+    latency: float
+    ok: bool
+    error: Optional[str] = None
+    api_requests: int = 0
+    progress_updates: int = 0
+
+
+@dataclass
+class ResourceUsage:
+    cpu_seconds: Optional[float] = None
+    peak_rss: Optional[int] = None
+
+
+def process_usage(pid: int) -> Optional[Tuple[float, int]]:
+    """(CPU seconds, RSS bytes) of a process, or None where it can't be read"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            cpu = process.cpu_times()
+            return cpu.user + cpu.system, process.memory_info().rss
+        except psutil.Error:
+            return None
+    # Linux without psutil
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return (int(fields[11]) + int(fields[12])) / ticks, resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class ResourceMonitor:
+    """Samples a process's RSS in the background and measures the CPU it uses meanwhile"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self._start_cpu: Optional[float] = None
+        self._last: Optional[Tuple[float, int]] = None
+        self._peak_rss = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        usage = process_usage(self.pid)
+        if usage is not None:
+            self._last = usage
+            self._peak_rss = max(self._peak_rss, usage[1])
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._sample()
+        self._start_cpu = self._last[0] if self._last else None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> ResourceUsage:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        if self._last is None or self._start_cpu is None:
+            return ResourceUsage()
+        return ResourceUsage(self._last[0] - self._start_cpu, self._peak_rss)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_http(url: str, timeout: float = 30, process: Optional[subprocess.Popen] = None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before answering")
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+class FakeServers:
+    """fake_comfyui subprocesses, one per worker"""
+
+    def __init__(self, count: int, fake_args: List[str], log_dir: Path):
+        self.urls: List[str] = []
+        self.processes: List[subprocess.Popen] = []
+        self.count = count
+        self.fake_args = fake_args
+        self.log_dir = log_dir
+
+    def __enter__(self) -> "FakeServers":
+        for i in range(self.count):
+            port = free_port()
+            log = open(self.log_dir / f"fake_comfyui_{i}.log", "w")
+            self.processes.append(subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.fake_comfyui", "--port", str(port), *self.fake_args],
+                cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT))
+            self.urls.append(f"http://127.0.0.1:{port}")
+        for url, process in zip(self.urls, self.processes):
+            wait_for_http(f"{url}/system_stats", process=process)
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def reset(self):
+        for url in self.urls:
+            requests.post(f"{url}/benchmark/reset", timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        """Request counts and prompt/model-load totals summed over all servers"""
+        totals: Dict[str, Any] = {"requests": {}, "prompts_run": 0, "model_loads": 0, "uploads": 0}
+        for url in self.urls:
+            stats = requests.get(f"{url}/benchmark/stats", timeout=5).json()
+            for route, count in stats["requests"].items():
+                totals["requests"][route] = totals["requests"].get(route, 0) + count
+            for key in ("prompts_run", "model_loads", "uploads"):
+                totals[key] += stats[key]
+        return totals
+
+
+def make_images(work_dir: Path, count: int, unique: bool) -> List[Path]:
+    """Input PNGs; with unique, every job gets different bytes (defeats upload dedup)"""
+    base = work_dir / "input.png"
+    subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=64x64",
+                    "-frames:v", "1", str(base)], check=True)
+    if not unique:
+        return [base] * count
+    images = []
+    data = base.read_bytes()
+    for i in range(count):
+        # Bytes after IEND are ignored by decoders but change the content hash
+        path = work_dir / f"input_{i}.png"
+        path.write_bytes(data + f"job {i}".encode())
+        images.append(path)
+    return images
+
+
+async def run_jobs(count: int, concurrency: int, job) -> List[JobResult]:
+    """Run job(i) -> JobResult for i in range(count), at most concurrency at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(i: int) -> JobResult:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await job(i)
+            except Exception as e:
+                return JobResult(time.perf_counter() - started, False, f"{type(e).__name__}: {e}")
+            result.latency = time.perf_counter() - started
+            return result
+
+    return await asyncio.gather(*(limited(i) for i in range(count)))
+
+
+# --- drivers ---
+
+async def drive_local(args, servers: FakeServers, images: List[Path], out_dir: Path) -> List[JobResult]:
+    # Read at construction time
+    os.environ["COMFYUI_URL"] = servers.urls[0]
+    os.environ["PIXELDOJO_RESULT_CACHE_MB"] = "0"
+    from app.generator import LocalComfyUIGenerator
+
+    generator = LocalComfyUIGenerator(comfyui_path=str(out_dir / "comfyui"), workflow_path=str(WORKFLOW_PATH))
+    generator.output_dir = out_dir
+
+    async def job(i: int) -> JobResult:
+        updates = []
+        kwargs = dict(fast_mode=args.fast_mode, progress_callback=updates.append)
+        if args.sync:
+            path = await asyncio.to_thread(generator.generate, str(images[i]), f"benchmark job {i}",
+                                           args.duration, **kwargs)
+        else:
+            path = await generator.agenerate(str(images[i]), f"benchmark job {i}", args.duration, **kwargs)
+        return JobResult(0, bool(path), None if path else "no video", progress_updates=len(updates))
+
+    try:
+        return await run_jobs(args.jobs, args.concurrency, job)
+    finally:
+        await generator.aclose()
+        generator.comfy.tracker.stop()
+
+
+async def drive_parallel(args, servers: FakeServers, images: List[Path], out_dir: Path) -> List[JobResult]:
+    from app.parallel_generator import ParallelVideoGenerator
+
+    generator = ParallelVideoGenerator(workers=servers.urls, workflow_path=str(WORKFLOW_PATH))
+    generator.output_dir = out_dir
+
+    async def job(i: int) -> JobResult:
+        updates = []
+        path = await generator.generate_parallel(str(images[i]), f"benchmark job {i}", args.duration,
+                                                 fast_mode=args.fast_mode, progress_callback=updates.append)
+        return JobResult(0, bool(path), None if path else "no video", progress_updates=len(updates))
+
+    try:
+        return await run_jobs(args.jobs, args.concurrency, job)
+    finally:
+        await generator.close()
+
+
+async def follow_stream(session: aiohttp.ClientSession, api: str, job_id: str) -> Tuple[Dict[str, Any], int]:
+    """Read /status/{id}/stream until the job finishes; returns (final status, events seen)"""
+    events = 0
+    async with session.get(f"{api}/status/{job_id}/stream", timeout=aiohttp.ClientTimeout(total=None)) as resp:
+        resp.raise_for_status()
+        async for line in resp.content:
+            if not line.startswith(b"data:"):
+                continue
+            events += 1
+            status = json.loads(line[5:])
+            if status.get("status") in ("completed", "failed"):
+                return status, events
+    raise RuntimeError("status stream ended before the job finished")
+
+
+async def follow_polling(session: aiohttp.ClientSession, api: str, job_id: str,
+                         interval: float) -> Tuple[Dict[str, Any], int]:
+    polls = 0
+    while True:
+        polls += 1
+        async with session.get(f"{api}/status/{job_id}") as resp:
+            resp.raise_for_status()
+            status = await resp.json()
+        if status.get("status") in ("completed", "failed"):
+            return status, polls
+        await asyncio.sleep(interval)
+
+
+async def drive_api(args, servers: FakeServers, images: List[Path], out_dir: Path) -> Tuple[List[JobResult], ResourceUsage]:
+    port = free_port()
+    api = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        COMFYUI_URL=servers.urls[0],
+        COMFYUI_WORKERS=",".join(servers.urls) if args.workers > 1 else "",
+        PIXELDOJO_JOB_DB=str(out_dir / "jobs.db"),
+        PIXELDOJO_RESULT_CACHE_MB="0",
+        PIXELDOJO_CONCURRENCY=str(args.api_concurrency or args.concurrency),
+        PIXELDOJO_MAX_QUEUE=str(max(50, args.jobs)),
+    )
+    log_path = out_dir / "api.log"
+    # cwd is the scratch dir, so uploads/ lands there
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--app-dir", str(BACKEND_DIR),
+             "--port", str(port), "--log-level", "warning"],
+            cwd=out_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    video_paths: List[str] = []
+    try:
+        wait_for_http(f"{api}/health", process=process)
+        monitor = ResourceMonitor(process.pid)
+        monitor.start()
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def job(i: int) -> JobResult:
+                form = aiohttp.FormData()
+                form.add_field("image", images[i].read_bytes(), filename=images[i].name, content_type="image/png")
+                form.add_field("prompt", f"benchmark job {i}")
+                form.add_field("duration", str(args.duration))
+                form.add_field("fast_mode", "true" if args.fast_mode else "false")
+                async with session.post(f"{api}/generate", data=form) as resp:
+                    body = await resp.json()
+                    if resp.status != 200:
+                        return JobResult(0, False, f"HTTP {resp.status}: {body.get('detail')}", api_requests=1)
+                job_id = body["job_id"]
+                if args.poll_interval:
+                    status, requests_made = await follow_polling(session, api, job_id, args.poll_interval)
+                else:
+                    # One long-lived request, however many events it carries
+                    status, _ = await follow_stream(session, api, job_id)
+                    requests_made = 1
+                if status["status"] != "completed":
+                    return JobResult(0, False, status.get("message"), api_requests=requests_made + 1)
+                if status.get("video_path"):
+                    video_paths.append(status["video_path"])
+                async with session.get(f"{api}/video/{job_id}") as resp:
+                    resp.raise_for_status()
+                    async for _ in resp.content.iter_chunked(256 * 1024):
+                        pass
+                return JobResult(0, True, api_requests=requests_made + 2)
+
+            results = await run_jobs(args.jobs, args.concurrency, job)
+        return results, monitor.stop()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        # The API writes into backend/outputs; don't leave benchmark videos behind
+        outputs = (BACKEND_DIR / "outputs").resolve()
+        for path in video_paths:
+            if Path(path).resolve().parent == outputs:
+                Path(path).unlink(missing_ok=True)
+
+
+# --- reporting ---
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def build_report(args, results: List[JobResult], wall: float, stats: Dict[str, Any],
+                 usage: ResourceUsage) -> Dict[str, Any]:
+    latencies = [r.latency for r in results if r.ok]
+    jobs = len(results)
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            errors[r.error or "unknown"] = errors.get(r.error or "unknown", 0) + 1
+    report = {
+        "mode": args.mode + (" (sync)" if args.mode == "local" and args.sync else ""),
+        "jobs": jobs,
+        "completed": len(latencies),
+        "failed": jobs - len(latencies),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "duration": args.duration,
+        "wall_seconds": round(wall, 3),
+        "throughput_jobs_per_min": round(60 * len(latencies) / wall, 2) if wall else None,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies) if latencies else None,
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+        },
+        "comfyui_requests_per_job": {route: round(count / jobs, 2)
+                                     for route, count in sorted(stats["requests"].items())},
+        "comfyui_requests_total_per_job": round(sum(stats["requests"].values()) / jobs, 2),
+        "prompts_run": stats["prompts_run"],
+        "model_loads": stats["model_loads"],
+        "image_uploads": stats["uploads"],
+        "backend_cpu_seconds": usage.cpu_seconds,
+        "backend_cpu_seconds_per_job": usage.cpu_seconds / jobs if usage.cpu_seconds is not None else None,
+        "backend_peak_rss_mb": round(usage.peak_rss / 2 ** 20, 1) if usage.peak_rss else None,
+    }
+    if args.mode == "api":
+        report["api_requests_per_job"] = round(sum(r.api_requests for r in results) / jobs, 2)
+    else:
+        report["progress_updates_per_job"] = round(sum(r.progress_updates for r in results) / jobs, 2)
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    def fmt(value, unit="s"):
+        return "n/a" if value is None else f"{value:.3f}{unit}"
+
+    latency = report["latency_seconds"]
+    print(f"\n== {report['mode']}: {report['jobs']} jobs x {report['duration']}s, concurrency "
+          f"{report['concurrency']}, {report['workers']} worker(s)")
+    print(f"completed {report['completed']}, failed {report['failed']} in {report['wall_seconds']:.2f}s "
+          f"({report['throughput_jobs_per_min']} jobs/min)")
+    for error, count in report["errors"].items():
+        print(f"  {count} x {error}")
+    print(f"latency  p50 {fmt(latency['p50'])}  p95 {fmt(latency['p95'])}  max {fmt(latency['max'])}  "
+          f"mean {fmt(latency['mean'])}")
+    print(f"ComfyUI requests/job: {report['comfyui_requests_total_per_job']}")
+    for route, count in report["comfyui_requests_per_job"].items():
+        print(f"  {count:8.2f}  {route}")
+    if "api_requests_per_job" in report:
+        print(f"API requests/job: {report['api_requests_per_job']}")
+    print(f"prompts run {report['prompts_run']}, model loads {report['model_loads']}, "
+          f"image uploads {report['image_uploads']}")
+    print(f"backend CPU {fmt(report['backend_cpu_seconds'])} "
+          f"({fmt(report['backend_cpu_seconds_per_job'])}/job), peak RSS "
+          f"{'n/a' if report['backend_peak_rss_mb'] is None else str(report['backend_peak_rss_mb']) + ' MB'}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark PixelDojo orchestration against fake ComfyUI servers")
+    parser.add_argument("mode", choices=("local", "parallel", "api"))
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs in flight at once")
+    parser.add_argument("--duration", type=int, default=5, help="video seconds per job")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="fake ComfyUI servers (default: 1, or 3 for parallel)")
+    parser.add_argument("--fast-mode", action="store_true")
+    parser.add_argument("--unique-images", action="store_true", help="a different input image per job")
+    parser.add_argument("--sync", action="store_true", help="local: run the blocking generate() in threads")
+    parser.add_argument("--api-concurrency", type=int, default=None,
+                        help="api: PIXELDOJO_CONCURRENCY for the server (default: --concurrency)")
+    parser.add_argument("--poll-interval", type=float, default=0,
+                        help="api: poll /status at this interval instead of following the SSE stream")
+    parser.add_argument("--step-time", type=float, default=0.02, help="fake seconds per sampling step")
+    parser.add_argument("--steps", type=int, default=None, help="fake sampling steps (default: the workflow's)")
+    parser.add_argument("--load-time", type=float, default=0.5, help="fake model load seconds")
+    parser.add_argument("--decode-time", type=float, default=0.1)
+    parser.add_argument("--encode-time", type=float, default=0.05)
+    parser.add_argument("--output-bytes", type=int, default=0, help="pad fake output clips to this size")
+    parser.add_argument("--json", type=Path, default=None, help="also write the report here")
+    args = parser.parse_args(argv)
+    if args.workers is None:
+        args.workers = 3 if args.mode == "parallel" else 1
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Drivers import the app package from backend/
+    sys.path.insert(0, str(BACKEND_DIR))
+    fake_args = ["--step-time", str(args.step_time), "--load-time", str(args.load_time),
+                 "--decode-time", str(args.decode_time), "--encode-time", str(args.encode_time),
+                 "--output-bytes", str(args.output_bytes)]
+    if args.steps:
+        fake_args += ["--steps", str(args.steps)]
+
+    work_dir = Path(tempfile.mkdtemp(prefix="pixeldojo_bench_"))
+    try:
+        images = make_images(work_dir, args.jobs, args.unique_images)
+        with FakeServers(args.workers, fake_args, work_dir) as servers:
+            servers.reset()
+            started = time.perf_counter()
+            if args.mode == "api":
+                results, usage = asyncio.run(drive_api(args, servers, images, work_dir))
+            else:
+                monitor = ResourceMonitor(os.getpid())
+                monitor.start()
+                driver = drive_local if args.mode == "local" else drive_parallel
+                results = asyncio.run(driver(args, servers, images, work_dir))
+                usage = monitor.stop()
+            wall = time.perf_counter() - started
+            report = build_report(args, results, wall, servers.stats(), usage)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.json}")
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
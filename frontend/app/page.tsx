@@ -18,13 +18,23 @@ export default function Home() {
   const [videoUrl, setVideoUrl] = useState<string | null>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
   const statusIntervalRef = useRef<NodeJS.Timeout | null>(null);
+  const statusStreamRef = useRef<EventSource | null>(null);
 
-  // Cleanup interval on unmount
+  const stopStatusUpdates = () => {
+    if (statusIntervalRef.current) {
+      clearInterval(statusIntervalRef.current);
+      statusIntervalRef.current = null;
+    }
+    if (statusStreamRef.current) {
+      statusStreamRef.current.close();
+      statusStreamRef.current = null;
+    }
+  };
+
+  // Cleanup status updates on unmount
   useEffect(() => {
     return () => {
-      if (statusIntervalRef.current) {
-        clearInterval(statusIntervalRef.current);
-      }
+      stopStatusUpdates();
     };
   }, []);
 
@@ -74,31 +84,61 @@ export default function Home() {
     }
   };
 
+  const applyStatus = (id: string, data: { status?: string; progress?: number; message?: string }) => {
+    setProgress(data.progress || 0);
+    setMessage(data.message || '');
+
+    if (data.status === 'completed') {
+      setStatus('completed');
+      setVideoUrl(`${API_URL}/video/${id}`);
+      stopStatusUpdates();
+    } else if (data.status === 'failed') {
+      setStatus('failed');
+      stopStatusUpdates();
+    }
+  };
+
   const pollStatus = async (id: string) => {
     try {
       const response = await fetch(`${API_URL}/status/${id}`);
       const data = await response.json();
-
-      setProgress(data.progress || 0);
-      setMessage(data.message || '');
-
-      if (data.status === 'completed') {
-        setStatus('completed');
-        setVideoUrl(`${API_URL}/video/${id}`);
-        if (statusIntervalRef.current) {
-          clearInterval(statusIntervalRef.current);
-        }
-      } else if (data.status === 'failed') {
-        setStatus('failed');
-        if (statusIntervalRef.current) {
-          clearInterval(statusIntervalRef.current);
-        }
-      }
+      applyStatus(id, data);
     } catch (error) {
       console.error('Error polling status:', error);
     }
   };
 
+  const startPolling = (id: string) => {
+    statusIntervalRef.current = setInterval(() => {
+      pollStatus(id);
+    }, 2000);
+
+    // Poll immediately
+    pollStatus(id);
+  };
+
+  const watchStatus = (id: string) => {
+    if (typeof EventSource === 'undefined') {
+      startPolling(id);
+      return;
+    }
+
+    // One push connection per job; fall back to polling if the stream fails
+    const stream = new EventSource(`${API_URL}/status/${id}/stream`);
+    statusStreamRef.current = stream;
+    stream.onmessage = (event) => {
+      applyStatus(id, JSON.parse(event.data));
+    };
+    stream.onerror = () => {
+      if (statusStreamRef.current !== stream) {
+        return;
+      }
+      stream.close();
+      statusStreamRef.current = null;
+      startPolling(id);
+    };
+  };
+
   const handleGenerate = async () => {
     if (!image || !prompt.trim()) {
       alert('Please select an image and enter a prompt');
@@ -122,6 +162,18 @@ export default function Home() {
         body: formData,
       });
 
+      if (response.status === 429) {
+        setStatus('failed');
+        setMessage('The generation queue is full. Please try again in a minute.');
+        return;
+      }
+
+      if (response.status === 503) {
+        setStatus('failed');
+        setMessage('The video service is starting up or temporarily unavailable. Please try again in a minute.');
+        return;
+      }
+
       if (!response.ok) {
         throw new Error('Generation failed');
       }
@@ -129,13 +181,9 @@ export default function Home() {
       const data = await response.json();
       setJobId(data.job_id);
 
-      // Start polling for status
-      statusIntervalRef.current = setInterval(() => {
-        pollStatus(data.job_id);
-      }, 2000);
-
-      // Poll immediately
-      pollStatus(data.job_id);
+      // Follow status updates
+      stopStatusUpdates();
+      watchStatus(data.job_id);
     } catch (error) {
       console.error('Error generating video:', error);
       setStatus('failed');